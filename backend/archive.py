@@ -0,0 +1,183 @@
+"""Job expiry and archival.
+
+Jobs are live while their ``status`` is open and their ``deadline`` is in
+the future. Feed queries select live jobs through ``live_query``, which
+matches the partial indexes in ``ensure_live_indexes``: those index open
+jobs only, so whatever else is left in the collection never enters them.
+
+``JobArchiver`` moves jobs whose deadline has passed into ``jobs_archive``
+in batches, keeping ``jobs`` down to the live working set. Archived jobs
+keep their ``id`` and fields and gain ``archived_at``, so they stay
+available for history.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple, Union
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from database import acquire_lease
+
+logger = logging.getLogger("wolk.archive")
+
+OPEN = "open"
+
+# Most recently closed first; `id` breaks ties
+ARCHIVE_SORT = [("deadline", -1), ("id", -1)]
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def as_utc(value: datetime) -> datetime:
+    """``value`` as an aware UTC datetime; MongoDB returns naive UTC ones"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def to_datetime(value: Union[str, date, datetime], end_of_day: bool = False) -> datetime:
+    """Parse an ISO date or datetime, as stored before dates were real dates.
+
+    A bare date means midnight UTC at its start, or with ``end_of_day`` the
+    midnight that ends it, so a deadline of "2025-03-20" lasts all that day.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        value = date.fromisoformat(value) if len(value) == 10 else datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime.combine(value + timedelta(days=1 if end_of_day else 0), time(), timezone.utc)
+    return as_utc(value)
+
+
+def live_query(now: Optional[datetime] = None, **conditions) -> Dict[str, Any]:
+    """Filter selecting live jobs, plus ``conditions``"""
+    return {"status": OPEN, "deadline": {"$gt": now or utcnow()}, **conditions}
+
+
+async def next_expiry(jobs_collection, now: Optional[datetime] = None) -> Optional[datetime]:
+    """The earliest deadline among live jobs, when the live set next shrinks without a write"""
+    job = await jobs_collection.find_one(live_query(now), {"deadline": 1, "_id": 0}, sort=[("deadline", 1)])
+    return as_utc(job["deadline"]) if job else None
+
+
+def is_live(job: Dict[str, Any], now: Optional[datetime] = None) -> bool:
+    deadline = job.get("deadline")
+    return isinstance(deadline, datetime) and as_utc(deadline) > (now or utcnow())
+
+
+async def ensure_live_indexes(jobs_collection, feed_sort: Sequence[Tuple[str, int]]):
+    """Indexes for feed queries over live jobs, and for finding expired ones"""
+    open_only = {"status": OPEN}
+    await jobs_collection.create_index(feed_sort, name="live_feed", partialFilterExpression=open_only)
+    await jobs_collection.create_index(
+        [("category", 1)] + list(feed_sort), name="live_category_feed", partialFilterExpression=open_only
+    )
+    await jobs_collection.create_index("deadline")
+
+
+async def ensure_archive_indexes(archive_collection, retention_days: float = 0):
+    await archive_collection.create_index("id", unique=True)
+    await archive_collection.create_index(ARCHIVE_SORT)
+    await archive_collection.create_index([("category", 1)] + ARCHIVE_SORT)
+    if retention_days > 0:
+        await archive_collection.create_index(
+            "archived_at", expireAfterSeconds=int(retention_days * 86400), name="archive_retention"
+        )
+
+
+class JobArchiver:
+    """Moves past-deadline jobs to the archive every ``interval`` seconds.
+
+    Each round copies up to ``batch_size`` expired jobs into the archive and
+    then deletes them from ``jobs``, repeating while full batches are found.
+    A job copied but not yet deleted when a round fails is copied again next
+    time; the archive's unique ``id`` index turns that into a no-op. Only
+    the process holding the ``archiver`` lease archives at a time.
+    """
+
+    def __init__(
+        self,
+        jobs_collection,
+        archive_collection,
+        locks_collection,
+        batch_size: int = 500,
+        interval: float = 60.0,
+        on_archived: Optional[Callable[[], Awaitable]] = None,
+    ):
+        self.jobs_collection = jobs_collection
+        self.archive_collection = archive_collection
+        self.locks_collection = locks_collection
+        self.batch_size = batch_size
+        self.interval = interval
+        # Called after each batch that removed jobs, e.g. to bump the jobs version
+        self.on_archived = on_archived
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.archived = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if await acquire_lease(self.locks_collection, "archiver", self.owner, self.interval * 0.9):
+                    await self.archive_expired()
+            except PyMongoError as e:
+                logger.warning("Archiving expired jobs failed", extra={"error": str(e)})
+            await asyncio.sleep(self.interval)
+
+    async def archive_expired(self, now: Optional[datetime] = None) -> int:
+        """Archive every job whose deadline has passed, returning how many"""
+        now = now or utcnow()
+        moved = 0
+        while True:
+            found, archived = await self.archive_batch(now)
+            moved += archived
+            if found < self.batch_size:
+                break
+        if moved:
+            logger.info("Expired jobs archived", extra={"jobs": moved})
+        return moved
+
+    async def archive_batch(self, now: datetime) -> Tuple[int, int]:
+        """Archive up to ``batch_size`` expired jobs; returns how many were found and moved"""
+        expired = {"deadline": {"$lte": now}}
+        jobs = await (
+            self.jobs_collection.find(expired).sort("deadline", 1).limit(self.batch_size).to_list(None)
+        )
+        if not jobs:
+            return 0, 0
+        for job in jobs:
+            job["archived_at"] = now
+        try:
+            await self.archive_collection.insert_many(jobs, ordered=False)
+        except BulkWriteError as e:
+            # Copied by an earlier round that failed before deleting them
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        ids = [job["_id"] for job in jobs]
+        result = await self.jobs_collection.delete_many({"_id": {"$in": ids}, **expired})
+        if result.deleted_count < len(jobs):
+            # Jobs whose deadline was extended meanwhile stay live, and only live
+            kept = await self.jobs_collection.distinct("_id", {"_id": {"$in": ids}})
+            await self.archive_collection.delete_many({"_id": {"$in": kept}})
+        self.archived += result.deleted_count
+        if result.deleted_count and self.on_archived is not None:
+            await self.on_archived()
+        return len(jobs), result.deleted_count
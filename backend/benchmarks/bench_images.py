@@ -0,0 +1,106 @@
+"""Benchmark: job card image pipeline.
+
+Serves ``--images`` generated full-size photos from a local fixture
+transport (nothing leaves the machine) and requests every card variant
+through ``ImagePipeline`` with ``--concurrency`` requests in flight: first
+cold (fetch, resize in the process pool, store), then warm (disk cache
+hits). Reports latency per pass and the bytes a card costs against the
+original.
+
+    python -m benchmarks.bench_images --images 40 --workers 2
+"""
+import argparse
+import asyncio
+import io
+import random
+import shutil
+import tempfile
+import time
+
+import httpx
+from PIL import Image, ImageFilter
+
+from benchmarks.stats import latency_summary
+from images import VARIANTS, DiskCache, ImagePipeline
+
+HOST = "images.example.test"
+
+
+def make_photo(seed: int, width: int, height: int) -> bytes:
+    """A noisy gradient JPEG at Unsplash's default quality, hard to compress like a photo"""
+    rng = random.Random(seed)
+    image = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), rng.uniform(20, 60)).convert("RGB")
+    image = Image.blend(image, noise, 0.5).filter(ImageFilter.GaussianBlur(1))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=85)
+    return output.getvalue()
+
+
+def fixture_transport(photos):
+    def handler(request):
+        photo = photos.get(request.url.path)
+        if photo is None:
+            return httpx.Response(404)
+        return httpx.Response(200, content=photo, headers={"Content-Type": "image/jpeg"})
+    return httpx.MockTransport(handler)
+
+
+async def run_pass(pipeline, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, sizes = [], []
+
+    async def one(url, variant, format):
+        async with semaphore:
+            start = time.perf_counter()
+            _, body = await pipeline.get(url, variant, format)
+            latencies.append(time.perf_counter() - start)
+            sizes.append((variant, format, len(body)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*request) for request in requests))
+    return time.perf_counter() - start, latencies, sizes
+
+
+async def main(args):
+    print(f"generating {args.images} {args.width}x{args.height} photos...")
+    photos = {f"/photo-{i}.jpg": make_photo(i, args.width, args.height) for i in range(args.images)}
+    original = sum(len(photo) for photo in photos.values()) / len(photos)
+    requests = [
+        (f"https://{HOST}{path}", variant, format)
+        for path in photos for variant in VARIANTS for format in ("webp", "jpeg")
+    ]
+    directory = tempfile.mkdtemp(prefix="wolk-bench-images-")
+    pipeline = ImagePipeline(
+        DiskCache(directory, 1024 * 1024 * 1024),
+        allowed_hosts=[HOST],
+        workers=args.workers,
+        transport=fixture_transport(photos),
+    )
+    try:
+        # Start the worker processes outside the timings
+        pipeline._get_pool().submit(int).result()
+        print(f"original: {original / 1024:,.0f} KiB on average")
+        for label in ("cold", "warm"):
+            elapsed, latencies, sizes = await run_pass(pipeline, requests, args.concurrency)
+            summary = latency_summary(latencies)
+            print(f"{label:<6} requests={len(requests):>5}  req/s={len(requests) / elapsed:>8.1f}  "
+                  f"p50={summary['p50_ms']:>7.1f}ms  p95={summary['p95_ms']:>7.1f}ms  p99={summary['p99_ms']:>7.1f}ms")
+        for variant in VARIANTS:
+            for format in ("webp", "jpeg"):
+                bodies = [size for v, f, size in sizes if v == variant and f == format]
+                average = sum(bodies) / len(bodies)
+                print(f"{variant:<6} {format:<5} {average / 1024:>7.1f} KiB  ({original / average:,.0f}x smaller)")
+    finally:
+        await pipeline.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2, help="Resize worker processes")
+    parser.add_argument("--concurrency", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
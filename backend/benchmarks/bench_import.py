@@ -0,0 +1,87 @@
+"""Benchmark: bulk job import throughput.
+
+Streams ``--rows`` synthetic listings to POST /api/jobs/import on a running
+Wolk API as NDJSON or CSV. The body is generated while it is sent, so
+neither side holds the whole upload. ``--bad-rate`` of the rows are
+invalid. Reports rows per second and the import report's counts.
+
+    python serve.py --workers 1
+    python -m benchmarks.bench_import --rows 1000000 --format ndjson
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import random
+import time
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+COLUMNS = ["id", "title", "description", "payment", "location", "employer", "category", "deadline",
+           "latitude", "longitude"]
+CATEGORIES = ["Manual Labor", "Cleaning", "Technology", "Professional Services", "Consulting", "Delivery"]
+
+
+def make_row(rng, run, i, employers, bad_rate):
+    row = {
+        "id": f"bench-{run}-{i}",
+        "title": f"Listing {i}",
+        "description": "Imported from a partner job board. " * 4,
+        "payment": round(rng.lognormvariate(4, 1), 1),
+        "location": f"City {rng.randrange(500)}",
+        "employer": f"Partner Employer {rng.randrange(employers)}",
+        "category": rng.choice(CATEGORIES),
+        "deadline": (date.today() + timedelta(days=365)).isoformat(),
+        "latitude": round(rng.uniform(-60, 70), 4),
+        "longitude": round(rng.uniform(-180, 180), 4),
+    }
+    if rng.random() < bad_rate:
+        row["payment"] = -1
+    return row
+
+
+async def body(args, run):
+    rng = random.Random(args.seed)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if args.format == "csv":
+        writer.writerow(COLUMNS)
+    for i in range(args.rows):
+        row = make_row(rng, run, i, args.employers, args.bad_rate)
+        if args.format == "csv":
+            writer.writerow([row[column] for column in COLUMNS])
+        else:
+            buffer.write(json.dumps(row, separators=(",", ":")) + "\n")
+        if buffer.tell() >= args.upload_chunk:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+async def main(args):
+    run = uuid.uuid4().hex[:8]
+    content_type = "text/csv" if args.format == "csv" else "application/x-ndjson"
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None) as client:
+        start = time.perf_counter()
+        response = await client.post("/api/jobs/import", content=body(args, run), headers={"Content-Type": content_type})
+        elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    report = response.json()
+    print(f"{args.format}: {report['rows']} rows in {elapsed:.1f}s, {report['rows'] / elapsed:,.0f} rows/s "
+          f"({report['inserted']} inserted, {report['failed']} rejected)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--employers", type=int, default=2000, help="Distinct employer names")
+    parser.add_argument("--bad-rate", type=float, default=0.01)
+    parser.add_argument("--upload-chunk", type=int, default=64 * 1024, help="Bytes per upload chunk")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+"""Benchmark: bytes per job card on the wire, before and after slimming.
+
+Renders the same feed page the way ``/api/jobs`` does for the full jobs
+(before), a ``fields=`` sparse fieldset and the ``view=card``
+representation, each sent as is and compressed as ``CompressionMiddleware``
+would (gzip, and brotli when the ``brotli`` package is installed). Reports
+bytes per page and per card, and the time compressing a page takes.
+
+Descriptions are generated at ``--description-chars`` on average, since
+real postings run longer than the sample jobs'. No database or server is
+needed.
+
+    python -m benchmarks.bench_payload --page-size 20 --description-chars 600
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+
+from compression import CompressionMiddleware, brotli
+
+WORDS = (
+    "reliable experienced flexible hours weekly payment tools provided must own transport "
+    "garden office apartment cleaning delivery translation website repair help needed urgently "
+    "team friendly remote evening weekend contract skills english estonian latvian references"
+).split()
+
+SPARSE_FIELDS = "id,title,payment,category,deadline"
+
+
+def make_jobs(server, count, description_chars, rng):
+    employers = {employer["id"]: employer for employer in server.sample_employers}
+    jobs = []
+    for i in range(count):
+        template = server.sample_jobs[i % len(server.sample_jobs)]
+        job = {key: value for key, value in template.items() if key in server.JOB_PROJECTION}
+        length = rng.randint(description_chars // 2, description_chars * 3 // 2)
+        words = []
+        while sum(len(word) + 1 for word in words) < length:
+            words.append(rng.choice(WORDS))
+        job.update(
+            id=str(uuid.UUID(int=rng.getrandbits(128))),
+            title=f"{template['title']} #{i}",
+            description=" ".join(words).capitalize() + ".",
+        )
+        # As the employer lookup leaves them
+        employer = employers[job["employer_id"]]
+        job.update(employer=employer["name"], employer_rating=employer["rating"])
+        jobs.append(job)
+    return server.with_defaults(jobs, server.JOB_DEFAULTS)
+
+
+def render(server, jobs, fields, view):
+    selected = server.job_fields(fields, view)
+    page = {"jobs": server.shape_jobs(jobs, selected, view), "next_cursor": "cursor"}
+    return server.JobsResponse(page).body
+
+
+def compress(middleware, encoding, body):
+    compressor = middleware.compressor(encoding)
+    return compressor.compress(body) + compressor.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--description-chars", type=int, default=600)
+    parser.add_argument("--rounds", type=int, default=200, help="Compressions timed per page and encoding")
+    args = parser.parse_args()
+
+    # Only the models and helpers are used; nothing connects to MongoDB
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import server
+
+    middleware = CompressionMiddleware(None)
+    jobs = make_jobs(server, args.page_size, args.description_chars, random.Random(7))
+    representations = {
+        "full": render(server, jobs, None, "full"),
+        "fields": render(server, jobs, SPARSE_FIELDS, "full"),
+        "card": render(server, jobs, None, "card"),
+    }
+    if brotli is None:
+        print("brotli is not installed; gzip only (pip install brotli)")
+
+    baseline = len(representations["full"])
+    print(f"{'representation':<16}{'encoding':<10}{'bytes/page':>12}{'bytes/card':>12}{'vs full':>9}{'us/page':>10}")
+    for name, body in representations.items():
+        for encoding in ("identity",) + middleware.encodings:
+            elapsed = 0.0
+            if encoding == "identity":
+                size = len(body)
+            else:
+                size = len(compress(middleware, encoding, body))
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    compress(middleware, encoding, body)
+                elapsed = (time.perf_counter() - start) / args.rounds
+            print(f"{name:<16}{encoding:<10}{size:>12}{size / args.page_size:>12.0f}"
+                  f"{size / baseline:>9.0%}{elapsed * 1e6:>10.0f}")
+    print(f"fields: {SPARSE_FIELDS}; card descriptions cut to {server.CARD_DESCRIPTION_CHARS} characters")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark: ranked deck latency on large job indexes.
+
+Builds ``ranking.JobIndex`` directly from synthetic jobs (no database) and
+reports, for each index size, the latency of picking a top-K deck for users
+with a swipe history, and the cost of learning from one swipe.
+
+    python -m benchmarks.bench_ranking --jobs 100000 250000 --budget-ms 25
+"""
+import argparse
+import random
+import time
+import uuid
+
+from benchmarks.stats import latency_summary
+from ranking import FeatureSpace, JobIndex, RankingEngine, UserProfile
+
+CATEGORIES = ["Manual Labor", "Cleaning", "Technology", "Professional Services", "Consulting",
+              "Delivery", "Tutoring", "Design", "Gardening", "Pet Care"]
+
+
+def make_job(rng, i):
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "category": rng.choice(CATEGORIES),
+        "payment": round(rng.lognormvariate(4, 1), 1),
+        "location": f"City {rng.randrange(500)}",
+        "employer_id": f"employer-{rng.randrange(5000)}",
+        "created_at": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}",
+    }
+
+
+def build_engine(jobs, budget):
+    engine = RankingEngine(None, None, [("created_at", -1), ("id", -1)], budget=budget)
+    engine.features = FeatureSpace()
+    engine.index = JobIndex()
+    rng = random.Random(1)
+    engine.employer_ratings = {f"employer-{i}": round(rng.uniform(3, 5), 1) for i in range(5000)}
+    for job in jobs:
+        engine._upsert(engine.index, job)
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[100000, 250000])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=500, help="Swipes per user before ranking")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=25.0)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'jobs':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'learn us':>10}{'over budget':>13}")
+    for size in args.jobs:
+        jobs = [make_job(rng, i) for i in range(size)]
+        engine = build_engine(jobs, args.budget_ms / 1000)
+
+        learn_time = 0.0
+        profiles = []
+        for _ in range(args.users):
+            profile = UserProfile()
+            liked = set(rng.sample(CATEGORIES, 3))
+            for job in rng.sample(jobs, args.history):
+                start = time.perf_counter()
+                engine._learn(profile, job["id"], "accept" if job["category"] in liked else "reject")
+                learn_time += time.perf_counter() - start
+            profiles.append(profile)
+
+        latencies = []
+        over_budget = 0
+        for profile in profiles:
+            start = time.perf_counter()
+            engine.top_k(profile, args.k)
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed)
+            over_budget += elapsed > engine.budget
+        summary = latency_summary(latencies)
+        print(
+            f"{size:>8}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}"
+            f"{summary['max_ms']:>10.2f}{learn_time / (args.users * args.history) * 1e6:>10.1f}{over_budget:>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
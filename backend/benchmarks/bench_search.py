@@ -0,0 +1,104 @@
+"""Benchmark: full-text job search latency on a large synthetic catalogue.
+
+Seeds a separate ``wolk_bench`` database with synthetic jobs (1M by default),
+builds the same weighted text index the API uses and times the search
+aggregation for a mix of common and rare terms, with and without a category
+filter, reporting latency percentiles per query.
+
+    python -m benchmarks.bench_search --jobs 1000000
+    python -m benchmarks.bench_search --skip-seed   # reuse the seeded data
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks.stats import latency_summary
+from archive import OPEN, live_query
+from search import build_search_pipeline, ensure_text_index
+
+CATEGORIES = ["Manual Labor", "Cleaning", "Technology", "Professional Services", "Consulting", "Delivery", "Gardening"]
+TITLES = [
+    "Chop Firewood", "Office Cleaning", "Website Development", "Document Translation",
+    "Marketing Consultation", "Garden Maintenance", "Furniture Assembly", "Logo Design",
+    "Grocery Delivery", "Dog Walking", "Tax Preparation", "Mobile App Bugfix",
+]
+WORDS = (
+    "urgent reliable flexible experienced weekend daily winter summer small large restaurant "
+    "office house garden react python design translate estonian english marketing strategy "
+    "cleaner driver assistant physically fit tools skills startup business professional"
+).split()
+QUERIES = ["cleaning", "react developer", "translation estonian", "firewood", "urgent weekend", "logo", "zyzzyva"]
+
+
+def synthetic_job(rng):
+    title = rng.choice(TITLES)
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "title": title,
+        "description": f"{title}. " + " ".join(rng.choices(WORDS, k=rng.randint(12, 30))),
+        "payment": round(rng.uniform(5, 250), 2),
+        "location": "Tallinn, Estonia",
+        "employer": "Bench Employer",
+        "employer_rating": round(rng.uniform(3, 5), 1),
+        "category": rng.choice(CATEGORIES),
+        "image_url": "",
+        "status": OPEN,
+        "deadline": datetime.now(timezone.utc) + timedelta(days=365),
+        "created_at": datetime(2025, rng.randint(1, 12), rng.randint(1, 28), tzinfo=timezone.utc),
+    }
+
+
+async def seed(jobs_collection, count, batch_size=10000):
+    rng = random.Random(42)
+    await jobs_collection.drop()
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        batch = [synthetic_job(rng) for _ in range(min(batch_size, count - offset))]
+        await jobs_collection.insert_many(batch, ordered=False)
+    inserted = time.perf_counter() - start
+    start = time.perf_counter()
+    await ensure_text_index(jobs_collection)
+    print(f"Seeded {count} jobs in {inserted:.1f}s, text index built in {time.perf_counter() - start:.1f}s")
+
+
+async def time_query(jobs_collection, q, category, limit, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await jobs_collection.aggregate(build_search_pipeline(q, category, limit, filters=live_query())).to_list(None)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    jobs_collection = client[args.database].jobs
+    try:
+        if not args.skip_seed:
+            await seed(jobs_collection, args.jobs)
+        for q in QUERIES:
+            for category in (None, "Technology"):
+                summary = latency_summary(await time_query(jobs_collection, q, category, args.limit, args.rounds))
+                label = f"{q!r}" + (f" in {category}" if category else "")
+                print(
+                    f"{label:<36} p50={summary['p50_ms']:>8.1f}ms  p95={summary['p95_ms']:>8.1f}ms  "
+                    f"p99={summary['p99_ms']:>8.1f}ms"
+                )
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="wolk_bench")
+    parser.add_argument("--jobs", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--skip-seed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""Benchmark: /api/stats rollups against aggregating raw history.
+
+Seeds a separate ``wolk_bench`` database with ``--days`` of synthetic
+completed payments and swipes (about ``--per-day`` of each per day), times
+``rebuild_stats``-style rollup rebuilding, then times 30 days of marketplace
+and category stats read from the rollups and computed by an aggregation
+over ``transactions`` and ``swipes``, as the endpoint would otherwise have
+to.
+
+    python -m benchmarks.bench_stats --days 365 --per-day 2000
+    python -m benchmarks.bench_stats --skip-seed   # reuse the seeded data
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from benchmarks.stats import latency_summary
+from rollups import ALL, CATEGORY, StatsRollups, day_start
+
+CATEGORIES = ["Manual Labor", "Cleaning", "Technology", "Professional Services", "Consulting", "Delivery", "Gardening"]
+
+
+async def seed(db, days, per_day, batch_size=10000):
+    rng = random.Random(42)
+    for name in ("jobs", "transactions", "swipes", "stats_daily"):
+        await db[name].drop()
+    await db.jobs.insert_many([{"id": f"job-{i}", "category": CATEGORIES[i % len(CATEGORIES)]} for i in range(1000)])
+    await db.jobs.create_index("id", unique=True)
+    await db.transactions.create_index([("status", 1), ("completed_at", 1)])
+    await db.swipes.create_index("timestamp")
+    start = time.perf_counter()
+    first = datetime.now(timezone.utc) - timedelta(days=days)
+    payments, swipes = [], []
+    for day in range(days):
+        for i in range(per_day):
+            at = first + timedelta(days=day, seconds=rng.randrange(86400))
+            job_id = f"job-{rng.randrange(1000)}"
+            user_id = f"user-{rng.randrange(10000)}"
+            swipes.append({"user_id": user_id, "job_id": job_id, "timestamp": at.isoformat(),
+                           "action": "accept" if rng.random() < 0.3 else "reject"})
+            if rng.random() < 0.3:
+                payments.append({"payment_id": f"p-{day}-{i}", "status": "completed", "user_id": user_id,
+                                 "job_id": job_id, "amount": round(rng.uniform(1, 100), 2),
+                                 "completed_at": at.isoformat()})
+        if len(swipes) >= batch_size or day == days - 1:
+            await db.swipes.insert_many(swipes, ordered=False)
+            if payments:
+                await db.transactions.insert_many(payments, ordered=False)
+            swipes, payments = [], []
+    print(f"Seeded {days} days of history in {time.perf_counter() - start:.1f}s")
+
+
+def aggregate_pipelines(first: date, category_jobs=None):
+    """The same stats computed from raw history, joined to jobs for categories"""
+    since = day_start(first).isoformat()
+    match_jobs = [
+        {"$lookup": {"from": "jobs", "localField": "job_id", "foreignField": "id", "as": "job"}},
+        {"$match": {"job.category": category_jobs}},
+    ] if category_jobs else []
+    payments = [
+        {"$match": {"status": "completed", "completed_at": {"$gte": since}}},
+        *match_jobs,
+        {"$group": {"_id": {"$substr": ["$completed_at", 0, 10]}, "payments": {"$sum": 1}, "amount": {"$sum": "$amount"}}},
+    ]
+    swipes = [
+        {"$match": {"timestamp": {"$gte": since}}},
+        *match_jobs,
+        {"$group": {
+            "_id": {"$substr": ["$timestamp", 0, 10]},
+            "accepts": {"$sum": {"$cond": [{"$eq": ["$action", "accept"]}, 1, 0]}},
+            "rejects": {"$sum": {"$cond": [{"$eq": ["$action", "accept"]}, 0, 1]}},
+        }},
+    ]
+    return payments, swipes
+
+
+async def timed(work, rounds):
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        await work()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[args.database]
+    rollups = StatsRollups(db.stats_daily, db.jobs)
+    try:
+        if not args.skip_seed:
+            await seed(db, args.days, args.per_day)
+            start = time.perf_counter()
+            counts = await rollups.rebuild(db.transactions, db.swipes, args.batch_size)
+            elapsed = time.perf_counter() - start
+            print(f"Rebuilt rollups from {counts['payments']} payments and {counts['swipes']} swipes in "
+                  f"{elapsed:.1f}s ({(counts['payments'] + counts['swipes']) / elapsed:,.0f} records/s)")
+
+        last = datetime.now(timezone.utc).date()
+        first = last - timedelta(days=29)
+        for label, scope, key in (("marketplace", ALL, ""), ("category", CATEGORY, "Technology")):
+            payments, swipes = aggregate_pipelines(first, key or None)
+
+            async def from_history():
+                await db.transactions.aggregate(payments).to_list(None)
+                await db.swipes.aggregate(swipes).to_list(None)
+
+            for source, work in (("rollups", lambda: rollups.daily(scope, key, first, last)), ("aggregation", from_history)):
+                summary = latency_summary(await timed(work, args.rounds))
+                print(f"{label:<12} {source:<12} p50={summary['p50_ms']:>9.1f}ms  p95={summary['p95_ms']:>9.1f}ms")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="wolk_bench")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=2000, help="Swipes per day; about 30%% come with a payment")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rebuild batch size")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--skip-seed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""Benchmark: single vs batched swipe ingestion.
+
+Sends the same number of swipes to a running Wolk API once as individual
+POST /api/swipe calls and once through POST /api/swipe/batch, and reports
+swipes per second for each batch size.
+
+    RATE_LIMIT_ENABLED=false AUTH_REQUIRED=false python server.py
+    python -m benchmarks.bench_swipes --swipes 5000 --batch-sizes 10 50 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+
+def make_swipes(count):
+    run = uuid.uuid4().hex[:8]
+    return [
+        {
+            "job_id": f"bench-job-{i}",
+            "user_id": f"bench-user-{run}-{i % 100}",
+            "action": "accept" if i % 3 == 0 else "reject",
+        }
+        for i in range(count)
+    ]
+
+
+async def send_all(client, path, payloads, concurrency):
+    queue = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+
+    async def worker():
+        while not queue.empty():
+            response = await client.post(path, json=queue.get_nowait())
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        elapsed = await send_all(client, "/api/swipe", make_swipes(args.swipes), args.concurrency)
+        print(f"{'single':<12} requests={args.swipes:>7}  swipes/s={args.swipes / elapsed:>9.1f}")
+
+        for batch_size in args.batch_sizes:
+            swipes = make_swipes(args.swipes)
+            batches = [swipes[i:i + batch_size] for i in range(0, len(swipes), batch_size)]
+            elapsed = await send_all(client, "/api/swipe/batch", batches, args.concurrency)
+            print(f"{'batch ' + str(batch_size):<12} requests={len(batches):>7}  swipes/s={args.swipes / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--swipes", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 50, 200])
+    asyncio.run(main(parser.parse_args()))
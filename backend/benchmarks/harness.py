@@ -0,0 +1,230 @@
+"""Concurrent end-to-end benchmark of the Wolk API.
+
+Runs the FastAPI ``app`` in-process and drives it with many concurrent
+virtual users, each repeating the real client flow:
+
+    POST /api/pi/auth -> GET /api/deck -> POST /api/swipe (per card)
+                                      -> POST /api/payments/approve -> POST /api/payments/complete
+                                         (for accepted cards)
+
+MongoDB is replaced by mongomock-motor (``--mongo mock``, the default) or a
+real server (``--mongo mongodb://...``), and the Pi API by the local stub in
+``benchmarks.stub_pi_server``, so nothing leaves the machine. Approvals and
+completions are queued; ``--task-consumers`` runs that many in-process task
+consumers in place of separate ``worker.py`` processes.
+
+Throughput and latency percentiles are reported per endpoint. Use
+``--save-baseline`` to record them, and ``--baseline`` to compare a run
+against a recorded one: the run fails (exit 1) when an endpoint's p95 grows,
+or its throughput drops, by more than ``--tolerance``.
+
+    python -m benchmarks.harness --users 50 --duration 20 --save-baseline
+    python -m benchmarks.harness --users 50 --duration 20 --baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.stats import latency_summary
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "harness.json")
+
+
+def load_app(mongo: str, pi_delay: float, task_consumers: int):
+    """Import the API wired to the chosen MongoDB and the Pi API stub"""
+    os.environ["PI_STUB_DELAY"] = str(pi_delay)
+    os.environ["TASK_CONSUMERS"] = str(task_consumers)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Every virtual user shares one client address
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if mongo == "mock":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is required for --mongo mock (pip install mongomock-motor)")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+    else:
+        os.environ["MONGO_URL"] = mongo
+        os.environ.setdefault("MONGO_DB", "wolk_bench")
+
+    import server
+    from benchmarks import stub_pi_server
+
+    server.pi_client.transport = httpx.ASGITransport(app=stub_pi_server.app)
+    server.pi_client.base_url = "http://pi-stub/v2"
+    return server
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, label, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[label] += 1
+            return None
+        self.latencies[label].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[label] += 1
+        return response
+
+
+async def sign_in(client, recorder):
+    """Sign a new user in through the Pi API stub; returns their auth headers"""
+    user_id = f"vu-{uuid.uuid4().hex[:12]}"
+    response = await recorder.call(
+        client, "POST /api/pi/auth", "POST", "/api/pi/auth",
+        json={"uid": user_id, "username": user_id, "access_token": f"stub-{user_id}"},
+    )
+    if response is None or response.status_code != 200:
+        return None
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+async def virtual_user(client, recorder, deadline, accept_rate, rng):
+    headers = None
+    while time.perf_counter() < deadline:
+        if headers is None:
+            headers = await sign_in(client, recorder)
+            continue
+        response = await recorder.call(client, "GET /api/deck", "GET", "/api/deck", headers=headers)
+        jobs = response.json().get("jobs", []) if response is not None and response.status_code == 200 else []
+        if not jobs:
+            # Deck exhausted; start over as a new user
+            headers = None
+            continue
+        for job in jobs:
+            if time.perf_counter() >= deadline:
+                return
+            action = "accept" if rng.random() < accept_rate else "reject"
+            await recorder.call(
+                client, "POST /api/swipe", "POST", "/api/swipe",
+                json={"job_id": job["id"], "action": action}, headers=headers,
+            )
+            if action == "accept":
+                payment_id = f"bench-{uuid.uuid4().hex}"
+                await recorder.call(
+                    client, "POST /api/payments/approve", "POST", "/api/payments/approve",
+                    json={"paymentId": payment_id},
+                )
+                await recorder.call(
+                    client, "POST /api/payments/complete", "POST", "/api/payments/complete",
+                    json={"paymentId": payment_id, "txid": f"tx-{payment_id}"},
+                )
+
+
+async def seed_jobs(server, count):
+    rng = random.Random(7)
+    jobs = []
+    for i in range(count):
+        template = server.sample_jobs[i % len(server.sample_jobs)]
+        job = dict(
+            template,
+            id=str(uuid.UUID(int=rng.getrandbits(128))),
+            title=f"{template['title']} #{i}",
+        )
+        # insert_many adds _id to the seeded sample dicts in place
+        job.pop("_id", None)
+        jobs.append(job)
+    await server.jobs_collection.insert_many(jobs)
+
+
+async def run(args):
+    server = load_app(args.mongo, args.pi_delay, args.task_consumers)
+    async with server.app.router.lifespan_context(server.app):
+        await seed_jobs(server, args.jobs)
+        recorder = Recorder()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://wolk", timeout=60) as client:
+            deadline = time.perf_counter() + args.duration
+            rng = random.Random(args.seed)
+            await asyncio.gather(*(
+                virtual_user(client, recorder, deadline, args.accept_rate, random.Random(rng.random()))
+                for _ in range(args.users)
+            ))
+
+    results = {}
+    for label, samples in sorted(recorder.latencies.items()):
+        results[label] = dict(
+            latency_summary(samples),
+            requests=len(samples),
+            rps=len(samples) / args.duration,
+            errors=recorder.errors[label],
+        )
+    return results
+
+
+def report(results):
+    print(f"{'endpoint':<32}{'requests':>10}{'rps':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, r in results.items():
+        print(
+            f"{label:<32}{r['requests']:>10}{r['rps']:>10.1f}{r['errors']:>8}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions against ``baseline``"""
+    regressions = []
+    for label, base in baseline.items():
+        current = results.get(label)
+        if current is None:
+            regressions.append(f"{label}: no requests in this run")
+            continue
+        if current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {current['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{label}: {current['rps']:.1f} rps vs baseline {base['rps']:.1f} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--jobs", type=int, default=500, help="Synthetic jobs seeded before the run")
+    parser.add_argument("--accept-rate", type=float, default=0.2)
+    parser.add_argument("--pi-delay", type=float, default=0.05, help="Pi API stub latency in seconds")
+    parser.add_argument("--task-consumers", type=int, default=8, help="In-process payment task consumers")
+    parser.add_argument("--mongo", default="mock", help="'mock' or a MongoDB URL")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, help="Fail on regressions against this file")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Write results to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Load test: /api/jobs latency while Pi payment calls are slow.
+
+Start the Pi stub and point the API at it, then run this script:
+
+    PI_STUB_DELAY=2 python -m benchmarks.stub_pi_server
+    PI_API_BASE_URL=http://127.0.0.1:8900/v2 RATE_LIMIT_ENABLED=false TASK_CONSUMERS=10 python server.py
+    python -m benchmarks.load_payments --payment-workers 50
+
+The script measures /api/jobs on its own, then again while payment workers
+keep /api/payments/approve and /api/payments/complete busy. With the async Pi
+client the two p99 figures should stay close; with blocking calls the second
+one grows with the stub delay.
+
+The payment endpoints only queue their work (202) and the Pi calls run in
+task consumers, so this exercises them only with ``TASK_CONSUMERS`` set on
+the API process, which then shares its event loop with them; payment
+requests themselves never wait on Pi. Every request comes from one
+address, so rate limits must be off (``RATE_LIMIT_ENABLED=false``) or the
+payment workers mostly measure 429s. Non-2xx responses are counted and
+reported per route.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+from benchmarks.stats import percentile
+
+
+async def measure_jobs(client, duration, concurrency, errors):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get("/api/jobs")
+            if not response.is_success:
+                errors[("/api/jobs", response.status_code)] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def payment_load(client, stop, counts, errors):
+    while not stop.is_set():
+        payment_id = str(uuid.uuid4())
+        for path, body in (
+            ("/api/payments/approve", {"paymentId": payment_id}),
+            ("/api/payments/complete", {"paymentId": payment_id, "txid": f"tx-{payment_id}"}),
+        ):
+            response = await client.post(path, json=body)
+            counts[path] += 1
+            if not response.is_success:
+                errors[(path, response.status_code)] += 1
+
+
+def report(label, latencies, duration):
+    print(
+        f"{label:<22} requests={len(latencies):>6}  "
+        f"rps={len(latencies) / duration:>8.1f}  "
+        f"p50={percentile(latencies, 50) * 1000:>7.1f}ms  "
+        f"p99={percentile(latencies, 99) * 1000:>7.1f}ms"
+    )
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.jobs_workers + args.payment_workers)
+    counts, errors = Counter(), Counter()
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        baseline = await measure_jobs(client, args.duration, args.jobs_workers, errors)
+        report("jobs (idle)", baseline, args.duration)
+
+        stop = asyncio.Event()
+        payers = [
+            asyncio.create_task(payment_load(client, stop, counts, errors)) for _ in range(args.payment_workers)
+        ]
+        loaded = await measure_jobs(client, args.duration, args.jobs_workers, errors)
+        stop.set()
+        await asyncio.gather(*payers, return_exceptions=True)
+        report("jobs (payments busy)", loaded, args.duration)
+
+    for path, count in sorted(counts.items()):
+        print(f"{path:<26} requests={count:>6}")
+    for (path, status), count in sorted(errors.items()):
+        print(f"{path:<26} status={status} x{count}")
+    if errors:
+        print("Non-2xx responses were left out of the latencies; 429s mean rate limits are on")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--jobs-workers", type=int, default=10)
+    parser.add_argument("--payment-workers", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,240 @@
+"""Soak test: thousands of concurrent server-sent event streams.
+
+Serves the API with uvicorn on a local port and opens ``--connections``
+streams on ``/api/events``, each following a few job categories, all jobs,
+or a user. Job and match events are then published at ``--rate`` per second
+for ``--duration`` seconds:
+
+* ``--mongo mock`` (the default) runs on mongomock-motor, which has no change
+  streams, so events are injected through the same callbacks the watchers
+  call;
+* ``--mongo mongodb://...`` inserts real jobs and accepted swipes and relies
+  on change streams (a replica set is required).
+
+``--slow`` of the streams stop reading for ``--stall`` seconds at a time, to
+check that they are sent ``lagged`` events while everyone else keeps
+receiving on time.
+
+The streams are read by ``--client-processes`` separate processes so the
+clients do not compete with the server for its event loop. Reports delivery
+latency (from the job's ``created_at`` or the swipe's ``timestamp`` to
+receipt), events received, lagged and dropped, and the server's memory.
+
+    python -m benchmarks.soak_events --connections 5000 --duration 30 --rate 20
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+import orjson
+import uvicorn
+
+from benchmarks.harness import load_app
+from benchmarks.stats import latency_summary
+
+CATEGORIES = ["Manual Labor", "Cleaning", "Technology", "Professional Services", "Consulting"]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def raise_fd_limit(wanted: int) -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def stream_params(rng, users):
+    roll = rng.random()
+    if roll < 0.25:
+        return {"user_id": rng.choice(users)}
+    if roll < 0.35:
+        return {}
+    return {"category": rng.sample(CATEGORIES, rng.randint(1, 2))}
+
+
+def age(stamp: str) -> float:
+    return time.time() - datetime.fromisoformat(stamp).timestamp()
+
+
+async def read_stream(client, stats, params, stall, rng):
+    """Read one stream until cancelled; ``stall`` > 0 pauses now and then"""
+    try:
+        async with client.stream("GET", "/api/events", params=params) as response:
+            if response.status_code != 200:
+                stats["errors"][str(response.status_code)] += 1
+                return
+            stats["connected"] += 1
+            kind = None
+            resume_at = time.perf_counter() + rng.uniform(0, stall) if stall else None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    kind = line[7:]
+                elif line.startswith("data: "):
+                    data = orjson.loads(line[6:])
+                    stats["received"][kind] += 1
+                    if kind == "lagged":
+                        stats["dropped"] += data["dropped"]
+                    elif kind == "job":
+                        stats["latencies"].append(age(data["job"]["created_at"]))
+                    elif kind == "match":
+                        stats["latencies"].append(age(data["timestamp"]))
+                if resume_at is not None and time.perf_counter() >= resume_at:
+                    await asyncio.sleep(stall)
+                    resume_at = time.perf_counter() + stall
+    except httpx.HTTPError as exc:
+        stats["errors"][type(exc).__name__] += 1
+
+
+async def read_streams(port, connections, users, slow, stall, seed, stop):
+    rng = random.Random(seed)
+    stats = {"connected": 0, "received": Counter(), "dropped": 0, "latencies": [], "errors": Counter()}
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=0)
+    timeout = httpx.Timeout(60, read=None)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=timeout) as client:
+        readers = [
+            asyncio.create_task(read_stream(
+                client, stats, stream_params(rng, users), stall if rng.random() < slow else 0, random.Random(rng.random())
+            ))
+            for _ in range(connections)
+        ]
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+    return stats
+
+
+def client_process(port, connections, users, slow, stall, seed, stop, results):
+    raise_fd_limit(connections + 100)
+    results.put(asyncio.run(read_streams(port, connections, users, slow, stall, seed, stop)))
+
+
+def make_job(server, rng):
+    template = rng.choice(server.sample_jobs)
+    job = {key: value for key, value in template.items() if key != "_id"}
+    job.update(id=str(uuid.uuid4()), category=rng.choice(CATEGORIES), created_at=datetime.now(timezone.utc))
+    return job
+
+
+async def publish(server, args, users, rng):
+    interval = 1 / args.rate
+    next_at = time.perf_counter()
+    deadline = next_at + args.duration
+    while next_at < deadline:
+        job = make_job(server, rng)
+        swipe = {"job_id": job["id"], "user_id": rng.choice(users), "action": "accept", "timestamp": job["created_at"].isoformat()}
+        match = rng.random() < 0.5
+        if args.mongo == "mock":
+            server.on_jobs_change({"operationType": "insert", "fullDocument": job})
+            if match:
+                server.publish_match_event({"operationType": "insert", "fullDocument": swipe})
+        else:
+            await server.jobs_collection.insert_one(job)
+            if match:
+                await server.swipes_collection.insert_one(swipe)
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+
+async def run(args):
+    os.environ.setdefault("EVENTS_MAX_STREAMS", str(args.connections))
+    # Streams follow users by user_id instead of signing each one in
+    os.environ.setdefault("AUTH_REQUIRED", "false")
+    server = load_app(args.mongo, 0.0, 0)
+    limit = raise_fd_limit(args.connections + 1000)
+    if limit < args.connections + 100:
+        print(f"warning: open file limit is {limit}, connections may fail")
+
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=args.port, log_level="warning",
+                            backlog=args.connections)
+    uvicorn_server = uvicorn.Server(config)
+    serving = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.05)
+
+    rng = random.Random(args.seed)
+    users = [f"soak-{i}" for i in range(max(1, args.connections // 4))]
+    baseline_rss = rss_mb()
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    results = context.Queue()
+    share, extra = divmod(args.connections, args.client_processes)
+    clients = [
+        context.Process(target=client_process, args=(
+            args.port, share + (i < extra), users, args.slow, args.stall, args.seed + i, stop, results
+        ))
+        for i in range(args.client_processes)
+    ]
+    for client in clients:
+        client.start()
+
+    start = time.perf_counter()
+    while len(server.event_broker) < args.connections and time.perf_counter() - start < args.connect_timeout:
+        await asyncio.sleep(0.1)
+    streams = len(server.event_broker)
+    connected_rss = rss_mb()
+    print(f"{streams} streams open in {time.perf_counter() - start:.1f}s, "
+          f"server RSS {baseline_rss:.0f} -> {connected_rss:.0f} MB "
+          f"({(connected_rss - baseline_rss) * 1024 / max(1, streams):.1f} KB/stream)")
+
+    published = server.event_broker.published
+    await publish(server, args, users, rng)
+    await asyncio.sleep(args.grace)
+    stop.set()
+    loop = asyncio.get_running_loop()
+    reports = [await loop.run_in_executor(None, results.get) for _ in clients]
+    for client in clients:
+        client.join()
+    uvicorn_server.should_exit = True
+    await serving
+
+    received, errors, latencies, dropped = Counter(), Counter(), [], 0
+    for report in reports:
+        received.update(report["received"])
+        errors.update(report["errors"])
+        latencies.extend(report["latencies"])
+        dropped += report["dropped"]
+    summary = latency_summary(latencies)
+    print(f"published {server.event_broker.published - published} events, "
+          f"{server.event_broker.delivered} deliveries, {server.event_broker.dropped} dropped at the server")
+    print("received " + ", ".join(f"{kind} {count}" for kind, count in sorted(received.items())))
+    print(f"lagged notices {received['lagged']} covering {dropped} events")
+    print(f"delivery latency ms p50 {summary['p50_ms']:.1f} p95 {summary['p95_ms']:.1f} "
+          f"p99 {summary['p99_ms']:.1f} max {summary['max_ms']:.1f}")
+    print(f"server peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    if errors:
+        print("errors " + ", ".join(f"{error} {count}" for error, count in errors.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--client-processes", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of publishing")
+    parser.add_argument("--rate", type=float, default=20.0, help="Job events per second")
+    parser.add_argument("--slow", type=float, default=0.05, help="Fraction of streams that stall")
+    parser.add_argument("--stall", type=float, default=5.0, help="Seconds a slow stream stops reading")
+    parser.add_argument("--grace", type=float, default=2.0, help="Seconds to wait for stragglers")
+    parser.add_argument("--connect-timeout", type=float, default=60.0)
+    parser.add_argument("--mongo", default="mock", help='"mock" or a MongoDB URL')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
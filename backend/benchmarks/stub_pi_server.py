@@ -0,0 +1,49 @@
+"""Local stand-in for the Pi Network payments and user APIs.
+
+Every call sleeps for ``PI_STUB_DELAY`` seconds (default 0.5) so the Wolk API
+can be exercised against a slow Pi backend without touching the network.
+
+    PI_STUB_DELAY=2 uvicorn benchmarks.stub_pi_server:app --port 8900
+"""
+import asyncio
+import os
+
+from fastapi import FastAPI, Header, HTTPException
+
+PI_STUB_DELAY = float(os.environ.get('PI_STUB_DELAY', '0.5'))
+
+app = FastAPI(title="Pi API stub")
+
+
+@app.get("/v2/me")
+async def get_user(authorization: str = Header("")):
+    # Access tokens of the form "stub-<uid>" belong to user <uid>
+    scheme, _, token = authorization.partition(" ")
+    if scheme != "Bearer" or not token.startswith("stub-"):
+        raise HTTPException(status_code=401, detail="Invalid access token")
+    await asyncio.sleep(PI_STUB_DELAY)
+    uid = token[len("stub-"):]
+    return {"uid": uid, "username": uid}
+
+
+@app.get("/v2/payments/{payment_id}")
+async def get_payment(payment_id: str):
+    await asyncio.sleep(PI_STUB_DELAY)
+    return {
+        "identifier": payment_id,
+        "amount": 1.0,
+        "memo": "Wolk job payment",
+        "status": {"developer_approved": True, "transaction_verified": True},
+        "transaction": {"txid": f"tx-{payment_id}"},
+    }
+
+
+@app.post("/v2/payments/approve")
+async def approve_payment(data: dict):
+    await asyncio.sleep(PI_STUB_DELAY)
+    return {"identifier": data.get("paymentId"), "status": {"developer_approved": True}}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get('PI_STUB_PORT', '8900')))
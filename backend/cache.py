@@ -0,0 +1,220 @@
+"""In-process caching for rarely changing job data.
+
+``TTLCache`` is a bounded LRU whose entries also expire after ``ttl``
+seconds, so the TTL is a hard upper bound on staleness. ``CollectionWatcher``
+invalidates entries sooner: it follows a MongoDB change stream on the
+collection and, where change streams are unavailable (standalone servers),
+falls back to polling a cheap fingerprint of the collection.
+
+``CollectionVersions`` keeps a version counter per collection in MongoDB,
+bumped after every write that changes what clients see. Every API process
+reads the same counters, so they make ETags that hold across processes.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger("wolk.cache")
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            expires_at, value = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        """Return the cached value for ``key``, loading and caching it on a miss.
+
+        ``None`` results are not cached.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = await loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CollectionWatcher:
+    """Calls ``on_change`` whenever documents in ``collection`` change.
+
+    ``on_change`` receives the change stream event, or ``None`` when the
+    change was detected by polling and its details are unknown. ``pipeline``
+    filters the change stream server-side. With ``poll=False`` the watcher
+    just stops where change streams are unavailable.
+    """
+
+    def __init__(
+        self,
+        collection,
+        on_change: Callable[[Optional[Dict[str, Any]]], None],
+        fingerprint: Optional[Callable[[], Awaitable[Any]]] = None,
+        poll_interval: float = 5.0,
+        retry_interval: float = 5.0,
+        pipeline: Optional[List[Dict[str, Any]]] = None,
+        poll: bool = True,
+    ):
+        self.collection = collection
+        self.on_change = on_change
+        self.fingerprint = fingerprint or collection.estimated_document_count
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.pipeline = pipeline
+        self.poll = poll
+        self.mode: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(
+                    self.pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    self.mode = "change_stream"
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.on_change(change)
+            except OperationFailure as e:
+                # Standalone servers have no change streams
+                logger.info("Change streams unavailable", extra={"collection": self.collection.name, "error": str(e)})
+                break
+            except PyMongoError as e:
+                logger.warning("Change stream interrupted", extra={"collection": self.collection.name, "error": str(e)})
+                # Anything may have changed while we were disconnected
+                self.on_change(None)
+                await asyncio.sleep(self.retry_interval)
+            except Exception as e:
+                logger.warning("Change stream failed", extra={"collection": self.collection.name, "error": str(e)})
+                break
+        if self.poll:
+            await self._poll()
+        else:
+            self.mode = "stopped"
+
+    async def _poll(self):
+        self.mode = "polling"
+        last = _MISSING
+        while True:
+            try:
+                current = await self.fingerprint()
+            except PyMongoError as e:
+                logger.warning("Error polling collection", extra={"collection": self.collection.name, "error": str(e)})
+            else:
+                if last is not _MISSING and current != last:
+                    self.on_change(None)
+                last = current
+            await asyncio.sleep(self.poll_interval)
+
+
+class CollectionVersions:
+    """Shared version counters, one document per counted collection.
+
+    Writers ``bump`` a counter after their write, never before, so a
+    response built after reading version N reflects at least version N.
+    Readers get counters from memory, reloaded at most every ``ttl``
+    seconds and whenever ``on_change`` (e.g. from a ``CollectionWatcher``
+    on the counters) reports a bump. ``on_bump`` is called with a
+    counter's name whenever this process sees it go up, before the new
+    version is handed out, so caches that may predate it can be dropped.
+    """
+
+    def __init__(self, collection, ttl: float = 30.0, on_bump: Optional[Callable[[str], None]] = None,
+                 clock=time.monotonic):
+        self.collection = collection
+        self.ttl = ttl
+        self.on_bump = on_bump
+        self.clock = clock
+        self._versions: Dict[str, int] = {}
+        self._expires_at = 0.0
+        self._loading: Optional[asyncio.Future] = None
+
+    def _update(self, name: str, version: int):
+        if version > self._versions.get(name, 0):
+            if self.on_bump is not None:
+                self.on_bump(name)
+            self._versions[name] = version
+
+    async def _load(self):
+        async for document in self.collection.find({}, {"version": 1}):
+            self._update(document["_id"], document["version"])
+        self._expires_at = self.clock() + self.ttl
+
+    async def get(self, *names: str) -> Tuple[int, ...]:
+        """Current versions of ``names``; 0 for collections never bumped"""
+        if self.clock() >= self._expires_at:
+            # One reload at a time; concurrent callers wait for it
+            if self._loading is None or self._loading.done():
+                self._loading = asyncio.ensure_future(self._load())
+            await asyncio.shield(self._loading)
+        return tuple(self._versions.get(name, 0) for name in names)
+
+    async def bump(self, name: str) -> int:
+        document = await self.collection.find_one_and_update(
+            {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self._update(name, document["version"])
+        return document["version"]
+
+    def on_change(self, change: Optional[Dict[str, Any]]):
+        document = change.get("fullDocument") if change else None
+        if document and "version" in document:
+            self._update(document["_id"], document["version"])
+        else:
+            self._expires_at = 0.0
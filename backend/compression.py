@@ -0,0 +1,198 @@
+"""Negotiated gzip and brotli compression of HTTP responses.
+
+``CompressionMiddleware`` compresses response bodies in the coding the
+client prefers among those it accepts: brotli (``br``) when the optional
+``brotli`` package is installed, otherwise gzip. Bodies smaller than
+``minimum_size`` bytes are sent as they are; the saving would not cover
+the framing. Streamed bodies are compressed chunk by chunk.
+
+Server-sent event streams are never compressed, as a compressor holds
+output back until it has enough input and would delay events; neither are
+images, which are compressed already, nor anything sent with
+``Cache-Control: no-transform``. Responses that could be compressed carry
+``Vary: Accept-Encoding`` (304s included) so shared caches keep encodings
+apart, and a compressed response's strong ETag is made weak, since its
+bytes no longer match the identity encoding's.
+"""
+import zlib
+from typing import Iterable, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from metrics import COMPRESSED_BYTES
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Never compressed: event streams must flush per event, images are compressed already
+DEFAULT_EXCLUDED_TYPES = ("text/event-stream", "image/", "video/", "audio/")
+
+
+def choose_encoding(accept_encoding: str, available: Sequence[str]) -> Optional[str]:
+    """The coding in ``available`` (most preferred first) the client weighs highest.
+
+    ``None`` when the client accepts none of them, e.g. with no
+    ``Accept-Encoding`` at all or only ``identity``.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+    best, best_q = None, 0.0
+    for coding in available:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        # wbits=31: gzip framing rather than a raw zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing response bodies of ``minimum_size`` bytes or more.
+
+    ``brotli_quality`` defaults to 4, which compresses JSON better than
+    gzip at level 6 in about the same time; higher levels cost far more CPU
+    for a few percent.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        excluded_types: Iterable[str] = DEFAULT_EXCLUDED_TYPES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_types = tuple(excluded_types)
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        responder = _CompressingResponder(self, send, encoding, head=scope["method"] == "HEAD")
+        await self.app(scope, receive, responder.send)
+
+    def compressor(self, encoding: str):
+        return _Brotli(self.brotli_quality) if encoding == "br" else _Gzip(self.gzip_level)
+
+    def compressible(self, status: int, headers: MutableHeaders) -> bool:
+        """Whether a response could be compressed, for some client, at some size"""
+        if status < 200 or status == 204 or "content-encoding" in headers:
+            return False
+        if "no-transform" in headers.get("cache-control", "").lower():
+            return False
+        content_type = headers.get("content-type", "").lower()
+        # 304s carry no Content-Type; they vary like the 200 they stand in for
+        return not content_type.startswith(self.excluded_types)
+
+
+class _CompressingResponder:
+    """The ``send`` for one response, holding its start until the first body chunk"""
+
+    def __init__(self, middleware: CompressionMiddleware, send, encoding: Optional[str], head: bool):
+        self.middleware = middleware
+        self._send = send
+        self.encoding = encoding
+        self.head = head
+        self.start = None
+        self.compressor = None
+        self.started = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+        if self.started:
+            if self.compressor is not None:
+                await self._send_compressed(message)
+            else:
+                await self._send(message)
+            return
+
+        self.started = True
+        start = self.start
+        headers = MutableHeaders(raw=start["headers"])
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.middleware.compressible(start["status"], headers):
+            await self._send(start)
+            await self._send(message)
+            return
+
+        headers.add_vary_header("Accept-Encoding")
+        too_small = not more_body and len(body) < self.middleware.minimum_size
+        if self.encoding is None or self.head or start["status"] == 304 or too_small:
+            await self._send(start)
+            await self._send(message)
+            return
+
+        self.compressor = self.middleware.compressor(self.encoding)
+        headers["Content-Encoding"] = self.encoding
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+        if more_body:
+            del headers["Content-Length"]
+            await self._send(start)
+            await self._send_compressed(message)
+        else:
+            compressed = self.compressor.compress(body) + self.compressor.finish()
+            COMPRESSED_BYTES.inc(len(body), encoding=self.encoding, stage="in")
+            COMPRESSED_BYTES.inc(len(compressed), encoding=self.encoding, stage="out")
+            headers["Content-Length"] = str(len(compressed))
+            await self._send(start)
+            await self._send({"type": "http.response.body", "body": compressed})
+
+    async def _send_compressed(self, message):
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        compressed = self.compressor.compress(body)
+        if not more_body:
+            compressed += self.compressor.finish()
+        COMPRESSED_BYTES.inc(len(body), encoding=self.encoding, stage="in")
+        COMPRESSED_BYTES.inc(len(compressed), encoding=self.encoding, stage="out")
+        await self._send({"type": "http.response.body", "body": compressed, "more_body": more_body})
@@ -0,0 +1,112 @@
+"""Per-process MongoDB client and the startup leader lease.
+
+``Mongo`` creates its ``AsyncIOMotorClient`` on first use instead of at
+import time, and again in any process that did not create it, so a client
+is never carried across a fork and every worker process gets its own
+connection pool. ``Mongo.collection`` hands out lightweight proxies that
+resolve against the current process's client on each access, which lets
+module-level services keep a collection reference from import time.
+
+``acquire_lease`` elects one process to run one-off work such as creating
+indexes and seeding, when several workers start at once.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Sequence
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+MONGO_DB = os.environ.get('MONGO_DB', 'wolk_db')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+
+
+class Mongo:
+    """Lazily connected, fork-aware MongoDB client"""
+
+    def __init__(
+        self,
+        url: str = MONGO_URL,
+        db_name: str = MONGO_DB,
+        max_pool_size: int = MONGO_MAX_POOL_SIZE,
+        min_pool_size: int = MONGO_MIN_POOL_SIZE,
+        event_listeners: Sequence = (),
+    ):
+        self.url = url
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.event_listeners = list(event_listeners)
+        self._client: Optional[AsyncIOMotorClient] = None
+        self._pid: Optional[int] = None
+        self._collections: Dict[str, object] = {}
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        if self._client is None or self._pid != os.getpid():
+            # A client inherited through fork is unusable; leave it alone
+            self._client = AsyncIOMotorClient(
+                self.url,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                event_listeners=self.event_listeners,
+            )
+            self._pid = os.getpid()
+            self._collections = {}
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def get_collection(self, name: str):
+        client = self.client
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = client[self.db_name][name]
+        return collection
+
+    def collection(self, name: str) -> "LazyCollection":
+        return LazyCollection(self, name)
+
+    def close(self):
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+        self._collections = {}
+
+
+class LazyCollection:
+    """Stand-in for a Motor collection that connects on first use"""
+
+    __slots__ = ("_mongo", "_name")
+
+    def __init__(self, mongo: Mongo, name: str):
+        self._mongo = mongo
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._mongo.get_collection(self._name), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self._mongo.db_name}.{self._name})"
+
+
+async def acquire_lease(collection, name: str, owner: str, ttl: float) -> bool:
+    """Take the lease ``name`` for ``ttl`` seconds unless someone else holds it.
+
+    The lease is not released early, so processes starting within ``ttl``
+    of the winner see it held and skip the guarded work.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await collection.update_one(
+            {"_id": name, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "acquired_at": now, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
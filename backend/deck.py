@@ -0,0 +1,242 @@
+"""Per-user swipe decks.
+
+A deck is the job feed with the jobs a user has already swiped removed.
+Instead of a ``$nin`` over an ever-growing list of job IDs, every user gets
+an in-memory bloom filter of seen job IDs, loaded once from the ``swipes``
+collection and updated as new swipes come in. The deck then walks the
+regular keyset-paginated feed and drops jobs the filter has seen.
+
+A walk that reaches the end of the feed starts again from the top once the
+jobs version has moved (new jobs may be there) or once it has served jobs
+(the user may have left some unswiped); the filter skips the swiped ones.
+
+A bloom filter can report false positives (never false negatives), so a
+small fraction of unseen jobs may be skipped; a swiped job is never served
+again. The ``swipes`` collection stays the source of truth: state for users
+evicted from memory is rebuilt from it on their next request.
+"""
+import asyncio
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pagination import fetch_page
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over string keys"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Kirsch-Mitzenmacher: derive k positions from two 64-bit hashes
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class SeenFilter:
+    """Scalable bloom filter of the job IDs one user has swiped.
+
+    When the current filter reaches capacity a new one twice the size and
+    with half the error rate is added, so the combined false positive rate
+    stays under ``error_rate`` however many jobs a user swipes.
+    """
+
+    def __init__(self, initial_capacity: int = 1024, error_rate: float = 0.01):
+        self.filters = [BloomFilter(initial_capacity, error_rate / 2)]
+
+    def add(self, job_id: str):
+        if job_id in self:
+            return
+        current = self.filters[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(current.capacity * 2, current.error_rate / 2)
+            self.filters.append(current)
+        current.add(job_id)
+
+    def __contains__(self, job_id: str) -> bool:
+        return any(job_id in f for f in self.filters)
+
+
+class _FeedState:
+    """Position of one user's deck in the (optionally category-filtered) feed"""
+
+    def __init__(self):
+        self.buffer: List[Dict[str, Any]] = []
+        self.cursor: Optional[str] = None
+        self.exhausted = False
+        # Jobs version the current walk started at, and whether it has served jobs since
+        self.version: Any = None
+        self.served = False
+        self.lock = asyncio.Lock()
+        self.prefetch_task: Optional[asyncio.Task] = None
+
+
+class _UserState:
+    def __init__(self, initial_capacity: int, error_rate: float):
+        self.seen = SeenFilter(initial_capacity, error_rate)
+        self.loaded: Optional[asyncio.Task] = None
+        self.feeds: Dict[Optional[str], _FeedState] = {}
+
+
+class DeckService:
+    """Serves each user the next unseen jobs and prefetches the batch after"""
+
+    def __init__(
+        self,
+        jobs_collection,
+        swipes_collection,
+        feed_sort,
+        max_users: int = 10000,
+        prefetch_size: int = 20,
+        page_size: int = 100,
+        initial_capacity: int = 1024,
+        error_rate: float = 0.01,
+        pending_swipes=None,
+        projection=None,
+        query: Optional[Callable[[], Dict[str, Any]]] = None,
+        is_live: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        version: Optional[Callable[[], Awaitable[Any]]] = None,
+    ):
+        self.jobs_collection = jobs_collection
+        self.swipes_collection = swipes_collection
+        # Callable returning job IDs a user swiped that are not stored yet
+        self.pending_swipes = pending_swipes
+        # Fields buffered per job; None keeps whole documents
+        self.projection = projection
+        # Filter every deck starts from, e.g. live jobs only, and whether a buffered job still passes it
+        self.query = query
+        self.is_live = is_live
+        # Version of the jobs collection, which changes when jobs are added or removed
+        self.version = version
+        self.feed_sort = feed_sort
+        self.max_users = max_users
+        self.prefetch_size = prefetch_size
+        self.page_size = page_size
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self._users: "OrderedDict[str, _UserState]" = OrderedDict()
+
+    async def _load_seen(self, user_id: str, seen: SeenFilter):
+        if self.pending_swipes is not None:
+            for job_id in self.pending_swipes(user_id):
+                seen.add(job_id)
+        # Covered by the (user_id, job_id) index
+        swipes_cursor = self.swipes_collection.find({"user_id": user_id}, {"job_id": 1, "_id": 0})
+        async for swipe in swipes_cursor:
+            seen.add(swipe["job_id"])
+
+    async def _user(self, user_id: str) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = _UserState(self.initial_capacity, self.error_rate)
+            state.loaded = asyncio.ensure_future(self._load_seen(user_id, state.seen))
+            self._users[user_id] = state
+            while len(self._users) > self.max_users:
+                _, evicted = self._users.popitem(last=False)
+                for feed in evicted.feeds.values():
+                    if feed.prefetch_task:
+                        feed.prefetch_task.cancel()
+        else:
+            self._users.move_to_end(user_id)
+        try:
+            await asyncio.shield(state.loaded)
+        except Exception:
+            # Retry the load on the next request rather than serve seen jobs
+            self._users.pop(user_id, None)
+            raise
+        return state
+
+    def mark_seen(self, user_id: str, job_id: str):
+        """Record a swipe in the user's in-memory filter, if it is loaded.
+
+        Users not in memory pick the swipe up from MongoDB when loaded.
+        """
+        state = self._users.get(user_id)
+        if state is not None:
+            state.seen.add(job_id)
+
+    async def _restart(self, feed: _FeedState) -> bool:
+        """Start the walk again from the top of the feed, unless it cannot find anything new"""
+        version = await self.version() if self.version else None
+        if feed.exhausted and not feed.served and version == feed.version:
+            return False
+        feed.cursor = None
+        feed.exhausted = False
+        feed.served = False
+        feed.version = version
+        return True
+
+    async def _fill(self, state: _UserState, feed: _FeedState, category: Optional[str], target: int):
+        async with feed.lock:
+            query = self.query() if self.query else {}
+            if category:
+                query["category"] = category
+            if feed.cursor is None and not feed.exhausted and feed.version is None:
+                await self._restart(feed)
+            while len(feed.buffer) < target:
+                if feed.exhausted and not await self._restart(feed):
+                    break
+                jobs, feed.cursor = await fetch_page(
+                    self.jobs_collection, query, self.feed_sort, self.page_size, feed.cursor, self.projection
+                )
+                buffered = {job["id"] for job in feed.buffer}
+                feed.buffer.extend(job for job in jobs if job["id"] not in state.seen and job["id"] not in buffered)
+                feed.exhausted = feed.cursor is None
+
+    def _schedule_prefetch(self, state: _UserState, feed: _FeedState, category: Optional[str]):
+        if feed.exhausted or len(feed.buffer) >= self.prefetch_size:
+            return
+        if feed.prefetch_task is None or feed.prefetch_task.done():
+            feed.prefetch_task = asyncio.ensure_future(
+                self._fill(state, feed, category, self.prefetch_size)
+            )
+
+    async def next_jobs(self, user_id: str, limit: int, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return up to ``limit`` jobs the user has not swiped yet"""
+        state = await self._user(user_id)
+        feed = state.feeds.setdefault(category, _FeedState())
+
+        # Jobs swiped or expired since they were buffered are dropped here
+        feed.buffer = [
+            job for job in feed.buffer
+            if job["id"] not in state.seen and (self.is_live is None or self.is_live(job))
+        ]
+        if len(feed.buffer) < limit:
+            await self._fill(state, feed, category, limit)
+
+        jobs = feed.buffer[:limit]
+        feed.buffer = feed.buffer[limit:]
+        feed.served = feed.served or bool(jobs)
+        self._schedule_prefetch(state, feed, category)
+        return jobs
+
+    async def close(self):
+        tasks = [
+            feed.prefetch_task
+            for state in self._users.values()
+            for feed in state.feeds.values()
+            if feed.prefetch_task and not feed.prefetch_task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._users.clear()
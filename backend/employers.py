@@ -0,0 +1,197 @@
+"""Employers and their rating aggregates.
+
+Jobs reference their employer by ``employer_id`` instead of carrying copies
+of its name and rating, so a new rating is one write to the employer rather
+than one to each of its jobs. An employer keeps ``rating_count`` and
+``rating_sum`` with ``rating`` as their quotient. A single pipeline update
+sets all three, so concurrent ratings are never lost or half applied.
+``employer_ratings`` holds each user's latest rating of an employer, and
+rating the same employer again replaces that rating in the aggregates.
+
+``EmployerDirectory.attach`` fills ``employer`` and ``employer_rating`` into
+job documents from a cache, loading the employers it misses with one query,
+so a feed page stays a single jobs query once the cache is warm.
+
+Employer names are unique, so jobs created concurrently under the same new
+name share one employer; ``ids_for_names`` creates employers by upsert.
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from cache import TTLCache
+
+EMPLOYER_PROJECTION = {"_id": 0, "id": 1, "name": 1, "rating": 1, "rating_count": 1}
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class EmployerDirectory:
+    def __init__(self, employers, ratings, cache: Optional[TTLCache] = None):
+        self.employers = employers
+        self.ratings = ratings
+        self.cache = cache or TTLCache(max_size=10000, ttl=30.0)
+        # Names only ever gain employers, so cached IDs stay valid
+        self.name_cache = TTLCache(max_size=self.cache.max_size, ttl=3600.0)
+
+    async def ensure_indexes(self):
+        await self.employers.create_index("id", unique=True)
+        indexes = await self.employers.index_information()
+        if "name_1" in indexes and not indexes["name_1"].get("unique"):
+            # Created non-unique by earlier versions
+            await self.employers.drop_index("name_1")
+        await self.employers.create_index("name", unique=True)
+        await self.employers.create_index("updated_at")
+        await self.ratings.create_index([("employer_id", 1), ("user_id", 1)], unique=True)
+
+    @staticmethod
+    def _new_employer(name: str, rating: Optional[float], employer_id: Optional[str], now: datetime) -> Dict[str, Any]:
+        return {
+            "id": employer_id or str(uuid.uuid4()),
+            "name": name,
+            "rating_count": 1 if rating is not None else 0,
+            "rating_sum": rating or 0.0,
+            "rating": rating or 0.0,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    async def create(self, name: str, rating: Optional[float] = None, employer_id: Optional[str] = None) -> Dict[str, Any]:
+        """Add an employer; an initial ``rating`` counts as one rating"""
+        employer = self._new_employer(name, rating, employer_id, utcnow())
+        await self.employers.insert_one(employer)
+        employer.pop("_id", None)
+        return employer
+
+    async def ids_for_names(self, names: Iterable[str]) -> Dict[str, str]:
+        """Map employer names to IDs, creating unrated employers for new names"""
+        ids = {}
+        missing = []
+        for name in set(names):
+            employer_id = self.name_cache.get(name)
+            if employer_id is None:
+                missing.append(name)
+            else:
+                ids[name] = employer_id
+        if missing:
+            await self._find_ids(missing, ids)
+            new = [name for name in missing if name not in ids]
+            if new:
+                await self._upsert_names(new)
+                # Whichever upsert won a race for a name, its employer is the one stored
+                await self._find_ids(new, ids)
+            for name in missing:
+                self.name_cache.set(name, ids[name])
+        return ids
+
+    async def _find_ids(self, names: List[str], ids: Dict[str, str]):
+        async for employer in self.employers.find({"name": {"$in": names}}, {"_id": 0, "id": 1, "name": 1}):
+            ids[employer["name"]] = employer["id"]
+
+    async def _upsert_names(self, names: List[str]):
+        now = utcnow()
+        upserts = []
+        for name in names:
+            employer = self._new_employer(name, None, None, now)
+            del employer["name"]
+            upserts.append(UpdateOne({"name": name}, {"$setOnInsert": employer}, upsert=True))
+        try:
+            await self.employers.bulk_write(upserts, ordered=False)
+        except BulkWriteError as e:
+            # Concurrent upserts of the same new name: one inserts, the others hit the unique index
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def existing_ids(self, employer_ids: Iterable[str]) -> Set[str]:
+        """The subset of ``employer_ids`` that are employers"""
+        employer_ids = set(employer_ids)
+        found = {employer_id for employer_id in employer_ids if self.cache.get(employer_id) is not None}
+        if len(found) < len(employer_ids):
+            cursor = self.employers.find({"id": {"$in": list(employer_ids - found)}}, {"_id": 0, "id": 1})
+            found.update([employer["id"] async for employer in cursor])
+        return found
+
+    async def get(self, employer_id: str) -> Optional[Dict[str, Any]]:
+        return await self.cache.get_or_load(
+            employer_id, lambda: self.employers.find_one({"id": employer_id}, EMPLOYER_PROJECTION)
+        )
+
+    async def rate(self, employer_id: str, user_id: str, rating: float) -> Optional[Dict[str, Any]]:
+        """Record ``user_id``'s rating and return the employer's new aggregates.
+
+        Returns None if there is no such employer.
+        """
+        if not await self.employers.count_documents({"id": employer_id}, limit=1):
+            return None
+        now = utcnow()
+        try:
+            previous = await self._replace_rating(employer_id, user_id, rating, now)
+        except DuplicateKeyError:
+            # A concurrent first rating by the same user won the upsert
+            previous = await self._replace_rating(employer_id, user_id, rating, now)
+        count_delta = 0 if previous else 1
+        sum_delta = rating - (previous["rating"] if previous else 0.0)
+        employer = await self.employers.find_one_and_update(
+            {"id": employer_id},
+            [
+                {"$set": {
+                    "rating_count": {"$add": [{"$ifNull": ["$rating_count", 0]}, count_delta]},
+                    "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", 0]}, sum_delta]},
+                    "updated_at": now,
+                }},
+                {"$set": {"rating": {"$divide": ["$rating_sum", {"$max": ["$rating_count", 1]}]}}},
+            ],
+            projection=EMPLOYER_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.cache.invalidate(employer_id)
+        return employer
+
+    async def _replace_rating(self, employer_id: str, user_id: str, rating: float, now: datetime):
+        """Store the user's rating and return the one it replaced, if any"""
+        return await self.ratings.find_one_and_update(
+            {"employer_id": employer_id, "user_id": user_id},
+            {"$set": {"rating": rating, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def attach(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fill in each job's ``employer`` and ``employer_rating`` in place.
+
+        Jobs without ``employer_id`` (not yet migrated) keep their own copies.
+        """
+        employers = {}
+        missing = []
+        for employer_id in {job["employer_id"] for job in jobs if job.get("employer_id")}:
+            employer = self.cache.get(employer_id)
+            if employer is None:
+                missing.append(employer_id)
+            else:
+                employers[employer_id] = employer
+        if missing:
+            async for employer in self.employers.find({"id": {"$in": missing}}, EMPLOYER_PROJECTION):
+                self.cache.set(employer["id"], employer)
+                employers[employer["id"]] = employer
+        for job in jobs:
+            employer_id = job.get("employer_id")
+            if employer_id:
+                employer = employers.get(employer_id, {})
+                job["employer"] = employer.get("name", "")
+                job["employer_rating"] = round(employer.get("rating", 0.0), 2)
+        return jobs
+
+    def invalidate(self, change: Optional[Dict[str, Any]]):
+        """Drop cached employers affected by a change to the employers collection"""
+        document = change.get("fullDocument") if change else None
+        if document and "id" in document:
+            self.cache.invalidate(document["id"])
+        else:
+            self.cache.clear()
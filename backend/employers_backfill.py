@@ -0,0 +1,67 @@
+"""One-off migration of jobs' copied employer names and ratings to ``employers``.
+
+Creates one employer per distinct ``employer`` name on jobs without an
+``employer_id`` (reusing an existing employer of that name), seeded with
+the average of the ratings copied into its jobs as one rating. The jobs
+then get the employer's ``employer_id`` and lose their copies.
+
+    python employers_backfill.py
+"""
+import argparse
+import asyncio
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from cache import CollectionVersions
+from employers import EmployerDirectory
+
+
+async def backfill(jobs_collection, directory: EmployerDirectory, keep_copies: bool = False):
+    pipeline = [
+        {"$match": {"employer_id": {"$exists": False}, "employer": {"$type": "string"}}},
+        {"$group": {"_id": "$employer", "rating": {"$avg": "$employer_rating"}}},
+    ]
+    created = migrated = 0
+    async for group in jobs_collection.aggregate(pipeline):
+        name = group["_id"]
+        employer = await directory.employers.find_one({"name": name}, {"id": 1})
+        if employer is None:
+            try:
+                employer = await directory.create(name, group["rating"])
+                created += 1
+            except DuplicateKeyError:
+                # Created by the API since, for a new job under this name
+                employer = await directory.employers.find_one({"name": name}, {"id": 1})
+        update = {"$set": {"employer_id": employer["id"]}}
+        if not keep_copies:
+            update["$unset"] = {"employer": "", "employer_rating": ""}
+        result = await jobs_collection.update_many({"employer": name, "employer_id": {"$exists": False}}, update)
+        migrated += result.modified_count
+    return {"employers": created, "jobs": migrated}
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    try:
+        db = client[os.environ.get('MONGO_DB', 'wolk_db')]
+        directory = EmployerDirectory(db.employers, db.employer_ratings)
+        await directory.ensure_indexes()
+        result = await backfill(db.jobs, directory, args.keep_copies)
+        if result["jobs"]:
+            versions = CollectionVersions(db.collection_versions)
+            await versions.bump("jobs")
+            await versions.bump("employers")
+    finally:
+        client.close()
+    print(f"✅ Linked {result['jobs']} jobs to employers, {result['employers']} employers created")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--keep-copies", action="store_true",
+        help="Leave employer and employer_rating on the jobs, e.g. while older API versions still run"
+    )
+    asyncio.run(main(parser.parse_args()))
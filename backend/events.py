@@ -0,0 +1,159 @@
+"""Fan-out of job, match and payment events to server-sent event streams.
+
+``EventBroker`` keeps every open stream as a ``Subscription`` indexed by
+the job categories and the user it asked for, so publishing an event only
+touches the subscriptions that want it. Each event is encoded as an SSE
+frame once and the same bytes are queued for every recipient.
+
+Queues are bounded. ``publish`` never waits: when a subscriber's queue is
+full the event is dropped for that subscriber and counted, and the stream
+sends a ``lagged`` event before its next one so the client knows to
+refetch. One slow client therefore never holds up the others.
+"""
+import asyncio
+import itertools
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set
+
+import orjson
+
+# Event types
+JOB = "job"
+MATCH = "match"
+PAYMENT = "payment"
+RESYNC = "resync"
+LAGGED = "lagged"
+
+
+def sse_frame(event_id: Optional[int], kind: str, data: Dict[str, Any]) -> bytes:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {kind}\n".encode() + b"data: " + orjson.dumps(data, option=orjson.OPT_NAIVE_UTC) + b"\n\n"
+
+
+class Subscription:
+    __slots__ = ("categories", "user_id", "queue", "dropped")
+
+    def __init__(self, categories: Optional[Set[str]], user_id: Optional[str], queue_size: int):
+        # None receives jobs in every category
+        self.categories = categories
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def offer(self, frame: bytes) -> bool:
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+
+class EventBroker:
+    def __init__(self, queue_size: int = 100, max_subscribers: int = 10000):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._ids = itertools.count(1)
+        self._subscriptions: Set[Subscription] = set()
+        self._all_categories: Set[Subscription] = set()
+        self._by_category: Dict[str, Set[Subscription]] = {}
+        self._by_user: Dict[str, Set[Subscription]] = {}
+        self._pending_resyncs: Dict[str, asyncio.TimerHandle] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    @property
+    def full(self) -> bool:
+        return len(self._subscriptions) >= self.max_subscribers
+
+    def subscribe(self, categories: Optional[Iterable[str]] = None, user_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(set(categories) if categories else None, user_id, self.queue_size)
+        self._subscriptions.add(subscription)
+        if subscription.categories is None:
+            self._all_categories.add(subscription)
+        else:
+            for category in subscription.categories:
+                self._by_category.setdefault(category, set()).add(subscription)
+        if user_id:
+            self._by_user.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+        self._all_categories.discard(subscription)
+        for category in subscription.categories or ():
+            self._discard(self._by_category, category, subscription)
+        if subscription.user_id:
+            self._discard(self._by_user, subscription.user_id, subscription)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[Subscription]], key: str, subscription: Subscription):
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del index[key]
+
+    def _deliver(self, kind: str, data: Dict[str, Any], subscribers: Iterable[Subscription]):
+        frame = sse_frame(next(self._ids), kind, data)
+        self.published += 1
+        for subscription in subscribers:
+            if subscription.offer(frame):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+
+    def publish_job(self, data: Dict[str, Any], category: Optional[str]):
+        """Send a job event to streams following ``category`` or all jobs"""
+        subscribers = self._all_categories
+        if category in self._by_category:
+            subscribers = subscribers | self._by_category[category]
+        self._deliver(JOB, data, subscribers)
+
+    def publish_user(self, kind: str, data: Dict[str, Any], user_id: Optional[str]):
+        """Send a match or payment event to ``user_id``'s streams"""
+        subscribers = self._by_user.get(user_id) if user_id else None
+        if subscribers:
+            self._deliver(kind, data, list(subscribers))
+
+    def publish_resync(self, scope: str, users_only: bool = False, delay: float = 0.0):
+        """Tell clients something in ``scope`` changed that we cannot describe.
+
+        With ``delay``, resyncs of ``scope`` within ``delay`` seconds are sent
+        as one, e.g. for a batch of deletes.
+        """
+        if delay > 0:
+            if scope not in self._pending_resyncs:
+                self._pending_resyncs[scope] = asyncio.get_running_loop().call_later(
+                    delay, self._send_pending_resync, scope, users_only
+                )
+            return
+        subscribers = [s for s in self._subscriptions if s.user_id] if users_only else list(self._subscriptions)
+        self._deliver(RESYNC, {"scope": scope}, subscribers)
+
+    def _send_pending_resync(self, scope: str, users_only: bool):
+        del self._pending_resyncs[scope]
+        self.publish_resync(scope, users_only)
+
+    async def stream(self, categories: Optional[Iterable[str]] = None, user_id: Optional[str] = None,
+                     heartbeat: float = 15.0) -> AsyncIterator[bytes]:
+        """SSE body of one subscription, which lasts as long as the stream"""
+        subscription = self.subscribe(categories, user_id)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield b": keepalive\n\n"
+                    continue
+                if subscription.dropped:
+                    yield sse_frame(None, LAGGED, {"dropped": subscription.dropped})
+                    subscription.dropped = 0
+                yield frame
+        finally:
+            self.unsubscribe(subscription)
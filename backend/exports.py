@@ -0,0 +1,72 @@
+"""Constant-memory streaming of Motor cursors as NDJSON or CSV.
+
+Documents are encoded one at a time and flushed in chunks of roughly
+``chunk_size`` bytes, so memory use depends on the chunk size and the
+cursor's batch size, never on the number of rows exported.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Sequence
+
+from bson import ObjectId
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot export {type(value).__name__}")
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def _chunked(cursor, encode) -> AsyncIterator[str]:
+    buffer = []
+    size = 0
+    try:
+        async for document in cursor:
+            line = encode(document)
+            buffer.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_SIZE:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # Release the server-side cursor if the client disconnects early
+        await cursor.close()
+
+
+def ndjson_stream(cursor) -> AsyncIterator[str]:
+    return _chunked(
+        cursor,
+        lambda document: json.dumps(document, default=_json_default, separators=(",", ":")) + "\n",
+    )
+
+
+async def csv_stream(cursor, columns: Sequence[str]) -> AsyncIterator[str]:
+    row_buffer = io.StringIO()
+    writer = csv.writer(row_buffer)
+
+    def encode(document: Dict[str, Any]) -> str:
+        row_buffer.seek(0)
+        row_buffer.truncate()
+        writer.writerow([_csv_value(document.get(column)) for column in columns])
+        return row_buffer.getvalue()
+
+    yield encode({column: column for column in columns})
+    async for chunk in _chunked(cursor, encode):
+        yield chunk
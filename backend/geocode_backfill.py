@@ -0,0 +1,90 @@
+"""One-off backfill of GeoJSON points for jobs that only have a city string.
+
+Looks each job's ``location`` up in a local gazetteer CSV (columns
+``location,latitude,longitude``), so no geocoding service is called, and
+writes the points back with unordered bulk updates.
+
+    python geocode_backfill.py --gazetteer data/gazetteer.csv
+"""
+import argparse
+import asyncio
+import csv
+import os
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from cache import CollectionVersions
+
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.csv')
+
+
+def normalize_location(location: str) -> str:
+    return " ".join(location.replace(",", " ").lower().split())
+
+
+def load_gazetteer(path: str) -> Dict[str, List[float]]:
+    """Map normalized location names to [longitude, latitude]"""
+    places = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            places[normalize_location(row["location"])] = [float(row["longitude"]), float(row["latitude"])]
+    return places
+
+
+def geocode(location: str, places: Dict[str, List[float]]) -> Optional[Dict]:
+    coordinates = places.get(normalize_location(location))
+    if coordinates is None:
+        return None
+    return {"type": "Point", "coordinates": coordinates}
+
+
+async def backfill(jobs_collection, places: Dict[str, List[float]], batch_size: int = 1000, overwrite: bool = False):
+    query = {} if overwrite else {"geo": {"$exists": False}}
+    updated = unmatched = 0
+    unknown = set()
+    batch = []
+
+    async def flush():
+        nonlocal updated
+        if batch:
+            result = await jobs_collection.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch.clear()
+
+    async for job in jobs_collection.find(query, {"_id": 1, "location": 1}):
+        point = geocode(job.get("location", ""), places)
+        if point is None:
+            unmatched += 1
+            unknown.add(job.get("location"))
+            continue
+        batch.append(UpdateOne({"_id": job["_id"]}, {"$set": {"geo": point}}))
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+
+    return {"updated": updated, "unmatched": unmatched, "unknown_locations": sorted(filter(None, unknown))}
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    try:
+        db = client[os.environ.get('MONGO_DB', 'wolk_db')]
+        result = await backfill(db.jobs, load_gazetteer(args.gazetteer), args.batch_size, args.overwrite)
+        if result["updated"]:
+            # Revalidates cached feeds, whose jobs gained coordinates
+            await CollectionVersions(db.collection_versions).bump("jobs")
+    finally:
+        client.close()
+    print(f"✅ Geocoded {result['updated']} jobs, {result['unmatched']} without a gazetteer match")
+    for location in result["unknown_locations"]:
+        print(f"   Unknown location: {location}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--gazetteer", default=DEFAULT_GAZETTEER)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--overwrite", action="store_true", help="Re-geocode jobs that already have a point")
+    asyncio.run(main(parser.parse_args()))
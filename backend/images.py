@@ -0,0 +1,375 @@
+"""Resized job card images served from a local disk cache.
+
+Job images are full-size photos. ``ImagePipeline`` fetches a job's original
+once, resizes it to the fixed card sizes in ``VARIANTS`` as WebP or JPEG,
+and keeps originals and variants in a ``DiskCache``. Resizing runs in a
+process pool so decoding large photos never blocks the event loop.
+
+The cache is content-addressed: an original is stored under the SHA-256 of
+its bytes and its variants under that digest plus the variant, format and
+quality, so a file's name fixes its content and doubles as a strong ETag.
+A small ``.url`` file maps each source URL to its original's digest. Once
+the cache grows past ``max_bytes``, the least recently used files go first.
+API processes may share the cache directory; each tracks the files it has
+seen and evicts among those. File reads, writes and deletes run in the
+default thread pool; only the LRU bookkeeping happens on the event loop.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from cache import TTLCache
+
+logger = logging.getLogger("wolk.images")
+
+# Card sizes as (width, height); images are cropped to fill them
+VARIANTS = {"card": (600, 800), "thumb": (150, 200)}
+FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+# Larger sources are refused rather than decoded
+MAX_SOURCE_PIXELS = 50_000_000
+
+
+class ImageError(Exception):
+    """Raised when a job's image cannot be fetched or decoded"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def resize(data: bytes, width: int, height: int, format: str, quality: int) -> bytes:
+    """Crop and scale an encoded image to fill ``width`` x ``height``.
+
+    Runs in the worker processes; Pillow is only imported there.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEGs decode straight to as little as 1/8 scale, far cheaper than resizing
+        # after; square so it still covers the card if EXIF rotates the image
+        longest = max(width, height)
+        image.draft("RGB", (longest, longest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image)
+        image = ImageOps.fit(image.convert("RGB"), (width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        if format == "webp":
+            image.save(output, "WEBP", quality=quality, method=4)
+        else:
+            image.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+class DiskCache:
+    """Files under ``directory``, named by their caller, evicted LRU past ``max_bytes``"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def path(self, name: str) -> str:
+        # Fanned out so no directory holds too many files
+        return os.path.join(self.directory, name[:2], name)
+
+    def scan(self) -> List[Tuple[float, str, int]]:
+        """``(mtime, name, size)`` of the files on disk; blocking, so run in a thread"""
+        found = []
+        os.makedirs(self.directory, exist_ok=True)
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        return found
+
+    async def load(self, found: List[Tuple[float, str, int]]):
+        """Index files found by ``scan``, behind the ones used since"""
+        for _, name, size in sorted(found, reverse=True):
+            if name not in self._entries:
+                self._entries[name] = size
+                self._entries.move_to_end(name, last=False)
+                self.size += size
+        await self._evict()
+
+    @staticmethod
+    async def _blocking(function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    @staticmethod
+    def _read_file(path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed so readers never see a partial file
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except FileNotFoundError:
+                pass
+            raise
+
+    @staticmethod
+    def _remove_files(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def read(self, name: str) -> Optional[bytes]:
+        data = await self._blocking(self._read_file, self.path(name))
+        if data is None:
+            # Evicted, possibly by another process
+            self._forget(name)
+            return None
+        if name not in self._entries:
+            self._entries[name] = len(data)
+            self.size += len(data)
+        self._entries.move_to_end(name)
+        return data
+
+    async def exists(self, name: str) -> bool:
+        return await self._blocking(os.path.exists, self.path(name))
+
+    async def write(self, name: str, data: bytes):
+        await self._blocking(self._write_file, self.path(name), data)
+        self._forget(name)
+        self._entries[name] = len(data)
+        self.size += len(data)
+        await self._evict()
+
+    def _forget(self, name: str):
+        size = self._entries.pop(name, None)
+        if size is not None:
+            self.size -= size
+
+    async def _evict(self):
+        evicted = []
+        while self.size > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            evicted.append(self.path(name))
+        if evicted:
+            await self._blocking(self._remove_files, evicted)
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest() + ".url"
+
+
+class ImagePipeline:
+    """Fetches, resizes and caches job images.
+
+    Only ``https`` URLs on ``allowed_hosts`` are fetched, so job posters
+    cannot point the API at internal addresses.
+    """
+
+    def __init__(
+        self,
+        cache: DiskCache,
+        allowed_hosts: Iterable[str],
+        workers: int = 2,
+        quality: int = 80,
+        max_source_bytes: int = 10 * 1024 * 1024,
+        timeout: float = 10.0,
+        failure_ttl: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.cache = cache
+        self.allowed_hosts = frozenset(allowed_hosts)
+        self.workers = workers
+        self.quality = quality
+        self.max_source_bytes = max_source_bytes
+        self.timeout = timeout
+        # Custom transport, e.g. one serving local image fixtures
+        self.transport = transport
+        self.renders = 0
+        # Sources that recently failed, so they are not fetched on every request
+        self._failures = TTLCache(max_size=10000, ttl=failure_ttl)
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._loading: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+
+    async def _load(self):
+        try:
+            found = await asyncio.get_running_loop().run_in_executor(None, self.cache.scan)
+        except OSError as e:
+            logger.warning("Indexing the image cache failed", extra={"error": str(e)})
+            return
+        await self.cache.load(found)
+        logger.info("Image cache indexed", extra={"files": len(self.cache), "bytes": self.cache.size})
+
+    async def close(self):
+        if self._loading is not None:
+            self._loading.cancel()
+            try:
+                await self._loading
+            except asyncio.CancelledError:
+                pass
+            self._loading = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout, follow_redirects=False, transport=self.transport
+            )
+        return self._client
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned rather than forked: the API process runs threads (e.g. MongoDB monitors)
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def allowed(self, url: str) -> bool:
+        """Whether ``url`` is one the pipeline will fetch"""
+        parts = urlsplit(url)
+        return parts.scheme == "https" and parts.hostname in self.allowed_hosts
+
+    def variant_name(self, digest: str, variant: str, format: str) -> str:
+        return f"{digest}.{variant}.q{self.quality}.{format}"
+
+    async def cached_etag(self, url: str, variant: str, format: str) -> Optional[str]:
+        """The ETag of a variant already in the cache, without reading it"""
+        digest = await self.cache.read(url_key(url))
+        if digest is None:
+            return None
+        name = self.variant_name(digest.decode(), variant, format)
+        return f'"{name}"' if await self.cache.exists(name) else None
+
+    async def get(self, url: str, variant: str, format: str) -> Tuple[str, bytes]:
+        """The ``(etag, body)`` of ``url`` resized to ``variant`` in ``format``"""
+        digest = await self.cache.read(url_key(url))
+        if digest is not None:
+            name = self.variant_name(digest.decode(), variant, format)
+            data = await self.cache.read(name)
+            if data is not None:
+                return f'"{name}"', data
+        failure = self._failures.get(url)
+        if failure is not None:
+            raise ImageError(*failure)
+        try:
+            return await self._single_flight(
+                ("variant", url, variant, format), lambda: self._render(url, variant, format)
+            )
+        except ImageError as e:
+            if e.status_code != 503:
+                self._failures.set(url, (str(e), e.status_code))
+            raise
+
+    async def _single_flight(self, key: Tuple, work: Callable[[], Awaitable]):
+        """Run ``work`` once for concurrent callers asking for the same ``key``"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(work())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller going away does not cancel the others' work
+        return await asyncio.shield(future)
+
+    async def _render(self, url: str, variant: str, format: str) -> Tuple[str, bytes]:
+        digest, original = await self._single_flight(("source", url), lambda: self._original(url))
+        name = self.variant_name(digest, variant, format)
+        data = await self.cache.read(name)
+        if data is None:
+            width, height = VARIANTS[variant]
+            start = time.perf_counter()
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(
+                    self._get_pool(), resize, original, width, height, format, self.quality
+                )
+            except BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory); start a fresh pool next time
+                logger.warning("Image worker pool broke", extra={"error": str(e)})
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+                raise ImageError("Image resizing failed, retry shortly", status_code=503)
+            except Exception as e:
+                logger.warning("Resizing image failed", extra={"url": url, "error": str(e)})
+                raise ImageError("Could not decode the job's image")
+            self.renders += 1
+            logger.debug("Image resized", extra={
+                "variant": variant, "format": format, "bytes": len(data),
+                "ms": round((time.perf_counter() - start) * 1000, 1),
+            })
+            await self.cache.write(name, data)
+        return f'"{name}"', data
+
+    async def _original(self, url: str) -> Tuple[str, bytes]:
+        """The digest and bytes of ``url``, fetched into the cache unless there"""
+        key = url_key(url)
+        digest = await self.cache.read(key)
+        if digest is not None:
+            data = await self.cache.read(digest.decode())
+            if data is not None:
+                return digest.decode(), data
+        data = await self._fetch(url)
+        digest = hashlib.sha256(data).hexdigest()
+        await self.cache.write(digest, data)
+        await self.cache.write(key, digest.encode())
+        return digest, data
+
+    async def _fetch(self, url: str) -> bytes:
+        if not self.allowed(url):
+            raise ImageError("The job's image is not on an allowed host", status_code=404)
+        try:
+            async with self._get_client().stream("GET", url) as response:
+                if response.status_code != 200:
+                    raise ImageError(f"Image source returned {response.status_code}")
+                chunks, size = [], 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_source_bytes:
+                        raise ImageError("The job's image is too large")
+                    chunks.append(chunk)
+        except httpx.HTTPError as e:
+            logger.warning("Fetching image failed", extra={"url": url, "error": str(e)})
+            raise ImageError("Could not fetch the job's image")
+        return b"".join(chunks)
@@ -0,0 +1,186 @@
+"""Constant-memory bulk import of NDJSON or CSV uploads.
+
+The request body is read chunk by chunk and split into rows as it arrives.
+Each row is validated on its own and valid rows are written with unordered
+``insert_many`` calls of ``chunk_size`` documents. One chunk is written
+while the next is being parsed, and nothing else is held, so memory use
+depends on the chunk size and never on the size of the upload.
+
+Bad rows do not stop an import: validation failures, rows ``prepare``
+rejects and rows the database refuses (such as duplicate IDs) are reported
+by row number, up to ``max_errors`` of them.
+"""
+import asyncio
+import codecs
+import csv
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Type, Union
+
+import orjson
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY_ERROR = 11000
+
+Row = Tuple[int, Union[Dict[str, Any], str]]
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode UTF-8 ``chunks`` into lines, without their line endings"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line[:-1] if line.endswith("\r") else line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending[:-1] if pending.endswith("\r") else pending
+
+
+async def ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """``(line number, object)`` per non-blank line, or an error message"""
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        yield number, row if isinstance(row, dict) else "Expected a JSON object"
+
+
+async def csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Row]:
+    """``(record number, row)`` per CSV record after the header row.
+
+    Records are numbered from 1 for the header, as spreadsheets do. Quoted
+    fields may span lines. Empty fields are left out of the row, so they
+    take the model's defaults.
+    """
+    header: Optional[List[str]] = None
+    number = 0
+    record: List[str] = []
+    async for line in lines:
+        record.append(line)
+        # An odd number of quotes means a quoted field continues on the next line
+        if sum(part.count('"') for part in record) % 2:
+            continue
+        text = "\n".join(record)
+        record = []
+        number += 1
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield number, f"Expected {len(header)} fields, got {len(values)}"
+            continue
+        yield number, {name: value for name, value in zip(header, values) if value != ""}
+    if record:
+        yield number + 1, "Unterminated quoted field"
+
+
+def describe(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc']) or 'row'}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+class JobImporter:
+    """Validates rows against ``model`` and inserts them in chunks.
+
+    ``prepare(models)`` turns a chunk of validated models into documents,
+    returning a document or an error message for each.
+    """
+
+    def __init__(
+        self,
+        collection,
+        model: Type[BaseModel],
+        prepare: Callable[[List[BaseModel]], Awaitable[List[Union[Dict[str, Any], str]]]],
+        chunk_size: int = 1000,
+        max_errors: int = 100,
+    ):
+        self.collection = collection
+        self.model = model
+        self.prepare = prepare
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def _error(self, number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": number, "error": message})
+
+    async def run(self, rows: AsyncIterator[Row]) -> Dict[str, Any]:
+        numbers: List[int] = []
+        models: List[BaseModel] = []
+        writing: Optional[asyncio.Task] = None
+        try:
+            async for number, row in rows:
+                self.rows += 1
+                if isinstance(row, str):
+                    self._error(number, row)
+                    continue
+                try:
+                    models.append(self.model.model_validate(row))
+                except ValidationError as e:
+                    self._error(number, describe(e))
+                    continue
+                numbers.append(number)
+                if len(models) >= self.chunk_size:
+                    if writing is not None:
+                        await writing
+                    writing = asyncio.ensure_future(self._write(numbers, models))
+                    numbers, models = [], []
+            if writing is not None:
+                await writing
+                writing = None
+            if models:
+                await self._write(numbers, models)
+        finally:
+            if writing is not None and not writing.done():
+                writing.cancel()
+        return self.report()
+
+    async def _write(self, numbers: List[int], models: List[BaseModel]):
+        documents, document_numbers = [], []
+        for number, prepared in zip(numbers, await self.prepare(models)):
+            if isinstance(prepared, str):
+                self._error(number, prepared)
+            else:
+                documents.append(prepared)
+                document_numbers.append(number)
+        if not documents:
+            return
+        try:
+            await self.collection.insert_many(documents, ordered=False)
+            self.inserted += len(documents)
+        except BulkWriteError as e:
+            self.inserted += e.details.get("nInserted", 0)
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    message = "A job with this id already exists"
+                else:
+                    message = error.get("errmsg", "Write failed")
+                self._error(document_numbers[error["index"]], message)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
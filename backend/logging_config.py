@@ -0,0 +1,130 @@
+"""Structured, sampled logging for the Wolk API.
+
+Records are emitted as one JSON object per line, with anything passed via
+``extra=`` as top-level fields. Two things keep logging cheap under load:
+
+* ``SamplingFilter`` lets through at most ``burst`` records per second for
+  each message template below WARNING and counts the rest, reporting the
+  count as ``suppressed`` on the next record that gets through.
+* Formatting and I/O happen on a ``QueueListener`` thread, so the event
+  loop only pays for enqueueing a record.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_SAMPLE_BURST = int(os.environ.get('LOG_SAMPLE_BURST', '20'))
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """``QueueHandler`` keeping a record's traceback apart from its message.
+
+    The stock ``prepare`` appends the traceback to ``msg`` and drops
+    ``exc_info``, which would leave ``JSONFormatter`` no ``exc`` to emit.
+    Here the traceback is formatted into ``exc_text`` instead, before the
+    record crosses to the listener thread.
+    """
+
+    _formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Caps each message template at ``burst`` records per second.
+
+    WARNING and above always pass.
+    """
+
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.clock = clock
+        self._lock = threading.Lock()
+        # template -> [window start, emitted in window, suppressed]
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.burst <= 0:
+            return True
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(record.msg)
+            if window is None or now - window[0] >= 1.0:
+                suppressed = window[2] if window else 0
+                window = self._windows[record.msg] = [now, 0, suppressed]
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed = window[2]
+                window[2] = 0
+        return True
+
+
+_listener = None
+
+
+def configure_logging(level: str = LOG_LEVEL, stream=None):
+    """Route the ``wolk`` loggers through the sampling filter and a queue"""
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JSONFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    logger = logging.getLogger("wolk")
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,288 @@
+"""Prometheus-style metrics for the Wolk API.
+
+A small in-process registry rendered in the Prometheus text exposition
+format at ``/metrics``. Metrics are updated from the event loop and from
+pymongo's monitoring threads, so every update goes through one lock.
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = registry.lock
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterable[str]:
+        return ()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class CallbackMetric(_Metric):
+    """Metric read at scrape time from ``callback() -> {label values: value}``.
+
+    Used to export counters that other components already keep, such as
+    cache hit counts. ``callback`` runs under the registry lock and must not
+    update metrics itself.
+    """
+
+    def __init__(self, registry, name, documentation, labelnames, callback: Callable[[], Dict[LabelValues, float]],
+                 kind: str = "gauge"):
+        super().__init__(registry, name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def _samples(self):
+        for key, value in sorted(self.callback().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts, then sum and count
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in self._metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter(
+    REGISTRY, "wolk_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    REGISTRY, "wolk_http_request_duration_seconds", "HTTP request latency by route", ["method", "route"]
+)
+MONGO_LATENCY = Histogram(
+    REGISTRY, "wolk_mongo_command_duration_seconds", "MongoDB command latency by collection",
+    ["collection", "command"]
+)
+MONGO_ERRORS = Counter(
+    REGISTRY, "wolk_mongo_command_errors_total", "Failed MongoDB commands by collection", ["collection", "command"]
+)
+PI_API_LATENCY = Histogram(
+    REGISTRY, "wolk_pi_api_request_duration_seconds", "Pi API call latency by operation", ["operation"]
+)
+PI_API_ERRORS = Counter(
+    REGISTRY, "wolk_pi_api_errors_total", "Failed Pi API calls by operation and status", ["operation", "status"]
+)
+TASKS_PROCESSED = Counter(
+    REGISTRY, "wolk_tasks_processed_total", "Queued task attempts by kind and outcome", ["kind", "outcome"]
+)
+TASK_DURATION = Histogram(
+    REGISTRY, "wolk_task_duration_seconds", "Queued task handler latency by kind", ["kind"]
+)
+DECK_RANK_LATENCY = Histogram(
+    REGISTRY, "wolk_deck_rank_duration_seconds", "Time to score and pick one ranked deck",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+DECK_RANK_TRUNCATED = Counter(
+    REGISTRY, "wolk_deck_rank_truncated_total", "Ranked decks that hit the latency budget before scoring every job"
+)
+REQUESTS_REJECTED = Counter(
+    REGISTRY, "wolk_http_requests_rejected_total", "Requests turned away by rate limits or admission control",
+    ["route", "reason"]
+)
+COMPRESSED_BYTES = Counter(
+    REGISTRY, "wolk_http_compressed_bytes_total", "Bytes of compressed response bodies, before and after, by encoding",
+    ["encoding", "stage"]
+)
+EVENT_LOOP_LAG = Histogram(
+    REGISTRY, "wolk_event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Label by route template so /api/jobs/{job_id} is one series
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=method, route=path)
+            HTTP_REQUESTS.inc(method=method, route=path, status=status)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener timing every command by collection"""
+
+    def __init__(self):
+        self._collections: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if isinstance(target, str):
+            self._collections[(event.connection_id, event.request_id)] = target
+
+    def _finish(self, event) -> str:
+        return self._collections.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if collection:
+            MONGO_LATENCY.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection:
+            MONGO_LATENCY.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+            MONGO_ERRORS.inc(collection=collection, command=event.command_name)
+
+
+class EventLoopLagMonitor:
+    """Measures how late ``asyncio.sleep(interval)`` wakes up"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start - self.interval))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
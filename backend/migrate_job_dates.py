@@ -0,0 +1,95 @@
+"""One-off migration of jobs' string dates to real dates.
+
+Converts ``deadline`` and ``created_at`` stored as ISO strings to datetimes
+(a bare deadline date lasts until the end of that day, UTC), marks jobs
+without a ``status`` open, and drops the feed indexes the partial live-job
+indexes replace. Run it before starting the API version that archives
+expired jobs; jobs already migrated are skipped, so it can be rerun.
+
+    python migrate_job_dates.py
+"""
+import argparse
+import asyncio
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from archive import OPEN, to_datetime
+from cache import CollectionVersions
+
+# Superseded by the live_feed and live_category_feed partial indexes
+OLD_FEED_INDEXES = ["created_at_-1_id_-1", "category_1_created_at_-1_id_-1"]
+
+
+def date_updates(job) -> dict:
+    updates = {}
+    for field, end_of_day in (("deadline", True), ("created_at", False)):
+        value = job.get(field)
+        if isinstance(value, str):
+            try:
+                updates[field] = to_datetime(value, end_of_day=end_of_day)
+            except ValueError:
+                pass
+    if "status" not in job:
+        updates["status"] = OPEN
+    return updates
+
+
+async def migrate(jobs_collection, batch_size: int = 1000):
+    query = {"$or": [
+        {"deadline": {"$type": "string"}},
+        {"created_at": {"$type": "string"}},
+        {"status": {"$exists": False}},
+    ]}
+    migrated = unparsable = 0
+    batch = []
+    async for job in jobs_collection.find(query, {"deadline": 1, "created_at": 1, "status": 1}):
+        updates = date_updates(job)
+        if isinstance(updates.get("deadline", job.get("deadline")), str):
+            unparsable += 1
+        if updates:
+            batch.append(UpdateOne({"_id": job["_id"]}, {"$set": updates}))
+        if len(batch) >= batch_size:
+            migrated += (await jobs_collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        migrated += (await jobs_collection.bulk_write(batch, ordered=False)).modified_count
+    return {"jobs": migrated, "unparsable": unparsable}
+
+
+async def drop_old_indexes(jobs_collection):
+    dropped = []
+    for name in OLD_FEED_INDEXES:
+        try:
+            await jobs_collection.drop_index(name)
+            dropped.append(name)
+        except OperationFailure:
+            pass  # Never created, or dropped already
+    return dropped
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    try:
+        db = client[os.environ.get('MONGO_DB', 'wolk_db')]
+        result = await migrate(db.jobs, args.batch_size)
+        if result["jobs"]:
+            await CollectionVersions(db.collection_versions).bump("jobs")
+        dropped = [] if args.keep_indexes else await drop_old_indexes(db.jobs)
+    finally:
+        client.close()
+    print(f"✅ Migrated {result['jobs']} jobs, dropped indexes: {', '.join(dropped) or 'none'}")
+    if result["unparsable"]:
+        print(f"⚠️  {result['unparsable']} jobs have a deadline that is not an ISO date; they are left out of the feed but never archived")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--keep-indexes", action="store_true",
+        help="Keep the old feed indexes, e.g. while older API versions still run"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+"""Keyset (cursor) pagination helpers.
+
+Cursors are opaque to clients: the sort key values of the last item on a
+page, JSON-encoded and base64url-wrapped. The next page is fetched with a
+range query on those values, so it costs one index seek no matter how deep
+the client has paged.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# (field, direction) pairs, using pymongo's 1 / -1 directions
+SortSpec = Sequence[Tuple[str, int]]
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def _decode_value(obj):
+    if set(obj) == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), default=_encode_value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: SortSpec) -> List[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded), object_hook=_decode_value)
+    except (binascii.Error, ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise InvalidCursor("Cursor does not match sort order")
+    return values
+
+
+def cursor_for(document: Dict[str, Any], sort: SortSpec) -> str:
+    return encode_cursor([document.get(field) for field, _ in sort])
+
+
+def keyset_filter(values: Sequence[Any], sort: SortSpec) -> Dict[str, Any]:
+    """Build the filter selecting documents strictly after ``values``.
+
+    For a sort of ``[(a, -1), (b, -1)]`` this is
+    ``a < va OR (a == va AND b < vb)``.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {"$lt" if direction < 0 else "$gt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def apply_cursor(query: Dict[str, Any], cursor: Optional[str], sort: SortSpec) -> Dict[str, Any]:
+    """Return ``query`` narrowed to the page after ``cursor``"""
+    if not cursor:
+        return query
+    after = keyset_filter(decode_cursor(cursor, sort), sort)
+    if not query:
+        return after
+    return {"$and": [query, after]}
+
+
+def split_page(documents: List[Dict[str, Any]], limit: int, sort: SortSpec):
+    """Trim ``limit + 1`` fetched documents to a page and its next cursor"""
+    if len(documents) > limit:
+        documents = documents[:limit]
+        return documents, cursor_for(documents[-1], sort)
+    return documents, None
+
+
+async def fetch_page(collection, query: Dict[str, Any], sort: SortSpec, limit: int,
+                     cursor: Optional[str] = None, projection=None):
+    """Fetch one page of ``collection`` and the cursor for the next one.
+
+    Reads ``limit + 1`` documents so the presence of a next page is known
+    without a second count query.
+    """
+    documents = []
+    mongo_cursor = (
+        collection.find(apply_cursor(query, cursor, sort), projection)
+        .sort(list(sort))
+        .limit(limit + 1)
+    )
+    async for document in mongo_cursor:
+        documents.append(document)
+    return split_page(documents, limit, sort)
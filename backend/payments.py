@@ -0,0 +1,367 @@
+"""Payment state machine and background reconciler.
+
+Every Pi payment has one document in ``transactions`` (unique on
+``payment_id``) that moves through
+
+    approved -> completing -> completed
+                           -> failed
+
+Each transition is a single conditional update that only matches the
+expected current state, so retried requests and duplicate Pi callbacks can
+never create a second row or move a payment backwards. Payments left in
+``completing`` (e.g. the Pi API timed out mid-request) or approved but never
+completed are picked up by ``PaymentReconciler``, which polls the Pi API in
+batches in the background.
+
+``PaymentService`` performs approvals and completions themselves. The API
+only enqueues them as ``APPROVE_TASK`` / ``COMPLETE_TASK`` on the task queue,
+and worker processes run them through ``payment_task_handlers``.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from pi_client import PiAPIError
+from task_queue import TaskRejected
+
+logger = logging.getLogger("wolk.payments")
+
+APPROVED = "approved"
+COMPLETING = "completing"
+COMPLETED = "completed"
+FAILED = "failed"
+
+APPROVE_TASK = "payments.approve"
+COMPLETE_TASK = "payments.complete"
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused for a different payment"""
+
+
+class PaymentRejected(TaskRejected):
+    """Raised when the Pi API refuses a payment for good; not retried"""
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def pi_outcome(payment_data: Dict[str, Any]) -> Optional[str]:
+    """Map a Pi payment object to COMPLETED, FAILED, or None if still pending"""
+    status = payment_data.get("status") or {}
+    if status.get("cancelled") or status.get("user_cancelled"):
+        return FAILED
+    if status.get("transaction_verified") or status.get("developer_completed"):
+        return COMPLETED
+    return None
+
+
+class PaymentStore:
+    """Conditional state transitions on the transactions collection"""
+
+    def __init__(self, collection, on_completed: Optional[Callable[[Dict[str, Any]], Awaitable]] = None):
+        self.collection = collection
+        # Called once per payment with its document when it completes, e.g. to update rollups
+        self.on_completed = on_completed
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("payment_id", unique=True)
+        await self.collection.create_index("idempotency_key", unique=True, sparse=True)
+        await self.collection.create_index([("status", 1), ("updated_at", 1)])
+
+    async def get(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"payment_id": payment_id})
+
+    async def get_by_idempotency_key(self, idempotency_key: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"idempotency_key": idempotency_key})
+
+    async def record_approval(self, payment_id: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Create the approved record, or return the existing one unchanged"""
+        now = utcnow()
+        record = {
+            "payment_id": payment_id,
+            "status": APPROVED,
+            "created_at": now.isoformat(),
+            "updated_at": now,
+        }
+        if idempotency_key:
+            record["idempotency_key"] = idempotency_key
+        try:
+            return await self.collection.find_one_and_update(
+                {"payment_id": payment_id},
+                {"$setOnInsert": record},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            existing = await self.get(payment_id)
+            if existing is None:
+                # The idempotency key belongs to another payment
+                raise IdempotencyConflict(idempotency_key)
+            # Lost an upsert race for the same payment
+            return existing
+
+    async def begin_completion(self, payment_id: str, txid: str) -> Optional[Dict[str, Any]]:
+        """Move a payment to ``completing``; return None if it is not ours to move.
+
+        Payments we never saw approved (e.g. incomplete payments from an
+        earlier session) are created directly in ``completing``.
+        """
+        now = utcnow()
+        try:
+            return await self.collection.find_one_and_update(
+                {"payment_id": payment_id, "status": APPROVED},
+                {
+                    "$set": {"status": COMPLETING, "txid": txid, "updated_at": now},
+                    "$setOnInsert": {"created_at": now.isoformat()},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Already completing, completed or failed
+            return None
+
+    async def claim_stale(self, payment: Dict[str, Any]) -> bool:
+        """Take the reconciliation lease on a stuck payment.
+
+        Bumping ``updated_at`` hides it from other reconcilers until the
+        lease goes stale again.
+        """
+        result = await self.collection.update_one(
+            {"_id": payment["_id"], "status": payment["status"], "updated_at": payment.get("updated_at")},
+            {"$set": {"updated_at": utcnow()}, "$inc": {"reconcile_attempts": 1}},
+        )
+        return result.modified_count == 1
+
+    async def finish(self, payment_id: str, payment_data: Dict[str, Any], txid: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """completing -> completed; returns None if the payment was not completing"""
+        update = {
+            "status": COMPLETED,
+            "amount": payment_data.get("amount", 0),
+            "completed_at": utcnow().isoformat(),
+            "updated_at": utcnow(),
+            "pi_data": payment_data,
+        }
+        txid = txid or (payment_data.get("transaction") or {}).get("txid")
+        if txid:
+            update["txid"] = txid
+        if payment_data.get("user_uid"):
+            # Routes payment events to the payer's event streams
+            update["user_id"] = payment_data["user_uid"]
+        job_id = (payment_data.get("metadata") or {}).get("jobId")
+        if job_id:
+            update["job_id"] = job_id
+        payment = await self.collection.find_one_and_update(
+            {"payment_id": payment_id, "status": COMPLETING},
+            {"$set": update},
+            return_document=ReturnDocument.AFTER,
+        )
+        if payment is not None and self.on_completed is not None:
+            await self.on_completed(payment)
+        return payment
+
+    async def fail(self, payment_id: str, reason: str, from_status: str = COMPLETING) -> bool:
+        result = await self.collection.update_one(
+            {"payment_id": payment_id, "status": from_status},
+            {"$set": {"status": FAILED, "failure_reason": reason, "updated_at": utcnow()}},
+        )
+        return result.modified_count == 1
+
+
+def _is_rejection(error: PiAPIError) -> bool:
+    """A 4xx other than 429 will not succeed on retry"""
+    return error.status_code is not None and 400 <= error.status_code < 500 and error.status_code != 429
+
+
+class PaymentService:
+    """Approves and completes payments; safe to run more than once per payment.
+
+    Pi API outages raise ``PiAPIError`` so the task queue retries the call;
+    refusals raise ``PaymentRejected``.
+    """
+
+    def __init__(self, store: PaymentStore, pi_client):
+        self.store = store
+        self.pi_client = pi_client
+
+    async def approve(self, payment_id: str, idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        existing = await self.store.get(payment_id)
+        if existing:
+            if existing.get("status") == FAILED:
+                raise PaymentRejected("Payment approval failed")
+            return {"payment_id": payment_id, "status": existing["status"]}
+
+        try:
+            await self.pi_client.approve_payment(payment_id)
+        except PiAPIError as e:
+            if not _is_rejection(e):
+                raise
+            # A retried task may find its earlier approval already went through
+            payment_data = await self.pi_client.get_payment(payment_id)
+            if not (payment_data.get("status") or {}).get("developer_approved"):
+                logger.warning("Payment approval failed", extra={"payment_id": payment_id, "error": e.body or str(e)})
+                raise PaymentRejected("Payment approval failed")
+
+        try:
+            payment = await self.store.record_approval(payment_id, idempotency_key)
+        except IdempotencyConflict:
+            raise PaymentRejected("Idempotency-Key already used for another payment")
+        logger.info("Payment approved", extra={"payment_id": payment_id})
+        return {"payment_id": payment_id, "status": payment["status"]}
+
+    async def complete(self, payment_id: str, txid: str) -> Dict[str, Any]:
+        payment = await self.store.begin_completion(payment_id, txid)
+        if payment is None:
+            payment = await self.store.get(payment_id)
+            if payment["status"] == COMPLETED:
+                return self.completed(payment)
+            if payment["status"] == FAILED:
+                raise PaymentRejected("Payment verification failed")
+            # Still completing: an earlier attempt stopped before settling it
+
+        try:
+            payment_data = await self.pi_client.get_payment(payment_id)
+        except PiAPIError as e:
+            if e.status_code == 404:
+                await self.store.fail(payment_id, "unknown to Pi Network")
+                raise PaymentRejected("Payment verification failed")
+            raise
+
+        if pi_outcome(payment_data) == FAILED:
+            await self.store.fail(payment_id, "cancelled on Pi Network")
+            raise PaymentRejected("Payment verification failed")
+
+        payment = await self.store.finish(payment_id, payment_data, txid)
+        if payment is None:
+            # The reconciler or another attempt settled it first
+            payment = await self.store.get(payment_id)
+            if payment["status"] == FAILED:
+                raise PaymentRejected("Payment verification failed")
+
+        logger.info("Payment completed", extra={"payment_id": payment_id})
+        return self.completed(payment)
+
+    @staticmethod
+    def completed(payment: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "payment_id": payment["payment_id"],
+            "status": COMPLETED,
+            "txid": payment.get("txid"),
+            "amount": payment.get("amount", 0),
+        }
+
+
+def payment_task_handlers(service: PaymentService) -> Dict[str, Any]:
+    """Task queue handlers for the payment task kinds"""
+
+    async def approve(payload):
+        return await service.approve(payload["payment_id"], payload.get("idempotency_key"))
+
+    async def complete(payload):
+        return await service.complete(payload["payment_id"], payload["txid"])
+
+    return {APPROVE_TASK: approve, COMPLETE_TASK: complete}
+
+
+class PaymentReconciler:
+    """Background task settling stuck payments against the Pi API.
+
+    Every ``interval`` seconds it loads up to ``batch_size`` payments that
+    have sat in ``completing`` for ``stale_after`` seconds, or in ``approved``
+    for ``approved_timeout`` seconds, plus any handed over with
+    ``reconcile_soon``, and looks them all up concurrently.
+    """
+
+    def __init__(
+        self,
+        store: PaymentStore,
+        pi_client,
+        interval: float = 30.0,
+        batch_size: int = 100,
+        stale_after: float = 60.0,
+        approved_timeout: float = 15 * 60.0,
+    ):
+        self.store = store
+        self.pi_client = pi_client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+        self.approved_timeout = approved_timeout
+        self._urgent = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def reconcile_soon(self, payment_id: str):
+        """Reconcile a payment in the next sweep and run that sweep now"""
+        self._urgent.add(payment_id)
+        self._wakeup.set()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except PyMongoError as e:
+                logger.error("Payment reconciliation sweep failed", extra={"error": str(e)})
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def sweep(self) -> int:
+        """Reconcile one batch of stuck payments; returns how many settled"""
+        now = utcnow()
+        urgent, self._urgent = self._urgent, set()
+        query = {"$or": [
+            {"status": COMPLETING, "updated_at": {"$lt": now - timedelta(seconds=self.stale_after)}},
+            {"status": APPROVED, "updated_at": {"$lt": now - timedelta(seconds=self.approved_timeout)}},
+            {"status": {"$in": [APPROVED, COMPLETING]}, "payment_id": {"$in": list(urgent)}},
+        ]}
+        stuck = await self.store.collection.find(query).sort("updated_at", 1).limit(self.batch_size).to_list(None)
+        results = await asyncio.gather(*(self._reconcile(payment) for payment in stuck))
+        return sum(results)
+
+    async def _reconcile(self, payment: Dict[str, Any]) -> bool:
+        if not await self.store.claim_stale(payment):
+            return False
+        payment_id = payment["payment_id"]
+        try:
+            payment_data = await self.pi_client.get_payment(payment_id)
+        except PiAPIError as e:
+            if e.status_code == 404:
+                return await self.store.fail(payment_id, "unknown to Pi Network", payment["status"])
+            # Transient; the lease expires and a later sweep retries
+            return False
+
+        outcome = pi_outcome(payment_data)
+        if outcome == FAILED:
+            return await self.store.fail(payment_id, "cancelled on Pi Network", payment["status"])
+        if outcome == COMPLETED:
+            if payment["status"] == APPROVED:
+                txid = (payment_data.get("transaction") or {}).get("txid")
+                if await self.store.begin_completion(payment_id, txid) is None:
+                    return False
+            settled = await self.store.finish(payment_id, payment_data)
+            if settled:
+                logger.info("Payment reconciled", extra={"payment_id": payment_id})
+            return settled is not None
+        return False
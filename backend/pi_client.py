@@ -0,0 +1,148 @@
+"""Async client for the Pi Network platform API.
+
+A single ``PiClient`` is shared by the whole process so that every payment
+endpoint reuses the same keep-alive connection pool instead of opening a new
+connection (and blocking the event loop) per request.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from metrics import PI_API_ERRORS, PI_API_LATENCY
+
+PI_API_BASE_URL = os.environ.get('PI_API_BASE_URL', 'https://api.minepi.com/v2')
+PI_API_TIMEOUT = float(os.environ.get('PI_API_TIMEOUT', '10'))
+PI_API_MAX_CONNECTIONS = int(os.environ.get('PI_API_MAX_CONNECTIONS', '20'))
+PI_API_MAX_CONCURRENCY = int(os.environ.get('PI_API_MAX_CONCURRENCY', '10'))
+PI_API_MAX_RETRIES = int(os.environ.get('PI_API_MAX_RETRIES', '3'))
+
+# Responses worth retrying for idempotent calls
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class PiAPIError(Exception):
+    """Raised when the Pi API cannot be reached or rejects a call"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, body: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class PiClient:
+    """Pooled, concurrency-bounded async client for the Pi payments API"""
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        base_url: str = PI_API_BASE_URL,
+        timeout: float = PI_API_TIMEOUT,
+        max_connections: int = PI_API_MAX_CONNECTIONS,
+        max_concurrency: int = PI_API_MAX_CONCURRENCY,
+        max_retries: int = PI_API_MAX_RETRIES,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5.0))
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Custom transport, e.g. httpx.ASGITransport over a local Pi API stub
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Key {self.api_key}"},
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self.transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _request(
+        self,
+        operation: str,
+        method: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        idempotent: bool = False,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        """Send a request, retrying idempotent calls on transient failures.
+
+        Non-idempotent calls are only retried when the connection could not
+        be established, i.e. when the request never reached the Pi servers.
+        """
+        client = self._get_client()
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.request(method, path, json=json, headers=headers)
+                    finally:
+                        PI_API_LATENCY.observe(time.perf_counter() - start, operation=operation)
+            except httpx.ConnectError as e:
+                PI_API_ERRORS.inc(operation=operation, status="connect")
+                if attempt >= self.max_retries:
+                    raise PiAPIError(f"Pi API unreachable: {e}") from e
+            except httpx.TransportError as e:
+                PI_API_ERRORS.inc(operation=operation, status="transport")
+                if not idempotent or attempt >= self.max_retries:
+                    raise PiAPIError(f"Pi API request failed: {e}") from e
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                PI_API_ERRORS.inc(operation=operation, status=response.status_code)
+                retryable = idempotent and response.status_code in RETRYABLE_STATUS_CODES
+                if not retryable or attempt >= self.max_retries:
+                    raise PiAPIError(
+                        f"Pi API returned {response.status_code}",
+                        status_code=response.status_code,
+                        body=response.text,
+                    )
+
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def get_payment(self, payment_id: str) -> Dict[str, Any]:
+        """Fetch a payment from the Pi API"""
+        return await self._request("get_payment", "GET", f"/payments/{payment_id}", idempotent=True)
+
+    async def approve_payment(self, payment_id: str) -> Dict[str, Any]:
+        """Approve a payment with the Pi API"""
+        return await self._request("approve_payment", "POST", "/payments/approve", json={"paymentId": payment_id})
+
+    async def get_user(self, access_token: str) -> Dict[str, Any]:
+        """Fetch the user a Pi access token belongs to, proving the token is genuine"""
+        return await self._request(
+            "get_user", "GET", "/me", idempotent=True, headers={"Authorization": f"Bearer {access_token}"}
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
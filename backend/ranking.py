@@ -0,0 +1,466 @@
+"""Personalized deck ranking from swipe history.
+
+Every job is reduced to five categorical features: category, payment band,
+location, employer and employer rating band. Linked jobs take their rating
+from the ``employers`` collection, as of when the job was indexed. Each
+``field:value`` pair owns one column of a shared ``FeatureSpace``, and
+``JobIndex`` holds every job as five column numbers in a ``(5, n)`` NumPy
+array, one contiguous row per field.
+
+A user's profile is one weight per column: the smoothed log-odds
+``log((accepts + 1) / (rejects + 1))`` of their swipes on jobs with that
+feature. A swipe only touches its job's five columns, so profiles are
+updated in place as swipes arrive. Scoring every job for a user is five
+gathers summed, ``weights[codes[0]] + ... + weights[codes[4]]``, followed by
+``argpartition`` for the top K.
+
+Scoring walks the index newest jobs first in chunks and stops once
+``budget`` seconds have passed, so a deck takes bounded time however many
+jobs there are; when the budget runs out only the oldest jobs go unscored.
+
+Swiped jobs are never served again. Jobs served but not swiped are held
+back only until the user's deck runs out or the jobs version moves, then
+offered again, as with the unranked deck.
+
+Jobs past their deadline are masked out at scoring time. Deleted jobs, e.g.
+archived ones, stay in the index as tombstones until they make up a
+quarter of it and the index is reloaded.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timezone
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from metrics import DECK_RANK_LATENCY, DECK_RANK_TRUNCATED
+
+logger = logging.getLogger("wolk.ranking")
+
+# Job fields the index is built from
+INDEX_PROJECTION = {
+    "id": 1, "category": 1, "payment": 1, "location": 1, "employer_id": 1, "employer": 1, "employer_rating": 1,
+    "created_at": 1, "deadline": 1, "status": 1,
+}
+CATEGORY = 0
+FIELDS = 5
+
+# Newer jobs win ties; a year of age costs less than one swipe's evidence
+FRESHNESS_PER_YEAR = 0.01
+_EPOCH = date(2020, 1, 1).toordinal()
+
+
+def job_features(job: Dict[str, Any], employer_rating: Optional[float] = None) -> Tuple[str, str, str, str, str]:
+    """The ``field:value`` features of a job, category first.
+
+    ``employer_rating`` is the linked employer's current rating; jobs not
+    yet linked to an employer use their own copy of it and their name.
+    """
+    payment = float(job.get("payment") or 0)
+    if job.get("employer_id"):
+        employer = f"employer:{job['employer_id']}"
+    else:
+        employer = f"employer-name:{job.get('employer', '')}"
+    if employer_rating is None:
+        employer_rating = job.get("employer_rating")
+    return (
+        f"category:{job.get('category', '')}",
+        f"payment:{int(math.log2(payment)) if payment >= 1 else 0}",
+        f"location:{' '.join(str(job.get('location', '')).lower().split())}",
+        employer,
+        f"rating:{round(float(employer_rating or 0) * 2) / 2}",
+    )
+
+
+def freshness(created_at) -> float:
+    if isinstance(created_at, datetime):
+        day = created_at.toordinal()
+    else:
+        try:
+            day = date.fromisoformat(str(created_at)[:10]).toordinal()
+        except ValueError:
+            return 0.0
+    return (day - _EPOCH) / 365.0 * FRESHNESS_PER_YEAR
+
+
+def expiry(job: Dict[str, Any]) -> float:
+    """When a job stops being offered, as a UNIX timestamp"""
+    if job.get("status", "open") != "open":
+        return -math.inf
+    deadline = job.get("deadline")
+    if not isinstance(deadline, datetime):
+        return math.inf
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return deadline.timestamp()
+
+
+class FeatureSpace:
+    """Column number per feature; only ever grows, so profiles stay valid"""
+
+    def __init__(self):
+        self._columns: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def column(self, feature: str) -> int:
+        column = self._columns.get(feature)
+        if column is None:
+            column = self._columns[feature] = len(self._columns)
+        return column
+
+    def get(self, feature: str) -> Optional[int]:
+        return self._columns.get(feature)
+
+
+class JobIndex:
+    """Feature columns of every job, jobs in insertion order"""
+
+    _generations = 0
+
+    def __init__(self, capacity: int = 1024):
+        JobIndex._generations += 1
+        self.generation = JobIndex._generations
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        # Job ID per MongoDB _id, which is all a delete event names
+        self.object_ids: Dict[Any, str] = {}
+        self.codes = np.zeros((FIELDS, capacity), dtype=np.int32)
+        self.freshness = np.zeros(capacity, dtype=np.float32)
+        self.expires = np.full(capacity, math.inf)
+        self.removed = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def remove(self, object_id: Any) -> bool:
+        """Tombstone the job stored under ``object_id``; False if unknown"""
+        job_id = self.object_ids.pop(object_id, None)
+        if job_id is None:
+            return False
+        if self.expires[self.rows[job_id]] != -math.inf:
+            self.expires[self.rows[job_id]] = -math.inf
+            self.removed += 1
+        return True
+
+    def upsert(self, job: Dict[str, Any], features: FeatureSpace, employer_rating: Optional[float] = None):
+        row = self.rows.get(job["id"])
+        if row is None:
+            row = len(self.ids)
+            if row == self.codes.shape[1]:
+                self.codes = np.concatenate([self.codes, np.zeros_like(self.codes)], axis=1)
+                self.freshness = np.concatenate([self.freshness, np.zeros_like(self.freshness)])
+                self.expires = np.concatenate([self.expires, np.full_like(self.expires, math.inf)])
+            self.ids.append(job["id"])
+            self.rows[job["id"]] = row
+        elif self.expires[row] == -math.inf:
+            self.removed -= 1
+        if "_id" in job:
+            self.object_ids[job["_id"]] = job["id"]
+        self.codes[:, row] = [features.column(feature) for feature in job_features(job, employer_rating)]
+        self.freshness[row] = freshness(job.get("created_at"))
+        self.expires[row] = expiry(job)
+        if self.expires[row] == -math.inf:
+            self.removed += 1
+
+
+class _Served:
+    """Jobs one user's deck (optionally category-filtered) has served since it last ran out"""
+
+    __slots__ = ("version", "ids")
+
+    def __init__(self, version: Any):
+        # Jobs version the deck started at
+        self.version = version
+        self.ids: Set[str] = set()
+
+
+class UserProfile:
+    """Per-column swipe counts and weights, plus the jobs not to show again"""
+
+    __slots__ = ("accepts", "rejects", "weights", "excluded", "served", "loaded", "_excluded_rows")
+
+    def __init__(self):
+        self.accepts = np.zeros(0, dtype=np.float32)
+        self.rejects = np.zeros(0, dtype=np.float32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        # Swiped (or pending) job IDs, never served again
+        self.excluded: Set[str] = set()
+        # Per category, jobs served but maybe not swiped
+        self.served: Dict[Optional[str], _Served] = {}
+        self.loaded: Optional[asyncio.Future] = None
+        self._excluded_rows: Tuple[Tuple[int, int], np.ndarray] = ((0, -1), np.zeros(0, dtype=np.int64))
+
+    def _grow(self, size: int):
+        if len(self.weights) < size:
+            size = max(size, 2 * len(self.weights))
+            self.accepts = np.pad(self.accepts, (0, size - len(self.accepts)))
+            self.rejects = np.pad(self.rejects, (0, size - len(self.rejects)))
+            self.weights = np.pad(self.weights, (0, size - len(self.weights)))
+
+    def learn(self, columns: np.ndarray, accepted: bool):
+        self._grow(int(columns.max()) + 1)
+        counts = self.accepts if accepted else self.rejects
+        counts[columns] += 1
+        self.weights[columns] = np.log((self.accepts[columns] + 1) / (self.rejects[columns] + 1))
+
+    def weights_for(self, size: int) -> np.ndarray:
+        self._grow(size)
+        return self.weights[:size]
+
+    def excluded_rows(self, index: JobIndex) -> np.ndarray:
+        key = (index.generation, len(self.excluded))
+        if self._excluded_rows[0] != key:
+            rows = index.rows
+            self._excluded_rows = (key, np.fromiter(
+                (rows[job_id] for job_id in self.excluded if job_id in rows), dtype=np.int64
+            ))
+        return self._excluded_rows[1]
+
+
+class RankingEngine:
+    """Serves each user their top-ranked unseen jobs.
+
+    The job index is loaded in the background on ``start`` and kept current
+    through ``on_jobs_changed``; until it is ready, ``ready`` is False and
+    callers should fall back to the unranked deck.
+    """
+
+    def __init__(
+        self,
+        jobs_collection,
+        swipes_collection,
+        feed_sort,
+        projection=None,
+        budget: float = 0.025,
+        chunk_size: int = 16384,
+        max_users: int = 10000,
+        pending_swipes=None,
+        retry_interval: float = 5.0,
+        query: Optional[Dict[str, Any]] = None,
+        employers_collection=None,
+        version: Optional[Callable[[], Awaitable[Any]]] = None,
+    ):
+        self.jobs_collection = jobs_collection
+        # Linked jobs' employer ratings are read from here
+        self.employers_collection = employers_collection
+        self.employer_ratings: Dict[str, float] = {}
+        # Jobs the index is loaded from, e.g. open ones only
+        self.query = query or {}
+        self.swipes_collection = swipes_collection
+        # Oldest first, so appended jobs keep the index in age order
+        self.load_sort = [(field, -direction) for field, direction in feed_sort]
+        self.projection = projection
+        self.budget = budget
+        self.chunk_size = chunk_size
+        self.max_users = max_users
+        # Callable returning job IDs a user swiped that are not stored yet
+        self.pending_swipes = pending_swipes
+        self.retry_interval = retry_interval
+        # Version of the jobs collection, which changes when jobs are added or removed
+        self.version = version
+        self.features = FeatureSpace()
+        self.index: Optional[JobIndex] = None
+        self._users: "OrderedDict[str, UserProfile]" = OrderedDict()
+        self._load_task: Optional[asyncio.Task] = None
+        self._reload_again = False
+        # Job changes seen while a reload is reading the collection
+        self._backlog: Optional[List[Dict[str, Any]]] = None
+        # Reload once this share of the index is tombstones
+        self.compact_ratio = 0.25
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    def start(self):
+        self._schedule_reload()
+
+    def _schedule_reload(self):
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.ensure_future(self._reload())
+        else:
+            self._reload_again = True
+
+    async def _reload(self):
+        while True:
+            self._reload_again = False
+            self._backlog = []
+            try:
+                index = JobIndex()
+                if self.employers_collection is not None:
+                    async for employer in self.employers_collection.find({}, {"id": 1, "rating": 1, "_id": 0}):
+                        self.employer_ratings[employer["id"]] = employer.get("rating", 0.0)
+                jobs = self.jobs_collection.find(self.query, INDEX_PROJECTION)
+                async for job in jobs.sort(self.load_sort).batch_size(5000):
+                    self._upsert(index, job)
+            except PyMongoError as e:
+                logger.error("Loading the ranking index failed", extra={"error": str(e)})
+                self._backlog = None
+                await asyncio.sleep(self.retry_interval)
+                continue
+            for change in self._backlog:
+                self._apply(index, change)
+            self._backlog = None
+            self.index = index
+            logger.info("Ranking index loaded", extra={"jobs": len(index), "features": len(self.features)})
+            if not self._reload_again:
+                return
+
+    def _apply(self, index: Optional[JobIndex], change: Dict[str, Any]) -> bool:
+        """Apply an insert, update, replace or delete event to ``index``, if any.
+
+        Returns False for events that cannot be applied this way.
+        """
+        operation = change.get("operationType")
+        document = change.get("fullDocument")
+        if operation in ("insert", "update", "replace") and document and "id" in document:
+            if index is not None:
+                self._upsert(index, document)
+            return True
+        if operation == "delete" and "documentKey" in change:
+            # Deletes of jobs the index never loaded, e.g. closed ones, change nothing
+            if index is not None:
+                index.remove(change["documentKey"].get("_id"))
+            return True
+        return False
+
+    def _upsert(self, index: JobIndex, job: Dict[str, Any]):
+        index.upsert(job, self.features, self.employer_ratings.get(job.get("employer_id")))
+
+    def on_employers_changed(self, change: Optional[Dict[str, Any]]):
+        """Track employer ratings for jobs indexed from now on"""
+        document = change.get("fullDocument") if change else None
+        if document and "id" in document and "rating" in document:
+            self.employer_ratings[document["id"]] = document["rating"]
+
+    def on_jobs_changed(self, change: Optional[Dict[str, Any]]):
+        """Apply a jobs change stream event; anything unclear reloads the index"""
+        applied = False
+        if change and (self.index is not None or self._backlog is not None):
+            applied = self._apply(self.index, change)
+            if applied and self._backlog is not None:
+                # The reload in progress may already have read past this job
+                self._backlog.append(change)
+        if not applied or (self.index is not None and self.index.removed > self.compact_ratio * len(self.index)):
+            self._schedule_reload()
+
+    async def _load_profile(self, user_id: str, profile: UserProfile):
+        if self.pending_swipes is not None:
+            profile.excluded.update(self.pending_swipes(user_id))
+        history = self.swipes_collection.find({"user_id": user_id}, {"job_id": 1, "action": 1, "_id": 0})
+        async for swipe in history:
+            self._learn(profile, swipe["job_id"], swipe.get("action"))
+
+    def _learn(self, profile: UserProfile, job_id: str, action: Optional[str]):
+        profile.excluded.add(job_id)
+        row = self.index.rows.get(job_id) if self.index is not None else None
+        if row is not None:
+            profile.learn(self.index.codes[:, row], action == "accept")
+
+    async def _profile(self, user_id: str) -> UserProfile:
+        profile = self._users.get(user_id)
+        if profile is None:
+            profile = self._users[user_id] = UserProfile()
+            profile.loaded = asyncio.ensure_future(self._load_profile(user_id, profile))
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        try:
+            await asyncio.shield(profile.loaded)
+        except Exception:
+            # Retry the load on the next request rather than rank without history
+            self._users.pop(user_id, None)
+            raise
+        return profile
+
+    def record(self, user_id: str, job_id: str, action: str):
+        """Learn from a swipe if the user's profile is in memory.
+
+        Profiles not in memory pick the swipe up from MongoDB when loaded.
+        """
+        profile = self._users.get(user_id)
+        if profile is not None:
+            self._learn(profile, job_id, action)
+
+    def top_k(
+        self, profile: UserProfile, k: int, category: Optional[str] = None, skip: Collection[str] = ()
+    ) -> List[str]:
+        """IDs of the ``k`` best-scoring jobs not excluded for the profile nor in ``skip``"""
+        index = self.index
+        size = len(index)
+        if size == 0 or k <= 0:
+            return []
+        category_column = None
+        if category is not None:
+            category_column = self.features.get(f"category:{category}")
+            if category_column is None:
+                return []
+
+        start = time.perf_counter()
+        now = time.time()
+        weights = profile.weights_for(len(self.features))
+        codes = index.codes
+        scores = np.full(size, -np.inf, dtype=np.float32)
+        high = size
+        while high > 0:
+            low = max(0, high - self.chunk_size)
+            chunk = index.freshness[low:high] + weights[codes[0, low:high]]
+            for field in range(1, len(codes)):
+                chunk += weights[codes[field, low:high]]
+            chunk[index.expires[low:high] <= now] = -np.inf
+            if category_column is not None:
+                chunk[codes[CATEGORY, low:high] != category_column] = -np.inf
+            scores[low:high] = chunk
+            high = low
+            if high > 0 and time.perf_counter() - start > self.budget:
+                DECK_RANK_TRUNCATED.inc()
+                break
+
+        excluded = profile.excluded_rows(index)
+        if len(excluded):
+            scores[excluded] = -np.inf
+        if skip:
+            rows = index.rows
+            scores[np.fromiter((rows[job_id] for job_id in skip if job_id in rows), dtype=np.int64)] = -np.inf
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k] if k < size else np.arange(size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[np.isfinite(scores[top])]
+        DECK_RANK_LATENCY.observe(time.perf_counter() - start)
+        return [index.ids[row] for row in top]
+
+    async def next_jobs(self, user_id: str, limit: int, category: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return up to ``limit`` unswiped jobs for the user, best first"""
+        profile = await self._profile(user_id)
+        version = await self.version() if self.version else None
+        served = profile.served.get(category)
+        if served is None or served.version != version:
+            # New jobs may rank above the ones served so far
+            served = profile.served[category] = _Served(version)
+        job_ids = self.top_k(profile, limit, category, served.ids)
+        if len(job_ids) < limit and served.ids:
+            # The deck ran out: start over, offering jobs served but not swiped again
+            served.ids = set(job_ids)
+            job_ids += self.top_k(profile, limit - len(job_ids), category, served.ids)
+        if not job_ids:
+            return []
+        served.ids.update(job_ids)
+        jobs = await self.jobs_collection.find({"id": {"$in": job_ids}}, self.projection).to_list(None)
+        by_id = {job["id"]: job for job in jobs}
+        return [by_id[job_id] for job_id in job_ids if job_id in by_id]
+
+    async def close(self):
+        if self._load_task is not None and not self._load_task.done():
+            self._load_task.cancel()
+            try:
+                await self._load_task
+            except asyncio.CancelledError:
+                pass
+        self._load_task = None
@@ -0,0 +1,258 @@
+"""Per-client rate limiting and global admission control.
+
+``RateLimitMiddleware`` gives every client a token bucket per limited route:
+a bucket holds up to ``burst`` tokens, refills at ``rate`` tokens per second,
+and each request takes one. A request finding the bucket empty is answered
+429 with ``Retry-After`` set to when the next token arrives. By default
+clients are keyed by their bearer token when they send one and by IP
+address otherwise; pass ``key`` to identify them some other way.
+
+Buckets live in a ``BucketStore``. ``MemoryBucketStore`` keeps them per
+process, so with N API processes a client may get up to N times its limit.
+``MongoBucketStore`` shares them between processes at the cost of one
+atomic ``find_one_and_update`` per limited request.
+
+``AdmissionControlMiddleware`` caps the requests being served at once. Up
+to ``max_queue`` more may wait ``queue_timeout`` seconds for a slot; anything
+beyond that is shed with 503 straight away, so overload shows up as fast
+rejections instead of every request slowing down.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Deque, Dict, Iterable, Optional, Tuple
+
+import orjson
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from metrics import REQUESTS_REJECTED
+
+logger = logging.getLogger("wolk.ratelimit")
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    rate: float  # tokens per second
+    burst: int
+
+    @classmethod
+    def parse(cls, spec: str) -> "RateLimit":
+        """``"rate/burst"``, e.g. ``"5/20"`` for 5 per second in bursts of 20"""
+        rate, _, burst = spec.partition("/")
+        return cls(float(rate), int(burst or math.ceil(float(rate))))
+
+
+class BucketStore(ABC):
+    @abstractmethod
+    async def take(self, key: str, limit: RateLimit) -> float:
+        """Take a token from ``key``'s bucket.
+
+        Returns 0 if one was available, otherwise the seconds until one is.
+        """
+
+
+class MemoryBucketStore(BucketStore):
+    """Buckets in a bounded LRU; evicted buckets start over full"""
+
+    def __init__(self, max_keys: int = 100000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        now = self.clock()
+        tokens, updated = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / limit.rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoBucketStore(BucketStore):
+    """Buckets shared by every process, one document per client and route"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, limit: RateLimit) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed = {"$max": [0, {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}]}
+        update = [
+            {"$set": {
+                "tokens": {"$min": [limit.burst, {"$add": [
+                    {"$ifNull": ["$tokens", limit.burst]}, {"$multiply": [elapsed, limit.rate]}
+                ]}]},
+                "updated_at": now,
+                # A full bucket is the same as none
+                "expires_at": now + timedelta(seconds=limit.burst / limit.rate),
+            }},
+            {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+        ]
+        try:
+            bucket = await self._update(key, update)
+        except DuplicateKeyError:
+            # Another process created the bucket first
+            bucket = await self._update(key, update)
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / limit.rate
+
+    async def _update(self, key, update):
+        return await self.collection.find_one_and_update(
+            {"_id": key}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+
+def client_ip(scope) -> str:
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def client_key(scope) -> str:
+    """The bearer token's digest for authenticated clients, else the client IP"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            return "auth:" + hashlib.sha256(value).hexdigest()[:32]
+    return client_ip(scope)
+
+
+async def send_error(send, status: int, detail: str, retry_after: float):
+    body = orjson.dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying ``limits[(method, path)]`` per client"""
+
+    def __init__(
+        self,
+        app,
+        limits: Dict[Tuple[str, str], RateLimit],
+        store: Optional[BucketStore] = None,
+        key: Callable[[dict], str] = client_key,
+        enabled: bool = True,
+    ):
+        self.app = app
+        self.limits = limits
+        self.store = store or MemoryBucketStore()
+        self.key = key
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limit is None or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            wait = await self.store.take(f"{scope['path']}:{self.key(scope)}", limit)
+        except PyMongoError as e:
+            # Fail open: a broken shared store must not take the API down
+            logger.warning("Rate limit store unavailable", extra={"error": str(e)})
+            wait = 0.0
+        if wait > 0:
+            REQUESTS_REJECTED.inc(route=scope["path"], reason="rate_limited")
+            await send_error(send, 429, "Too many requests, retry later", wait)
+            return
+        await self.app(scope, receive, send)
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware serving at most ``max_concurrent`` requests at once.
+
+    Paths in ``exempt`` (health checks, metrics, long-lived streams) are
+    neither counted nor shed.
+    """
+
+    def __init__(
+        self,
+        app,
+        max_concurrent: int = 256,
+        max_queue: int = 256,
+        queue_timeout: float = 0.5,
+        exempt: Iterable[str] = (),
+    ):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.exempt = frozenset(exempt)
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_concurrent <= 0 or scope["path"] in self.exempt:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self._acquire():
+            REQUESTS_REJECTED.inc(route=scope["path"], reason="overloaded")
+            await send_error(send, 503, "Server busy, retry shortly", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._release()
+
+    async def _acquire(self) -> bool:
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # _release hands its slot over by resolving the future
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the wait timed out; the slot is ours
+                return True
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes straight to the oldest waiter
+                waiter.set_result(None)
+                return
+        self.active -= 1
@@ -0,0 +1,37 @@
+"""Recompute the /api/stats rollups from scratch.
+
+Reads every completed payment and every swipe in batches and rebuilds
+``stats_daily`` from them, e.g. after first deploying rollups or when
+increments were lost. Stats the API records during the rebuild are not
+carried over, so pick a quiet time.
+
+    python rebuild_stats.py --batch-size 5000
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from payments import COMPLETED
+from rollups import StatsRollups
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    try:
+        db = client[os.environ.get('MONGO_DB', 'wolk_db')]
+        rollups = StatsRollups(db.stats_daily, db.jobs, db.jobs_archive)
+        start = time.perf_counter()
+        counts = await rollups.rebuild(db.transactions, db.swipes, args.batch_size, COMPLETED)
+    finally:
+        client.close()
+    print(f"✅ Rebuilt stats from {counts['payments']} payments and {counts['swipes']} swipes "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
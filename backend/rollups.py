@@ -0,0 +1,222 @@
+"""Daily payment and swipe rollups behind ``/api/stats``.
+
+``stats_daily`` holds one document per scope, key and UTC day: that day's
+completed payment count and Pi amount, and its accepted and rejected
+swipes. Rollups are kept per user (``user``), per job category
+(``category``) and for the whole marketplace (``all``). Completed payments
+and written swipes ``$inc`` their day's documents as they are stored, so
+reading N days of stats reads at most N documents however much history
+there is.
+
+An increment is applied after its payment or swipe is stored, so one lost
+in between (e.g. to a process dying) is missing from the rollups until
+``rebuild`` recomputes them from ``transactions`` and ``swipes``.
+"""
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger("wolk.rollups")
+
+USER = "user"
+CATEGORY = "category"
+ALL = "all"
+
+COUNTERS = ("payments", "amount", "accepts", "rejects")
+
+# Pi amounts have 7 decimal places; summed floats are rounded back to them
+AMOUNT_DIGITS = 7
+
+Increments = Dict[str, Tuple[Dict[str, Any], Dict[str, float]]]
+
+
+def day_of(value: Union[str, datetime, None]) -> date:
+    """The UTC day of a datetime or ISO timestamp; naive ones are taken as UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        return datetime.now(timezone.utc).date()
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.date()
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time(), timezone.utc)
+
+
+def rollup_id(scope: str, key: str, day: date) -> str:
+    return f"{scope}:{key}:{day.isoformat()}"
+
+
+def acceptance_rate(accepts: float, rejects: float) -> Optional[float]:
+    swipes = accepts + rejects
+    return round(accepts / swipes, 4) if swipes else None
+
+
+def summarize(days: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals over the days returned by ``StatsRollups.daily``"""
+    totals = {name: sum(day[name] for day in days) for name in COUNTERS}
+    totals["amount"] = round(totals["amount"], AMOUNT_DIGITS)
+    totals["acceptance_rate"] = acceptance_rate(totals["accepts"], totals["rejects"])
+    return totals
+
+
+def add_event(increments: Increments, user_id: Optional[str], category: Optional[str], day: date,
+              counts: Dict[str, float]):
+    """Count one payment or swipe towards its user's, category's and the marketplace's day"""
+    for scope, key in ((USER, user_id), (CATEGORY, category), (ALL, "")):
+        if key is None:
+            continue
+        _id = rollup_id(scope, key, day)
+        entry = increments.get(_id)
+        if entry is None:
+            entry = increments[_id] = ({"scope": scope, "key": key, "day": day_start(day)}, {})
+        for name, count in counts.items():
+            entry[1][name] = entry[1].get(name, 0) + count
+
+
+def payment_counts(payment: Dict[str, Any]) -> Dict[str, float]:
+    return {"payments": 1, "amount": float(payment.get("amount") or 0)}
+
+
+def swipe_counts(swipe: Dict[str, Any]) -> Dict[str, float]:
+    return {"accepts": 1} if swipe.get("action") == "accept" else {"rejects": 1}
+
+
+async def batches(cursor, size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class StatsRollups:
+    """Maintains and reads the daily rollups in ``collection``"""
+
+    def __init__(self, collection, jobs_collection, archive_collection=None):
+        self.collection = collection
+        self.jobs_collection = jobs_collection
+        # Payments and swipes may name jobs that have since been archived
+        self.archive_collection = archive_collection
+
+    async def ensure_indexes(self, collection=None):
+        await (collection or self.collection).create_index([("scope", 1), ("key", 1), ("day", 1)])
+
+    async def categories(self, job_ids: Iterable[str]) -> Dict[str, str]:
+        """Category per job ID, for the jobs that still exist live or archived"""
+        missing = {job_id for job_id in job_ids if job_id}
+        found: Dict[str, str] = {}
+        for collection in (self.jobs_collection, self.archive_collection):
+            if collection is None or not missing:
+                continue
+            async for job in collection.find({"id": {"$in": list(missing)}}, {"id": 1, "category": 1, "_id": 0}):
+                found[job["id"]] = job.get("category")
+                missing.discard(job["id"])
+        return found
+
+    async def _apply(self, increments: Increments, collection=None):
+        if not increments:
+            return
+        now = datetime.now(timezone.utc)
+        # Upserts by _id, which the server retries itself when two race to insert
+        await (collection or self.collection).bulk_write([
+            UpdateOne(
+                {"_id": _id},
+                {"$inc": counts, "$set": {"updated_at": now}, "$setOnInsert": fields},
+                upsert=True,
+            )
+            for _id, (fields, counts) in increments.items()
+        ], ordered=False)
+
+    async def _payment_increments(self, payments: List[Dict[str, Any]]) -> Increments:
+        categories = await self.categories(payment.get("job_id") for payment in payments)
+        increments: Increments = {}
+        for payment in payments:
+            add_event(
+                increments, payment.get("user_id"), categories.get(payment.get("job_id")),
+                day_of(payment.get("completed_at")), payment_counts(payment),
+            )
+        return increments
+
+    async def _swipe_increments(self, swipes: List[Dict[str, Any]]) -> Increments:
+        categories = await self.categories(swipe["job_id"] for swipe in swipes)
+        increments: Increments = {}
+        for swipe in swipes:
+            add_event(
+                increments, swipe.get("user_id"), categories.get(swipe["job_id"]),
+                day_of(swipe.get("timestamp")), swipe_counts(swipe),
+            )
+        return increments
+
+    async def record_payment(self, payment: Dict[str, Any]):
+        """Count a payment that just completed"""
+        try:
+            await self._apply(await self._payment_increments([payment]))
+        except Exception as e:
+            logger.error("Updating payment rollups failed", extra={"payment_id": payment.get("payment_id"), "error": str(e)})
+
+    async def record_swipes(self, swipes: List[Dict[str, Any]]):
+        """Count swipes that were just written"""
+        try:
+            await self._apply(await self._swipe_increments(swipes))
+        except Exception as e:
+            logger.error("Updating swipe rollups failed", extra={"swipes": len(swipes), "error": str(e)})
+
+    async def daily(self, scope: str, key: str, first: date, last: date) -> List[Dict[str, Any]]:
+        """Stats for each day from ``first`` to ``last``, days without activity included"""
+        # Walks the (scope, key, day) index: one document per day with activity
+        query = {"scope": scope, "key": key, "day": {"$gte": day_start(first), "$lte": day_start(last)}}
+        found = {}
+        async for rollup in self.collection.find(query, {"_id": 0, "day": 1, **{name: 1 for name in COUNTERS}}):
+            found[day_of(rollup["day"])] = rollup
+        days = []
+        day = first
+        while day <= last:
+            rollup = found.get(day, {})
+            accepts, rejects = rollup.get("accepts", 0), rollup.get("rejects", 0)
+            days.append({
+                "day": day.isoformat(),
+                "payments": rollup.get("payments", 0),
+                "amount": round(rollup.get("amount", 0), AMOUNT_DIGITS),
+                "accepts": accepts,
+                "rejects": rejects,
+                "acceptance_rate": acceptance_rate(accepts, rejects),
+            })
+            day += timedelta(days=1)
+        return days
+
+    async def rebuild(self, transactions_collection, swipes_collection, batch_size: int = 1000,
+                      completed_status: str = "completed") -> Dict[str, int]:
+        """Recompute every rollup from scratch.
+
+        Reads completed payments and swipes ``batch_size`` at a time into a
+        scratch collection, then renames it over ``collection``. Increments
+        made by the API while this runs are lost with the old collection, so
+        run it when traffic is low.
+        """
+        scratch = self.collection.database[f"{self.collection.name}_rebuild"]
+        await scratch.drop()
+        counts = {"payments": 0, "swipes": 0}
+        payments = transactions_collection.find(
+            {"status": completed_status}, {"user_id": 1, "job_id": 1, "amount": 1, "completed_at": 1}
+        ).batch_size(batch_size)
+        async for batch in batches(payments, batch_size):
+            await self._apply(await self._payment_increments(batch), scratch)
+            counts["payments"] += len(batch)
+        swipes = swipes_collection.find({}, {"user_id": 1, "job_id": 1, "action": 1, "timestamp": 1}).batch_size(batch_size)
+        async for batch in batches(swipes, batch_size):
+            await self._apply(await self._swipe_increments(batch), scratch)
+            counts["swipes"] += len(batch)
+        await self.ensure_indexes(scratch)
+        if counts["payments"] or counts["swipes"]:
+            await scratch.rename(self.collection.name, dropTarget=True)
+        else:
+            await self.collection.delete_many({})
+        return counts
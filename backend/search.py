@@ -0,0 +1,41 @@
+"""Full-text job search over a weighted MongoDB text index."""
+from typing import Any, Dict, List, Optional
+
+from pagination import apply_cursor
+
+JOB_TEXT_INDEX = [("title", "text"), ("description", "text"), ("category", "text")]
+JOB_TEXT_WEIGHTS = {"title": 10, "category": 5, "description": 1}
+
+# Best match first; `id` breaks ties between equally scored jobs
+SEARCH_SORT = [("score", -1), ("id", 1)]
+
+
+async def ensure_text_index(jobs_collection):
+    await jobs_collection.create_index(
+        JOB_TEXT_INDEX, weights=JOB_TEXT_WEIGHTS, name="job_text", default_language="english"
+    )
+
+
+def build_search_pipeline(q: str, category: Optional[str], limit: int, cursor: Optional[str] = None,
+                          projection: Optional[Dict[str, Any]] = None,
+                          filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Aggregation returning one page of matches, best score first.
+
+    Fetches ``limit + 1`` jobs so the caller can tell whether another page
+    exists; ``projection`` must keep ``score``, and ``filters`` further
+    restrict the matches. Raises ``InvalidCursor`` for cursors we did not
+    issue.
+    """
+    match: Dict[str, Any] = {"$text": {"$search": q}, **(filters or {})}
+    if category:
+        match["category"] = category
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$match": apply_cursor({}, cursor, SEARCH_SORT)},
+        {"$sort": dict(SEARCH_SORT)},
+        {"$limit": limit + 1},
+    ]
+    if projection:
+        pipeline.append({"$project": projection})
+    return pipeline
@@ -0,0 +1,92 @@
+"""Fast path for job responses.
+
+FastAPI normally validates whatever an endpoint returns against its
+``response_model`` and runs it through ``jsonable_encoder`` before encoding
+it with the standard ``json`` module. For job cards that work is redundant:
+the documents come from our own collection in the model's shape. Job
+endpoints therefore
+
+* fetch only the model's fields with a projection (no ``_id``, so there is
+  no ObjectId to stringify), and
+* return ``JobsResponse``, which hands the documents straight to orjson.
+
+The routes keep their ``response_model`` so the OpenAPI schema is unchanged.
+
+Clients that show less than a whole job can ask for a sparse fieldset;
+``parse_fields`` checks one against the model and ``select_fields`` trims
+documents to it.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+
+class JobsResponse(ORJSONResponse):
+    """JSON response encoded by orjson without response-model validation"""
+
+    def render(self, content: Any) -> bytes:
+        # MongoDB returns naive UTC datetimes; give them their offset
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+        )
+
+
+def model_projection(model: Type[BaseModel], *extra: str) -> Dict[str, int]:
+    """Projection selecting ``model``'s fields plus ``extra``, without ``_id``"""
+    projection = {name: 1 for name in model.model_fields}
+    projection.update((name, 1) for name in extra)
+    projection["_id"] = 0
+    return projection
+
+
+def optional_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Defaults of ``model``'s optional fields, which documents may lack"""
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if not field.is_required()
+    }
+
+
+def with_defaults(documents: Iterable[Dict[str, Any]], defaults: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Fill in missing optional fields in place, as validation would have"""
+    documents = list(documents)
+    if defaults:
+        for document in documents:
+            for name, default in defaults.items():
+                if name not in document:
+                    document[name] = default
+    return documents
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """Names in a sparse fieldset such as ``"id,title,payment"``, in ``model``'s order.
+
+    ``None`` when no fieldset was given; raises ``ValueError`` naming any
+    field ``model`` does not have.
+    """
+    if fields is None:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(names - set(model.model_fields))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return [name for name in model.model_fields if name in names]
+
+
+def select_fields(documents: Iterable[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    """Copies of ``documents`` holding only ``fields``; the originals may be cached"""
+    return [{name: document[name] for name in fields if name in document} for document in documents]
+
+
+def truncate(text: str, length: int) -> str:
+    """``text`` cut to at most ``length`` characters, at a word boundary where there is one"""
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    space = cut.rfind(" ")
+    if space > length // 2:
+        cut = cut[:space]
+    return cut.rstrip(" ,.;:-") + "…"
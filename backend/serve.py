@@ -0,0 +1,37 @@
+"""Production launcher: the API in several uvicorn worker processes.
+
+    python serve.py --workers 4 --port 8001
+
+``--workers`` defaults to ``WEB_CONCURRENCY`` or the CPU count. Every worker
+imports ``server`` on its own and opens its own MongoDB pool, of up to
+``MONGO_MAX_POOL_SIZE`` connections, when its lifespan starts. One of them
+creates indexes and seeds the database; the others skip that step.
+"""
+import argparse
+import os
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get('WEB_CONCURRENCY', '0')) or os.cpu_count() or 1
+    )
+    parser.add_argument("--access-log", action="store_true", help="Enable uvicorn's per-request access log")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        "server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        access_log=args.access_log,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
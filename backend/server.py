@@ -1,18 +1,228 @@
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import List, Literal, Optional, Dict, Any
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
 import uuid
-from datetime import datetime
-import requests
-import json
+import socket
+import logging
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+import hashlib
+import secrets
+import tempfile
 
-app = FastAPI(title="Wolk API", version="1.0.0")
+from pymongo.errors import DuplicateKeyError
 
-# CORS middleware
+from database import Mongo, acquire_lease
+from archive import (
+    ARCHIVE_SORT, OPEN, JobArchiver, ensure_archive_indexes, ensure_live_indexes, is_live, live_query, next_expiry,
+    to_datetime, utcnow,
+)
+from pi_client import PiAPIError, PiClient
+from pagination import InvalidCursor, apply_cursor, decode_cursor, fetch_page, split_page
+from deck import DeckService
+from employers import EmployerDirectory
+from ranking import RankingEngine
+from swipe_buffer import SwipeBufferFull, SwipeWriteBuffer
+from cache import CollectionVersions, CollectionWatcher, TTLCache
+from search import SEARCH_SORT, build_search_pipeline, ensure_text_index
+from events import MATCH, PAYMENT, EventBroker
+from exports import csv_stream, ndjson_stream
+from images import FORMATS, DiskCache, ImageError, ImagePipeline
+from imports import JobImporter, csv_rows, iter_lines, ndjson_rows
+from serialization import (
+    JobsResponse, model_projection, optional_defaults, parse_fields, select_fields, truncate, with_defaults,
+)
+from logging_config import configure_logging, shutdown_logging
+from compression import CompressionMiddleware
+from metrics import REGISTRY, CallbackMetric, EventLoopLagMonitor, MetricsMiddleware, MongoCommandMetrics
+from rollups import ALL, CATEGORY, USER, StatsRollups, summarize
+from ratelimit import (
+    AdmissionControlMiddleware, MemoryBucketStore, MongoBucketStore, RateLimit, RateLimitMiddleware, client_ip,
+)
+from payments import (
+    APPROVE_TASK, COMPLETE_TASK, COMPLETED, FAILED, PaymentReconciler, PaymentService, PaymentStore,
+    payment_task_handlers,
+)
+from sessions import InvalidSession, RevocationCache, Session, SessionManager
+from task_queue import TaskQueue, TaskWorker
+
+configure_logging()
+logger = logging.getLogger("wolk.api")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
+app = FastAPI(title="Wolk API", version="1.0.0", lifespan=lifespan)
+
+# MongoDB connection; each process opens its own client on first use
+mongo = Mongo(event_listeners=[MongoCommandMetrics()])
+jobs_collection = mongo.collection("jobs")
+jobs_archive_collection = mongo.collection("jobs_archive")
+users_collection = mongo.collection("users")
+transactions_collection = mongo.collection("transactions")
+swipes_collection = mongo.collection("swipes")
+employers_collection = mongo.collection("employers")
+employer_ratings_collection = mongo.collection("employer_ratings")
+tasks_collection = mongo.collection("tasks")
+locks_collection = mongo.collection("locks")
+rate_limits_collection = mongo.collection("rate_limits")
+revoked_sessions_collection = mongo.collection("revoked_sessions")
+stats_daily_collection = mongo.collection("stats_daily")
+collection_versions_collection = mongo.collection("collection_versions")
+
+# Only one process per STARTUP_LEASE_TTL seconds creates indexes and seeds
+STARTUP_LEASE_TTL = float(os.environ.get('STARTUP_LEASE_TTL', '60'))
+
+# Pi Network Configuration
+PI_API_KEY = os.environ.get('PI_API_KEY')
+PI_APP_ID = os.environ.get('PI_APP_ID')
+PI_WALLET_KEY = os.environ.get('PI_WALLET_KEY')
+
+# Swipe ingestion
+MAX_SWIPE_BATCH = int(os.environ.get('MAX_SWIPE_BATCH', '200'))
+SWIPE_FLUSH_SIZE = int(os.environ.get('SWIPE_FLUSH_SIZE', '500'))
+SWIPE_FLUSH_INTERVAL = float(os.environ.get('SWIPE_FLUSH_INTERVAL', '0.25'))
+SWIPE_MAX_PENDING = int(os.environ.get('SWIPE_MAX_PENDING', '10000'))
+
+# Payment reconciliation
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL', '30'))
+RECONCILE_STALE_AFTER = float(os.environ.get('RECONCILE_STALE_AFTER', '60'))
+
+# Payment task queue; approvals and completions run in worker.py processes.
+# TASK_CONSUMERS > 0 also runs that many consumers inside the API process.
+TASK_LEASE = float(os.environ.get('TASK_LEASE', '30'))
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', '8'))
+TASK_CONSUMERS = int(os.environ.get('TASK_CONSUMERS', '0'))
+
+# Personalized deck ranking; RANK_BUDGET_MS caps the scoring time per deck
+RANKING_ENABLED = os.environ.get('RANKING_ENABLED', 'true').lower() == 'true'
+RANK_BUDGET_MS = float(os.environ.get('RANK_BUDGET_MS', '25'))
+
+# Server-sent event streams; each open stream buffers at most EVENTS_QUEUE_SIZE events
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', '10000'))
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', '15'))
+
+# Per-client rate limits, "rate/burst": requests per second and burst size.
+# RATE_LIMIT_STORE=mongo shares the limits between API processes.
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')
+RATE_LIMIT_SWIPE = RateLimit.parse(os.environ.get('RATE_LIMIT_SWIPE', '10/30'))
+RATE_LIMIT_SWIPE_BATCH = RateLimit.parse(os.environ.get('RATE_LIMIT_SWIPE_BATCH', '2/5'))
+RATE_LIMIT_PAYMENTS = RateLimit.parse(os.environ.get('RATE_LIMIT_PAYMENTS', '1/5'))
+RATE_LIMIT_JOBS = RateLimit.parse(os.environ.get('RATE_LIMIT_JOBS', '1/10'))
+
+# Admission control: requests served at once, and how many may wait how long
+# for a slot before being shed with 503. MAX_CONCURRENT_REQUESTS=0 disables it.
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', '256'))
+ADMISSION_QUEUE = int(os.environ.get('ADMISSION_QUEUE', '256'))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '0.5'))
+
+# Job caches; CACHE_TTL is the longest cached job data can stay stale
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '30'))
+CACHE_MAX_JOBS = int(os.environ.get('CACHE_MAX_JOBS', '10000'))
+CACHE_MAX_EMPLOYERS = int(os.environ.get('CACHE_MAX_EMPLOYERS', '10000'))
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', '5'))
+
+# HTTP caching: seconds clients and CDNs may reuse a response before
+# revalidating it with its ETag
+FEED_MAX_AGE = int(os.environ.get('FEED_MAX_AGE', '10'))
+JOB_MAX_AGE = int(os.environ.get('JOB_MAX_AGE', '60'))
+CATEGORIES_MAX_AGE = int(os.environ.get('CATEGORIES_MAX_AGE', '300'))
+
+# Responses of COMPRESSION_MIN_SIZE bytes or more are sent gzip- or
+# brotli-compressed to clients that accept it
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+# Descriptions in the card view of jobs (view=card) are cut to this length
+CARD_DESCRIPTION_CHARS = int(os.environ.get('CARD_DESCRIPTION_CHARS', '140'))
+
+# Past-deadline jobs move to jobs_archive every ARCHIVE_INTERVAL seconds.
+# ARCHIVE_RETENTION_DAYS > 0 deletes archived jobs that much later.
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', '60'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_RETENTION_DAYS = float(os.environ.get('ARCHIVE_RETENTION_DAYS', '0'))
+
+# Bulk job import; IMPORT_CHUNK_SIZE jobs per insert_many
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '1000'))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '100'))
+
+# Job card images; resized variants are cached on disk up to IMAGE_CACHE_MAX_MB.
+# Only images on IMAGE_ALLOWED_HOSTS (comma-separated) are fetched.
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'wolk-images'))
+IMAGE_CACHE_MAX_MB = float(os.environ.get('IMAGE_CACHE_MAX_MB', '1024'))
+IMAGE_ALLOWED_HOSTS = os.environ.get('IMAGE_ALLOWED_HOSTS', 'images.unsplash.com')
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '80'))
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', '3600'))
+
+# Sessions; every API process must share SESSION_SECRET. AUTH_REQUIRED=false
+# also accepts requests naming their user_id without a session, for development.
+SESSION_SECRET = os.environ.get('SESSION_SECRET')
+SESSION_TTL = float(os.environ.get('SESSION_TTL', '3600'))
+SESSION_REVOCATION_POLL = float(os.environ.get('SESSION_REVOCATION_POLL', '5'))
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', 'true').lower() == 'true'
+if not SESSION_SECRET:
+    logger.warning("SESSION_SECRET is not set; sessions will not survive a restart or work across processes")
+    SESSION_SECRET = secrets.token_urlsafe(32)
+
+session_revocations = RevocationCache(revoked_sessions_collection, poll_interval=SESSION_REVOCATION_POLL)
+sessions = SessionManager(SESSION_SECRET, ttl=SESSION_TTL, revocations=session_revocations)
+
+def bearer_token(authorization: str) -> Optional[str]:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
+
+def rate_limit_key(scope) -> str:
+    """The session's user for signed-in clients, else the client IP"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            token = bearer_token(value.decode("latin-1"))
+            if token:
+                try:
+                    return "user:" + sessions.verify(token).user_id
+                except InvalidSession:
+                    pass
+            break
+    return client_ip(scope)
+if RATE_LIMIT_STORE == 'mongo':
+    rate_limit_store = MongoBucketStore(rate_limits_collection)
+else:
+    rate_limit_store = MemoryBucketStore()
+
+app.add_middleware(
+    AdmissionControlMiddleware,
+    max_concurrent=MAX_CONCURRENT_REQUESTS,
+    max_queue=ADMISSION_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+    # Long-lived streams would hold their slots for their whole duration
+    exempt=["/api/health", "/metrics", "/api/events", "/api/transactions/export", "/api/jobs/import"],
+)
+app.add_middleware(
+    RateLimitMiddleware,
+    limits={
+        ("POST", "/api/swipe"): RATE_LIMIT_SWIPE,
+        ("POST", "/api/swipe/batch"): RATE_LIMIT_SWIPE_BATCH,
+        ("POST", "/api/payments/approve"): RATE_LIMIT_PAYMENTS,
+        ("POST", "/api/payments/complete"): RATE_LIMIT_PAYMENTS,
+        ("POST", "/api/jobs"): RATE_LIMIT_JOBS,
+        ("POST", "/api/jobs/import"): RATE_LIMIT_JOBS,
+    },
+    store=rate_limit_store,
+    key=rate_limit_key,
+    enabled=RATE_LIMIT_ENABLED,
+)
+# CORS middleware, outside the limits so their 429s and 503s carry CORS headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,21 +230,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+app.add_middleware(MetricsMiddleware)
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.wolk_db
-jobs_collection = db.jobs
-users_collection = db.users
-transactions_collection = db.transactions
-
-# Pi Network Configuration
-PI_API_KEY = os.environ.get('PI_API_KEY')
-PI_APP_ID = os.environ.get('PI_APP_ID')
-PI_WALLET_KEY = os.environ.get('PI_WALLET_KEY')
+pi_client = PiClient(PI_API_KEY)
+# Daily payment and swipe rollups behind /api/stats
+stats_rollups = StatsRollups(stats_daily_collection, jobs_collection, jobs_archive_collection)
+payment_store = PaymentStore(transactions_collection, on_completed=stats_rollups.record_payment)
+payment_reconciler = PaymentReconciler(
+    payment_store,
+    pi_client,
+    interval=RECONCILE_INTERVAL,
+    stale_after=RECONCILE_STALE_AFTER,
+)
+payment_service = PaymentService(payment_store, pi_client)
+task_queue = TaskQueue(tasks_collection, lease=TASK_LEASE, max_attempts=TASK_MAX_ATTEMPTS)
+task_worker = TaskWorker(task_queue, payment_task_handlers(payment_service), concurrency=TASK_CONSUMERS)
 
 # Pydantic models
+class GeoPoint(BaseModel):
+    type: str = "Point"
+    coordinates: List[float]  # [longitude, latitude]
+
 class Job(BaseModel):
     id: str
     title: str
@@ -43,10 +261,95 @@ class Job(BaseModel):
     location: str
     employer: str
     employer_rating: float
+    employer_id: Optional[str] = None
     category: str
     image_url: str
-    deadline: str
-    created_at: str
+    deadline: datetime
+    created_at: datetime
+    geo: Optional[GeoPoint] = None
+
+class JobPage(BaseModel):
+    jobs: List[Job]
+    next_cursor: Optional[str] = None
+
+class NearbyJob(Job):
+    distance_km: float
+
+class NearbyJobPage(BaseModel):
+    jobs: List[NearbyJob]
+    next_cursor: Optional[str] = None
+
+class Deck(BaseModel):
+    jobs: List[Job]
+
+class SearchJob(Job):
+    score: float
+
+class SearchJobPage(BaseModel):
+    jobs: List[SearchJob]
+    next_cursor: Optional[str] = None
+
+class ArchivedJob(Job):
+    archived_at: datetime
+
+class ArchivedJobPage(BaseModel):
+    jobs: List[ArchivedJob]
+    next_cursor: Optional[str] = None
+
+# Job endpoints fetch just these fields and skip response-model validation
+JOB_PROJECTION = model_projection(Job)
+NEARBY_JOB_PROJECTION = model_projection(NearbyJob)
+SEARCH_JOB_PROJECTION = model_projection(SearchJob)
+ARCHIVED_JOB_PROJECTION = model_projection(ArchivedJob)
+JOB_DEFAULTS = optional_defaults(Job)
+# What a swipe card shows (view=card)
+CARD_FIELDS = ["id", "title", "description", "payment", "location", "employer", "employer_rating", "category",
+               "image_url", "deadline"]
+# Attached from employers rather than read from migrated jobs
+EMPLOYER_FIELDS = {"employer", "employer_rating"}
+
+class JobCreate(BaseModel):
+    # Optional caller-chosen ID, e.g. a partner board's listing ID; reused IDs are rejected
+    id: Optional[str] = Field(None, min_length=1, max_length=100)
+    title: str = Field(..., min_length=1, max_length=200)
+    description: str = Field(..., max_length=10000)
+    payment: float = Field(..., gt=0)
+    location: str = Field(..., min_length=1, max_length=200)
+    # An existing employer, or a name to find or create one by
+    employer_id: Optional[str] = None
+    employer: Optional[str] = Field(None, min_length=1, max_length=200)
+    category: str = Field(..., min_length=1, max_length=100)
+    image_url: str = ""
+    # An ISO date or datetime; a bare date lasts until the end of that day, UTC
+    deadline: datetime
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+
+    @field_validator("deadline", mode="before")
+    @classmethod
+    def parse_deadline(cls, value):
+        if isinstance(value, (str, date)):
+            try:
+                return to_datetime(value, end_of_day=True)
+            except ValueError:
+                raise ValueError("deadline must be an ISO date or datetime")
+        return value
+
+    @field_validator("deadline")
+    @classmethod
+    def check_deadline(cls, value: datetime) -> datetime:
+        value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+        if value <= utcnow():
+            raise ValueError("deadline has passed")
+        return value
+
+    @model_validator(mode="after")
+    def check_references(self):
+        if not (self.employer_id or self.employer):
+            raise ValueError("employer_id or employer is required")
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude go together")
+        return self
 
 class PiUser(BaseModel):
     uid: str
@@ -65,25 +368,26 @@ class PaymentCompletion(BaseModel):
     paymentId: str
     txid: str
 
+class EmployerRating(BaseModel):
+    user_id: Optional[str] = None  # defaults to the session's user
+    rating: float = Field(..., ge=1, le=5)
+
 class SwipeAction(BaseModel):
     job_id: str
-    user_id: str
-    action: str  # "accept" or "reject"
+    user_id: Optional[str] = None  # defaults to the session's user
+    action: Literal["accept", "reject"]
 
-# Pi API verification
-def verify_pi_payment(payment_id: str):
-    """Verify payment with Pi Network servers"""
-    try:
-        url = f"https://api.minepi.com/v2/payments/{payment_id}"
-        headers = {"Authorization": f"Key {PI_API_KEY}"}
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        print(f"Error verifying payment: {e}")
-        return None
+# Employers of the sample jobs
+sample_employers = [
+    {"id": str(uuid.uuid4()), "name": "John Smith", "rating": 4.8},
+    {"id": str(uuid.uuid4()), "name": "Clean Solutions Ltd", "rating": 4.6},
+    {"id": str(uuid.uuid4()), "name": "Maria Andersson", "rating": 4.9},
+    {"id": str(uuid.uuid4()), "name": "Baltic Business Corp", "rating": 4.7},
+    {"id": str(uuid.uuid4()), "name": "Nordic Innovations", "rating": 4.5}
+]
+
+# Sample jobs are dated from startup, so a fresh database has a live feed
+SAMPLE_DATE = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
 
 # Sample job data with Wolk branding
 sample_jobs = [
@@ -93,12 +397,13 @@ sample_jobs = [
         "description": "Need someone to chop firewood for winter. Urgently need assistance! Must be physically fit and have experience with axes.",
         "payment": 50.0,
         "location": "Tallinn, Estonia",
-        "employer": "John Smith",
-        "employer_rating": 4.8,
+        "geo": {"type": "Point", "coordinates": [24.7536, 59.437]},
+        "employer_id": sample_employers[0]["id"],
         "category": "Manual Labor",
         "image_url": "https://images.unsplash.com/photo-1675134768072-d700f38ceef0?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NTY2Njd8MHwxfHNlYXJjaHwzfHx3b3JrJTIwam9ic3xlbnwwfHx8fDE3NTI3NTg2MDF8MA&ixlib=rb-4.1.0&q=85",
-        "deadline": "2025-03-20",
-        "created_at": "2025-03-15"
+        "status": OPEN,
+        "deadline": SAMPLE_DATE + timedelta(days=6),
+        "created_at": SAMPLE_DATE
     },
     {
         "id": str(uuid.uuid4()),
@@ -106,12 +411,13 @@ sample_jobs = [
         "description": "Looking for reliable cleaner for small office space. Daily cleaning required, flexible hours available.",
         "payment": 35.0,
         "location": "Riga, Latvia",
-        "employer": "Clean Solutions Ltd",
-        "employer_rating": 4.6,
+        "geo": {"type": "Point", "coordinates": [24.1052, 56.9496]},
+        "employer_id": sample_employers[1]["id"],
         "category": "Cleaning",
         "image_url": "https://images.unsplash.com/photo-1741543821138-471a53f147f2?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NTY2Njd8MHwxfHNlYXJjaHwyfHx3b3JrJTIwam9ic3xlbnwwfHx8fDE3NTI3NTg2MDF8MA&ixlib=rb-4.1.0&q=85",
-        "deadline": "2025-03-25",
-        "created_at": "2025-03-14"
+        "status": OPEN,
+        "deadline": SAMPLE_DATE + timedelta(days=11),
+        "created_at": SAMPLE_DATE - timedelta(days=1)
     },
     {
         "id": str(uuid.uuid4()),
@@ -119,12 +425,13 @@ sample_jobs = [
         "description": "Need a simple website for my restaurant. Looking for someone with React and modern web development skills.",
         "payment": 120.0,
         "location": "Helsinki, Finland",
-        "employer": "Maria Andersson",
-        "employer_rating": 4.9,
+        "geo": {"type": "Point", "coordinates": [24.9384, 60.1699]},
+        "employer_id": sample_employers[2]["id"],
         "category": "Technology",
         "image_url": "https://images.unsplash.com/photo-1504384308090-c894fdcc538d?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1Nzl8MHwxfHNlYXJjaHwyfHxlbXBsb3ltZW50fGVufDB8fHx8MTc1Mjc1ODYwOXww&ixlib=rb-4.1.0&q=85",
-        "deadline": "2025-03-30",
-        "created_at": "2025-03-13"
+        "status": OPEN,
+        "deadline": SAMPLE_DATE + timedelta(days=16),
+        "created_at": SAMPLE_DATE - timedelta(days=2)
     },
     {
         "id": str(uuid.uuid4()),
@@ -132,12 +439,13 @@ sample_jobs = [
         "description": "Need someone to translate business documents from English to Estonian. Must have professional translation experience.",
         "payment": 80.0,
         "location": "Tartu, Estonia",
-        "employer": "Baltic Business Corp",
-        "employer_rating": 4.7,
+        "geo": {"type": "Point", "coordinates": [26.729, 58.378]},
+        "employer_id": sample_employers[3]["id"],
         "category": "Professional Services",
         "image_url": "https://images.unsplash.com/photo-1562564055-71e051d33c19?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1Nzl8MHwxfHNlYXJjaHwxfHxlbXBsb3ltZW50fGVufDB8fHx8MTc1Mjc1ODYwOXww&ixlib=rb-4.1.0&q=85",
-        "deadline": "2025-03-22",
-        "created_at": "2025-03-12"
+        "status": OPEN,
+        "deadline": SAMPLE_DATE + timedelta(days=8),
+        "created_at": SAMPLE_DATE - timedelta(days=3)
     },
     {
         "id": str(uuid.uuid4()),
@@ -145,122 +453,481 @@ sample_jobs = [
         "description": "Small startup needs marketing strategy consultation. Looking for someone with digital marketing experience.",
         "payment": 95.0,
         "location": "Stockholm, Sweden",
-        "employer": "Nordic Innovations",
-        "employer_rating": 4.5,
+        "geo": {"type": "Point", "coordinates": [18.0686, 59.3293]},
+        "employer_id": sample_employers[4]["id"],
         "category": "Consulting",
         "image_url": "https://images.unsplash.com/photo-1517048676732-d65bc937f952?crop=entropy&cs=srgb&fm=jpg&ixid=M3w3NDk1Nzl8MHwxfHNlYXJjaHwzfHxlbXBsb3ltZW50fGVufDB8fHx8MTc1Mjc1ODYwOXww&ixlib=rb-4.1.0&q=85",
-        "deadline": "2025-03-28",
-        "created_at": "2025-03-11"
+        "status": OPEN,
+        "deadline": SAMPLE_DATE + timedelta(days=14),
+        "created_at": SAMPLE_DATE - timedelta(days=4)
     }
 ]
 
-@app.on_event("startup")
+# Newest jobs first; `id` breaks ties between jobs created at the same time
+JOB_FEED_SORT = [("created_at", -1), ("id", -1)]
+
+swipe_buffer = SwipeWriteBuffer(
+    swipes_collection,
+    batch_size=SWIPE_FLUSH_SIZE,
+    flush_interval=SWIPE_FLUSH_INTERVAL,
+    max_pending=SWIPE_MAX_PENDING,
+    on_written=stats_rollups.record_swipes,
+)
+deck_service = DeckService(
+    jobs_collection,
+    swipes_collection,
+    JOB_FEED_SORT,
+    pending_swipes=swipe_buffer.pending_job_ids,
+    projection=JOB_PROJECTION,
+    query=live_query,
+    is_live=is_live,
+    # Exhausted decks start over once jobs are added
+    version=lambda: collection_versions.get("jobs"),
+)
+ranker = RankingEngine(
+    jobs_collection,
+    swipes_collection,
+    JOB_FEED_SORT,
+    projection=JOB_PROJECTION,
+    budget=RANK_BUDGET_MS / 1000,
+    pending_swipes=swipe_buffer.pending_job_ids,
+    # Past-deadline jobs are masked when scoring
+    query={"status": OPEN},
+    employers_collection=employers_collection,
+    version=lambda: collection_versions.get("jobs"),
+)
+
+# Keyed by the live version (see live_version), so a bump or a passed deadline is a miss
+categories_cache = TTLCache(max_size=1, ttl=CACHE_TTL)
+job_cache = TTLCache(max_size=CACHE_MAX_JOBS, ttl=CACHE_TTL)
+# First feed page per (category, limit, live version)
+feed_cache = TTLCache(max_size=256, ttl=CACHE_TTL)
+employer_cache = TTLCache(max_size=CACHE_MAX_EMPLOYERS, ttl=CACHE_TTL)
+employer_directory = EmployerDirectory(employers_collection, employer_ratings_collection, employer_cache)
+
+def on_version_bump(name: str):
+    if name == "employers":
+        # Feed ETags cover employer ratings, which are attached from this cache
+        employer_cache.clear()
+
+# Versions of "jobs" and "employers", bumped after writes; feed ETags are built from them
+collection_versions = CollectionVersions(collection_versions_collection, ttl=CACHE_TTL, on_bump=on_version_bump)
+
+async def bump_jobs_version():
+    await collection_versions.bump("jobs")
+
+# Earliest live deadline per jobs version
+expiry_cache = TTLCache(max_size=1, ttl=CACHE_TTL)
+NO_EXPIRY = datetime.max.replace(tzinfo=timezone.utc)
+
+async def live_version() -> str:
+    """The jobs version and the earliest live deadline, for ETags and cache keys.
+
+    Jobs leave the feed when their deadline passes, before the archiver
+    moves them and bumps the version; the deadline part changes then.
+    """
+    jobs_version, = await collection_versions.get("jobs")
+    expiry = expiry_cache.get(jobs_version)
+    if expiry is None or expiry <= utcnow():
+        expiry = await next_expiry(jobs_collection) or NO_EXPIRY
+        expiry_cache.set(jobs_version, expiry)
+    return f"{jobs_version}.{0 if expiry is NO_EXPIRY else int(expiry.timestamp() * 1000)}"
+
+job_archiver = JobArchiver(
+    jobs_collection,
+    jobs_archive_collection,
+    locks_collection,
+    batch_size=ARCHIVE_BATCH_SIZE,
+    interval=ARCHIVE_INTERVAL,
+    on_archived=bump_jobs_version,
+)
+image_pipeline = ImagePipeline(
+    DiskCache(IMAGE_CACHE_DIR, int(IMAGE_CACHE_MAX_MB * 1024 * 1024)),
+    allowed_hosts=[host.strip() for host in IMAGE_ALLOWED_HOSTS.split(",") if host.strip()],
+    workers=IMAGE_WORKERS,
+    quality=IMAGE_QUALITY,
+)
+
+def invalidate_job_caches(change: Optional[Dict[str, Any]]):
+    """Drop cached job data affected by a change to the jobs collection"""
+    categories_cache.clear()
+    feed_cache.clear()
+    
+    operation = change.get("operationType") if change else None
+    if operation == "insert":
+        return
+    document = change.get("fullDocument") if change else None
+    if document and "id" in document:
+        job_cache.invalidate(document["id"])
+    else:
+        # Deletes and polled changes don't say which job changed
+        job_cache.clear()
+
+async def jobs_fingerprint():
+    """Cheap signature of the jobs collection for the polling fallback.
+
+    Catches inserts and deletes; in-place edits are bounded by CACHE_TTL.
+    """
+    # Covered by the live_feed partial index
+    newest = await jobs_collection.find_one({"status": OPEN}, {"created_at": 1, "id": 1, "_id": 0}, sort=JOB_FEED_SORT)
+    return await jobs_collection.estimated_document_count(), newest
+
+event_broker = EventBroker(queue_size=EVENTS_QUEUE_SIZE, max_subscribers=EVENTS_MAX_STREAMS)
+
+def publish_job_event(change: Optional[Dict[str, Any]]):
+    """Push job inserts and updates to event streams"""
+    document = change.get("fullDocument") if change else None
+    if not document:
+        # Deletes and polled changes: clients refetch, once per burst (e.g. an archived batch)
+        event_broker.publish_resync("jobs", delay=1.0)
+        return
+    job = {name: document[name] for name, include in JOB_PROJECTION.items() if include and name in document}
+    event_broker.publish_job({"operation": change["operationType"], "job": job}, document.get("category"))
+
+def on_jobs_change(change: Optional[Dict[str, Any]]):
+    invalidate_job_caches(change)
+    ranker.on_jobs_changed(change)
+    publish_job_event(change)
+
+jobs_watcher = CollectionWatcher(
+    jobs_collection,
+    on_jobs_change,
+    fingerprint=jobs_fingerprint,
+    poll_interval=JOBS_POLL_INTERVAL,
+)
+
+async def employers_fingerprint():
+    # Ratings change employers in place, so count alone would miss them
+    newest = await employers_collection.find_one({}, {"updated_at": 1, "_id": 0}, sort=[("updated_at", -1)])
+    return await employers_collection.estimated_document_count(), newest
+
+def on_employers_change(change: Optional[Dict[str, Any]]):
+    employer_directory.invalidate(change)
+    ranker.on_employers_changed(change)
+
+employers_watcher = CollectionWatcher(
+    employers_collection,
+    on_employers_change,
+    fingerprint=employers_fingerprint,
+    poll_interval=JOBS_POLL_INTERVAL,
+)
+
+async def versions_fingerprint():
+    return await collection_versions_collection.find({}).sort("_id", 1).to_list(None)
+
+versions_watcher = CollectionWatcher(
+    collection_versions_collection,
+    collection_versions.on_change,
+    fingerprint=versions_fingerprint,
+    poll_interval=JOBS_POLL_INTERVAL,
+)
+
+def publish_payment_event(change: Optional[Dict[str, Any]]):
+    """Push payment state changes to the paying user's event streams"""
+    document = change.get("fullDocument") if change else None
+    if not document:
+        event_broker.publish_resync("transactions", users_only=True)
+        return
+    payment = {name: document.get(name) for name in ("payment_id", "status", "txid", "amount", "job_id")}
+    event_broker.publish_user(PAYMENT, payment, document.get("user_id"))
+
+async def transactions_fingerprint():
+    # Covered by the (status, updated_at) index
+    return (
+        await transactions_collection.estimated_document_count(),
+        await transactions_collection.count_documents({"status": COMPLETED}),
+    )
+
+transactions_watcher = CollectionWatcher(
+    transactions_collection,
+    publish_payment_event,
+    fingerprint=transactions_fingerprint,
+    poll_interval=JOBS_POLL_INTERVAL,
+)
+
+def publish_match_event(change: Optional[Dict[str, Any]]):
+    document = change.get("fullDocument") if change else None
+    if document:
+        match = {name: document.get(name) for name in ("job_id", "user_id", "timestamp")}
+        event_broker.publish_user(MATCH, match, document.get("user_id"))
+
+# Accepted swipes only; without change streams matches are not pushed
+swipes_watcher = CollectionWatcher(
+    swipes_collection,
+    publish_match_event,
+    pipeline=[{"$match": {"operationType": "insert", "fullDocument.action": "accept"}}],
+    poll=False,
+)
+
+# Newest transactions first; `payment_id` is unique and breaks ties
+TRANSACTION_SORT = [("created_at", -1), ("payment_id", -1)]
+TRANSACTION_EXPORT_COLUMNS = [
+    "payment_id", "txid", "user_id", "job_id", "amount", "status", "created_at", "completed_at", "updated_at"
+]
+
+loop_lag_monitor = EventLoopLagMonitor()
+
+CACHES = {"categories": categories_cache, "jobs": job_cache, "feed": feed_cache, "employers": employer_cache}
+CallbackMetric(
+    REGISTRY, "wolk_cache_hits_total", "Cache hits", ["cache"],
+    lambda: {(name, ): cache.hits for name, cache in CACHES.items()}, kind="counter"
+)
+CallbackMetric(
+    REGISTRY, "wolk_cache_misses_total", "Cache misses", ["cache"],
+    lambda: {(name, ): cache.misses for name, cache in CACHES.items()}, kind="counter"
+)
+CallbackMetric(
+    REGISTRY, "wolk_swipe_buffer_pending", "Swipes waiting to be written", [],
+    lambda: {(): len(swipe_buffer)}
+)
+CallbackMetric(
+    REGISTRY, "wolk_event_streams", "Open server-sent event streams", [],
+    lambda: {(): len(event_broker)}
+)
+CallbackMetric(
+    REGISTRY, "wolk_events_total", "Event deliveries to streams, by outcome", ["outcome"],
+    lambda: {("delivered", ): event_broker.delivered, ("dropped", ): event_broker.dropped}, kind="counter"
+)
+CallbackMetric(
+    REGISTRY, "wolk_jobs_archived_total", "Past-deadline jobs moved to the archive", [],
+    lambda: {(): job_archiver.archived}, kind="counter"
+)
+CallbackMetric(
+    REGISTRY, "wolk_image_cache_bytes", "Bytes of originals and resized images cached on disk", [],
+    lambda: {(): image_pipeline.cache.size}
+)
+CallbackMetric(
+    REGISTRY, "wolk_image_renders_total", "Job images resized", [],
+    lambda: {(): image_pipeline.renders}, kind="counter"
+)
+
+async def ensure_indexes():
+    """Create the indexes backing the job feed and swipe decks"""
+    await jobs_collection.create_index("id", unique=True)
+    await ensure_live_indexes(jobs_collection, JOB_FEED_SORT)
+    await ensure_archive_indexes(jobs_archive_collection, ARCHIVE_RETENTION_DAYS)
+    await jobs_collection.create_index([("geo", "2dsphere"), ("category", 1)])
+    await jobs_collection.create_index("employer_id")
+    await ensure_text_index(jobs_collection)
+    await employer_directory.ensure_indexes()
+    await payment_store.ensure_indexes()
+    await task_queue.ensure_indexes()
+    await transactions_collection.create_index(TRANSACTION_SORT)
+    await swipes_collection.create_index([("user_id", 1), ("job_id", 1)], unique=True)
+    await users_collection.create_index("pi_uid", unique=True)
+    await session_revocations.ensure_indexes()
+    await stats_rollups.ensure_indexes()
+    if isinstance(rate_limit_store, MongoBucketStore):
+        await rate_limit_store.ensure_indexes()
+
 async def startup_event():
-    # Initialize database with sample data
-    existing_jobs = await jobs_collection.count_documents({})
-    if existing_jobs == 0:
-        await jobs_collection.insert_many(sample_jobs)
-        print("✅ Sample jobs inserted into Wolk database")
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if await acquire_lease(locks_collection, "startup", owner, STARTUP_LEASE_TTL):
+        await ensure_indexes()
+        
+        # Initialize database with sample data
+        existing_jobs = await jobs_collection.count_documents({})
+        if existing_jobs == 0:
+            for employer in sample_employers:
+                await employer_directory.create(employer["name"], employer["rating"], employer["id"])
+            await jobs_collection.insert_many(sample_jobs)
+            await bump_jobs_version()
+            logger.info("Sample jobs inserted into Wolk database")
+    else:
+        logger.info("Skipping index creation and seeding, another worker holds the startup lease")
+    
+    swipe_buffer.start()
+    session_revocations.start()
+    image_pipeline.start()
+    jobs_watcher.start()
+    versions_watcher.start()
+    employers_watcher.start()
+    transactions_watcher.start()
+    swipes_watcher.start()
+    payment_reconciler.start()
+    job_archiver.start()
+    loop_lag_monitor.start()
+    if RANKING_ENABLED:
+        ranker.start()
+    if TASK_CONSUMERS > 0:
+        task_worker.start()
+
+async def shutdown_event():
+    await task_worker.close()
+    await loop_lag_monitor.close()
+    await payment_reconciler.close()
+    await job_archiver.close()
+    await session_revocations.close()
+    await jobs_watcher.close()
+    await versions_watcher.close()
+    await employers_watcher.close()
+    await transactions_watcher.close()
+    await swipes_watcher.close()
+    await swipe_buffer.close()
+    await deck_service.close()
+    await ranker.close()
+    await image_pipeline.close()
+    await pi_client.aclose()
+    mongo.close()
+    shutdown_logging()
 
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "Wolk API", "pi_integration": "enabled"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+async def current_session(authorization: Optional[str] = Header(None)) -> Optional[Session]:
+    """The session named by the request's bearer token, if it sends one"""
+    if authorization is None:
+        return None
+    token = bearer_token(authorization)
+    try:
+        if token is None:
+            raise InvalidSession("Expected a bearer token")
+        return sessions.verify(token)
+    except InvalidSession as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+async def require_session(session: Optional[Session] = Depends(current_session)) -> Session:
+    if session is None:
+        raise HTTPException(status_code=401, detail="Sign in required", headers={"WWW-Authenticate": "Bearer"})
+    return session
+
+def acting_user_id(session: Optional[Session], user_id: Optional[str]) -> str:
+    """The user a request acts for: its session's, which a given user_id must match"""
+    if session is None:
+        if AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Sign in required", headers={"WWW-Authenticate": "Bearer"})
+        if not user_id:
+            raise HTTPException(status_code=422, detail="user_id is required without a session")
+        return user_id
+    if user_id is not None and user_id != session.user_id:
+        raise HTTPException(status_code=403, detail="user_id does not match the signed-in user")
+    return session.user_id
+
 @app.post("/api/pi/auth")
 async def authenticate_pi_user(user: PiUser):
-    """Store Pi user authentication data"""
+    """Verify a Pi login with the Pi API and start a session"""
     try:
-        # Store user in database
-        user_data = {
-            "pi_uid": user.uid,
-            "username": user.username,
-            "access_token": user.access_token,
-            "created_at": datetime.now().isoformat(),
-            "last_login": datetime.now().isoformat()
-        }
-        
-        # Update or insert user
+        pi_user = await pi_client.get_user(user.access_token)
+    except PiAPIError as e:
+        if e.status_code == 401:
+            raise HTTPException(status_code=401, detail="Invalid Pi access token")
+        logger.warning("Pi user lookup failed", extra={"error": str(e), "status_code": e.status_code})
+        raise HTTPException(status_code=502, detail="Could not verify the login with Pi Network")
+    if pi_user.get("uid") != user.uid:
+        raise HTTPException(status_code=401, detail="Access token belongs to another user")
+    username = pi_user.get("username") or user.username
+
+    try:
+        # The Pi access token is only needed to verify the login, so it is not stored
+        now = datetime.now().isoformat()
         await users_collection.update_one(
             {"pi_uid": user.uid},
-            {"$set": user_data},
+            {
+                "$set": {"username": username, "last_login": now},
+                "$setOnInsert": {"created_at": now},
+                "$unset": {"access_token": ""},
+            },
             upsert=True
         )
-        
-        print(f"✅ Pi user authenticated: {user.username}")
-        return {"status": "success", "message": "User authenticated successfully"}
+        token, session = sessions.issue(user.uid, username)
+
+        logger.info("Pi user authenticated", extra={"username": username})
+        return {
+            "status": "success",
+            "message": "User authenticated successfully",
+            "token": token,
+            "token_type": "bearer",
+            "expires_at": session.expires_at.isoformat(),
+        }
     
-    except Exception as e:
-        print(f"❌ Error authenticating user: {e}")
+    except Exception:
+        logger.exception("Error authenticating user")
         raise HTTPException(status_code=500, detail="Authentication failed")
 
+@app.post("/api/pi/logout")
+async def logout(session: Session = Depends(require_session)):
+    """End the current session"""
+    try:
+        await session_revocations.revoke(session)
+        return {"status": "success", "message": "Signed out"}
+    except Exception:
+        logger.exception("Error revoking session")
+        raise HTTPException(status_code=500, detail="Sign out failed")
+
+def completed_response(payment: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "status": "success", 
+        "message": "Payment completed successfully",
+        "txid": payment.get("txid"),
+        "amount": payment.get("amount", 0)
+    }
+
+def task_response(task: Dict[str, Any]) -> JSONResponse:
+    status_url = f"/api/tasks/{task['_id']}"
+    return JSONResponse(
+        status_code=202,
+        content={"status": task["status"], "task_id": task["_id"], "status_url": status_url},
+        headers={"Location": status_url},
+    )
+
 @app.post("/api/payments/approve")
-async def approve_payment(approval: PaymentApproval):
-    """Approve payment with Pi Network"""
+async def approve_payment(
+    approval: PaymentApproval,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """Queue a payment approval with Pi Network"""
     try:
-        url = "https://api.minepi.com/v2/payments/approve"
-        headers = {
-            "Authorization": f"Key {PI_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        # Retried approvals don't call the Pi API again
+        existing = await payment_store.get(approval.paymentId)
+        if existing:
+            if existing.get("status") == FAILED:
+                raise HTTPException(status_code=400, detail="Payment approval failed")
+            return {"status": "success", "message": "Payment approved"}
         
-        data = {"paymentId": approval.paymentId}
-        response = requests.post(url, json=data, headers=headers)
+        if idempotency_key:
+            owner = await payment_store.get_by_idempotency_key(idempotency_key)
+            if owner and owner["payment_id"] != approval.paymentId:
+                raise HTTPException(status_code=409, detail="Idempotency-Key already used for another payment")
         
-        if response.status_code == 200:
-            # Store pending payment in database
-            payment_record = {
-                "payment_id": approval.paymentId,
-                "status": "approved",
-                "created_at": datetime.now().isoformat()
-            }
-            await transactions_collection.insert_one(payment_record)
-            
-            print(f"✅ Payment approved: {approval.paymentId}")
-            return {"status": "success", "message": "Payment approved"}
-        else:
-            print(f"❌ Payment approval failed: {response.text}")
-            raise HTTPException(status_code=400, detail="Payment approval failed")
+        task = await task_queue.enqueue(
+            APPROVE_TASK,
+            {"payment_id": approval.paymentId, "idempotency_key": idempotency_key},
+            dedupe_key=f"{APPROVE_TASK}:{approval.paymentId}",
+        )
+        return task_response(task)
     
-    except Exception as e:
-        print(f"❌ Error approving payment: {e}")
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error approving payment", extra={"payment_id": approval.paymentId})
         raise HTTPException(status_code=500, detail="Payment approval error")
 
 @app.post("/api/payments/complete")
 async def complete_payment(completion: PaymentCompletion):
-    """Complete payment verification"""
+    """Queue payment verification and completion"""
     try:
-        # Verify payment with Pi Network
-        payment_data = verify_pi_payment(completion.paymentId)
-        
-        if not payment_data:
+        payment = await payment_store.get(completion.paymentId)
+        if payment and payment["status"] == COMPLETED:
+            return completed_response(payment)
+        if payment and payment["status"] == FAILED:
             raise HTTPException(status_code=400, detail="Payment verification failed")
         
-        # Update transaction in database
-        transaction_update = {
-            "payment_id": completion.paymentId,
-            "txid": completion.txid,
-            "amount": payment_data.get("amount", 0),
-            "status": "completed",
-            "completed_at": datetime.now().isoformat(),
-            "pi_data": payment_data
-        }
-        
-        await transactions_collection.update_one(
-            {"payment_id": completion.paymentId},
-            {"$set": transaction_update},
-            upsert=True
+        task = await task_queue.enqueue(
+            COMPLETE_TASK,
+            {"payment_id": completion.paymentId, "txid": completion.txid},
+            dedupe_key=f"{COMPLETE_TASK}:{completion.paymentId}",
         )
-        
-        print(f"✅ Payment completed: {completion.paymentId}")
-        return {
-            "status": "success", 
-            "message": "Payment completed successfully",
-            "txid": completion.txid,
-            "amount": payment_data.get("amount", 0)
-        }
+        return task_response(task)
     
-    except Exception as e:
-        print(f"❌ Error completing payment: {e}")
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error completing payment", extra={"payment_id": completion.paymentId})
         raise HTTPException(status_code=500, detail="Payment completion error")
 
 @app.post("/api/payments/incomplete")
@@ -270,98 +937,621 @@ async def handle_incomplete_payment(payment_data: dict):
         payment_id = payment_data.get("identifier")
         
         # Check if payment exists and is completed
-        existing = await transactions_collection.find_one({"payment_id": payment_id})
+        existing = await payment_store.get(payment_id)
         
-        if existing and existing.get("status") == "completed":
+        if existing and existing.get("status") == COMPLETED:
             return {"action": "ignore", "message": "Payment already completed"}
         
-        # If payment is still pending, try to complete it
+        # If payment is still pending, queue its completion
         if payment_data.get("status") == "pending":
             txid = payment_data.get("transaction", {}).get("txid")
             if txid:
-                completion = PaymentCompletion(paymentId=payment_id, txid=txid)
-                await complete_payment(completion)
-                return {"action": "completed", "message": "Payment completed"}
+                task = await task_queue.enqueue(
+                    COMPLETE_TASK,
+                    {"payment_id": payment_id, "txid": txid},
+                    dedupe_key=f"{COMPLETE_TASK}:{payment_id}",
+                )
+                return {
+                    "action": "completing",
+                    "message": "Payment completion in progress",
+                    "status_url": f"/api/tasks/{task['_id']}",
+                }
         
-        print(f"📋 Handled incomplete payment: {payment_id}")
+        logger.info("Handled incomplete payment", extra={"payment_id": payment_id})
         return {"action": "processed", "message": "Payment processed"}
     
     except Exception as e:
-        print(f"❌ Error handling incomplete payment: {e}")
+        logger.exception("Error handling incomplete payment")
         return {"action": "error", "message": str(e)}
 
-@app.get("/api/jobs", response_model=List[Job])
-async def get_jobs(category: Optional[str] = None, limit: int = 10):
+@app.get("/api/tasks/{task_id}")
+async def get_task(task_id: str):
+    """Get the status of a queued payment task"""
+    try:
+        task = await task_queue.get(task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return {
+            "task_id": task["_id"],
+            "kind": task["kind"],
+            "status": task["status"],
+            "attempts": task["attempts"],
+            "result": task.get("result"),
+            "error": task.get("error"),
+            "created_at": task["created_at"],
+            "updated_at": task["updated_at"],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as for any GET
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def cache_headers(etag: str, max_age: int) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+
+def not_modified(request: Request, headers: Dict[str, str]) -> Optional[Response]:
+    """A 304 when the client's copy still carries the current ETag"""
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return None
+
+def job_fields(fields: Optional[str], view: str) -> Optional[List[str]]:
+    """The Job fields a request selects with ``fields`` and ``view``; None for all of them"""
     try:
-        query = {}
-        if category:
-            query["category"] = category
+        selected = parse_fields(fields, Job)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if selected is None:
+        return CARD_FIELDS if view == "card" else None
+    return selected if "id" in selected else ["id"] + selected
+
+def job_projection(selected: Optional[List[str]]) -> Dict[str, int]:
+    """Projection for the ``selected`` fields plus the feed's sort keys, which cursors need"""
+    if selected is None:
+        return JOB_PROJECTION
+    names = set(selected) | {name for name, _ in JOB_FEED_SORT}
+    if names & EMPLOYER_FIELDS:
+        # Unmigrated jobs carry their own copies
+        names |= EMPLOYER_FIELDS | {"employer_id"}
+    return dict({name: 1 for name in sorted(names)}, _id=0)
+
+def shape_jobs(jobs: List[Dict[str, Any]], selected: Optional[List[str]], view: str) -> List[Dict[str, Any]]:
+    """Jobs trimmed to the ``selected`` fields and, for cards, shortened"""
+    if selected is None:
+        return jobs
+    shaped = select_fields(jobs, selected)
+    if view == "card":
+        for job in shaped:
+            if "description" in job:
+                job["description"] = truncate(job["description"], CARD_DESCRIPTION_CHARS)
+            if job.get("image_url") and image_pipeline.allowed(job["image_url"]):
+                # The resized card image instead of the full-size original's long URL;
+                # images the pipeline won't fetch keep their original URL
+                job["image_url"] = f"/api/images/{job['id']}"
+    return shaped
+
+@app.get("/api/jobs", response_model=JobPage)
+async def get_jobs(
+    request: Request,
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|card)$"),
+):
+    """Get a page of the job feed, newest first"""
+    selected = job_fields(fields, view)
+    try:
+        # Employer ratings are part of every job on the page
+        jobs_version = await live_version()
+        employers_version, = await collection_versions.get("employers")
+        headers = cache_headers(f'W/"{jobs_version}.{employers_version}"', FEED_MAX_AGE)
+        response = not_modified(request, headers)
+        if response is not None:
+            return response
         
-        jobs_cursor = jobs_collection.find(query).limit(limit)
-        jobs = []
-        async for job in jobs_cursor:
-            job["_id"] = str(job["_id"])
-            jobs.append(job)
+        query = live_query(category=category) if category else live_query()
         
-        return jobs
+        async def load_page():
+            jobs, next_cursor = await fetch_page(
+                jobs_collection, query, JOB_FEED_SORT, limit, cursor, job_projection(selected)
+            )
+            return {"jobs": with_defaults(jobs, JOB_DEFAULTS), "next_cursor": next_cursor}
+        
+        if cursor:
+            page = await load_page()
+        else:
+            key = (category, limit, jobs_version, selected and tuple(selected))
+            page = await feed_cache.get_or_load(key, load_page)
+        if selected is None or EMPLOYER_FIELDS.intersection(selected):
+            await employer_directory.attach(page["jobs"])
+        jobs = shape_jobs(page["jobs"], selected, view)
+        return JobsResponse({"jobs": jobs, "next_cursor": page["next_cursor"]}, headers=headers)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Nearest first; `id` breaks ties between jobs at the same distance
+NEARBY_SORT = [("distance_km", 1), ("id", 1)]
+
+@app.get("/api/jobs/nearby", response_model=NearbyJobPage)
+async def get_nearby_jobs(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(25, gt=0, le=1000),
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """Get jobs within radius_km of a point, nearest first"""
+    try:
+        min_distance_km = 0.0
+        after_cursor = apply_cursor({}, cursor, NEARBY_SORT)
+        if cursor:
+            # Start the geo scan at the last page's distance, less 1m of float slack
+            min_distance_km = max(0.0, decode_cursor(cursor, NEARBY_SORT)[0] - 0.001)
+        
+        pipeline = [
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [lon, lat]},
+                "key": "geo",
+                "distanceField": "distance_km",
+                "distanceMultiplier": 0.001,
+                "minDistance": min_distance_km * 1000,
+                "maxDistance": radius_km * 1000,
+                "query": live_query(category=category) if category else live_query(),
+                "spherical": True
+            }},
+            {"$match": after_cursor},
+            {"$sort": dict(NEARBY_SORT)},
+            {"$limit": limit + 1},
+            {"$project": NEARBY_JOB_PROJECTION}
+        ]
+        jobs = await jobs_collection.aggregate(pipeline).to_list(None)
+        
+        jobs, next_cursor = split_page(jobs, limit, NEARBY_SORT)
+        await employer_directory.attach(jobs)
+        return JobsResponse({"jobs": with_defaults(jobs, JOB_DEFAULTS), "next_cursor": next_cursor})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/jobs/search", response_model=SearchJobPage)
+async def search_jobs(
+    q: str = Query(..., min_length=1, max_length=200),
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """Search job titles, descriptions and categories, best match first"""
+    try:
+        pipeline = build_search_pipeline(q, category, limit, cursor, SEARCH_JOB_PROJECTION, live_query())
+        jobs = await jobs_collection.aggregate(pipeline).to_list(None)
+        
+        jobs, next_cursor = split_page(jobs, limit, SEARCH_SORT)
+        await employer_directory.attach(jobs)
+        return JobsResponse({"jobs": with_defaults(jobs, JOB_DEFAULTS), "next_cursor": next_cursor})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/jobs/archive", response_model=ArchivedJobPage)
+async def get_archived_jobs(
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    """Get a page of archived past-deadline jobs, latest deadline first"""
+    try:
+        query = {"category": category} if category else {}
+        jobs, next_cursor = await fetch_page(
+            jobs_archive_collection, query, ARCHIVE_SORT, limit, cursor, ARCHIVED_JOB_PROJECTION
+        )
+        await employer_directory.attach(jobs)
+        return JobsResponse({"jobs": with_defaults(jobs, JOB_DEFAULTS), "next_cursor": next_cursor})
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def find_job(job_id: str) -> Optional[Dict[str, Any]]:
+    async def load_job():
+        job = await jobs_collection.find_one({"id": job_id}, JOB_PROJECTION)
+        if job is None:
+            # Archived jobs stay viewable, e.g. from a user's payment history
+            job = await jobs_archive_collection.find_one({"id": job_id}, JOB_PROJECTION)
+        if job:
+            with_defaults([job], JOB_DEFAULTS)
+        return job
+    
+    return await job_cache.get_or_load(job_id, load_job)
+
 @app.get("/api/jobs/{job_id}", response_model=Job)
-async def get_job(job_id: str):
+async def get_job(
+    job_id: str,
+    request: Request,
+    fields: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|card)$"),
+):
+    selected = job_fields(fields, view)
+    try:
+        # Whole from job_cache, then trimmed: cheaper than a projected read per fieldset
+        job = await find_job(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        await employer_directory.attach([job])
+        response = JobsResponse(shape_jobs([job], selected, view)[0])
+        # Hashed from the body: the job comes from job_cache, so only the bytes are saved
+        digest = hashlib.blake2b(response.body, digest_size=12).hexdigest()
+        headers = cache_headers(f'W/"{digest}"', JOB_MAX_AGE)
+        not_modified_response = not_modified(request, headers)
+        if not_modified_response is not None:
+            return not_modified_response
+        response.headers.update(headers)
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/images/{job_id}")
+async def get_job_image(
+    job_id: str,
+    request: Request,
+    size: str = Query("card", pattern="^(card|thumb)$"),
+    format: Optional[str] = Query(None, pattern="^(webp|jpeg)$"),
+):
+    """Get a job's image resized for its card, as WebP when the client accepts it"""
+    headers = {"Cache-Control": f"public, max-age={IMAGE_MAX_AGE}"}
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+        headers["Vary"] = "Accept"
     try:
-        job = await jobs_collection.find_one({"id": job_id})
+        job = await find_job(job_id)
         if not job:
             raise HTTPException(status_code=404, detail="Job not found")
+        if not job.get("image_url"):
+            raise HTTPException(status_code=404, detail="Job has no image")
         
-        job["_id"] = str(job["_id"])
-        return job
+        etag = await image_pipeline.cached_etag(job["image_url"], size, format)
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=dict(headers, ETag=etag))
+        etag, body = await image_pipeline.get(job["image_url"], size, format)
+        return Response(body, media_type=FORMATS[format], headers=dict(headers, ETag=etag))
+    except ImageError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error serving job image", extra={"job_id": job_id})
+        raise HTTPException(status_code=500, detail="Image error")
+
+@app.get("/api/employers/{employer_id}")
+async def get_employer(employer_id: str):
+    """Get an employer and its rating aggregates"""
+    try:
+        employer = await employer_directory.get(employer_id)
+        if not employer:
+            raise HTTPException(status_code=404, detail="Employer not found")
+        return employer
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/employers/{employer_id}/ratings")
+async def rate_employer(
+    employer_id: str,
+    rating: EmployerRating,
+    session: Optional[Session] = Depends(current_session),
+):
+    """Rate an employer; rating again replaces the user's earlier rating"""
+    user_id = acting_user_id(session, rating.user_id)
+    try:
+        employer = await employer_directory.rate(employer_id, user_id, rating.rating)
+        if not employer:
+            raise HTTPException(status_code=404, detail="Employer not found")
+        await collection_versions.bump("employers")
+        return employer
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error rating employer", extra={"employer_id": employer_id})
+        raise HTTPException(status_code=500, detail="Rating error")
+
+def build_job_document(job: JobCreate, employer_id: str) -> Dict[str, Any]:
+    document = {
+        "id": job.id or str(uuid.uuid4()),
+        "title": job.title,
+        "description": job.description,
+        "payment": job.payment,
+        "location": job.location,
+        "employer_id": employer_id,
+        "category": job.category,
+        "image_url": job.image_url,
+        "status": OPEN,
+        "deadline": job.deadline,
+        "created_at": datetime.now(timezone.utc),
+    }
+    if job.latitude is not None:
+        document["geo"] = {"type": "Point", "coordinates": [job.longitude, job.latitude]}
+    return document
+
+async def prepare_jobs(jobs: List[JobCreate]) -> List[Any]:
+    """Job documents for validated jobs, or why each one cannot be stored"""
+    employer_ids = await employer_directory.ids_for_names(job.employer for job in jobs if not job.employer_id)
+    existing = await employer_directory.existing_ids(job.employer_id for job in jobs if job.employer_id)
+    prepared = []
+    for job in jobs:
+        if job.employer_id and job.employer_id not in existing:
+            prepared.append(f"Unknown employer_id {job.employer_id}")
+        else:
+            prepared.append(build_job_document(job, job.employer_id or employer_ids[job.employer]))
+    return prepared
+
+@app.post("/api/jobs", response_model=Job, status_code=201)
+async def create_job(job: JobCreate):
+    """Post a new job"""
+    try:
+        prepared, = await prepare_jobs([job])
+        if isinstance(prepared, str):
+            raise HTTPException(status_code=400, detail=prepared)
+        await jobs_collection.insert_one(prepared)
+        await bump_jobs_version()
+        await employer_directory.attach([prepared])
+        # Only the public fields; the document also holds _id and status
+        job, = select_fields(with_defaults([prepared], JOB_DEFAULTS), list(Job.model_fields))
+        return JobsResponse(job, status_code=201)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A job with this id already exists")
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Error creating job")
+        raise HTTPException(status_code=500, detail="Job creation error")
+
+@app.post("/api/jobs/import")
+async def import_jobs(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+):
+    """Bulk-create jobs from an NDJSON or CSV upload, reporting rejected rows"""
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    lines = iter_lines(request.stream())
+    rows = csv_rows(lines) if format == "csv" else ndjson_rows(lines)
+    importer = JobImporter(
+        jobs_collection, JobCreate, prepare_jobs, chunk_size=IMPORT_CHUNK_SIZE, max_errors=IMPORT_MAX_ERRORS
+    )
+    try:
+        report = await importer.run(rows)
+    except Exception as e:
+        logger.exception("Job import failed", extra={"inserted": importer.inserted})
+        raise HTTPException(status_code=500, detail=f"Import failed after {importer.inserted} jobs: {e}")
+    finally:
+        if importer.inserted:
+            await bump_jobs_version()
+    logger.info("Jobs imported", extra={"rows": report["rows"], "inserted": report["inserted"], "failed": report["failed"]})
+    return report
+
+def build_swipe_record(swipe_action: SwipeAction, user_id: str) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "job_id": swipe_action.job_id,
+        "user_id": user_id,
+        "action": swipe_action.action,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+async def buffer_swipes(records: List[Dict[str, Any]]):
+    """Queue swipes for the write-behind buffer and hide them from decks"""
+    try:
+        await swipe_buffer.add(records)
+    except SwipeBufferFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many swipes waiting to be stored, retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    for record in records:
+        deck_service.mark_seen(record["user_id"], record["job_id"])
+        ranker.record(record["user_id"], record["job_id"], record["action"])
+
 @app.post("/api/swipe")
-async def record_swipe(swipe_action: SwipeAction):
+async def record_swipe(swipe_action: SwipeAction, session: Optional[Session] = Depends(current_session)):
+    user_id = acting_user_id(session, swipe_action.user_id)
     try:
-        action_record = {
-            "id": str(uuid.uuid4()),
-            "job_id": swipe_action.job_id,
-            "user_id": swipe_action.user_id,
-            "action": swipe_action.action,
-            "timestamp": datetime.now().isoformat()
-        }
+        action_record = build_swipe_record(swipe_action, user_id)
+        await buffer_swipes([action_record])
         
-        print(f"📱 Wolk swipe recorded: {swipe_action.action} for job {swipe_action.job_id}")
+        logger.info("Swipe recorded", extra={"action": swipe_action.action, "job_id": swipe_action.job_id})
         
         if swipe_action.action == "accept":
             return {"message": "Job accepted! Ready to initiate Pi payment.", "match": True, "requires_payment": True}
         else:
             return {"message": "Job rejected", "match": False, "requires_payment": False}
             
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/swipe/batch")
+async def record_swipe_batch(
+    swipe_actions: List[SwipeAction],
+    session: Optional[Session] = Depends(current_session),
+):
+    """Record several swipes in one request"""
+    if len(swipe_actions) > MAX_SWIPE_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_SWIPE_BATCH} swipes per batch")
+    records = [
+        build_swipe_record(swipe_action, acting_user_id(session, swipe_action.user_id))
+        for swipe_action in swipe_actions
+    ]
+    try:
+        await buffer_swipes(records)
+        
+        results = [
+            {
+                "job_id": swipe_action.job_id,
+                "match": swipe_action.action == "accept",
+                "requires_payment": swipe_action.action == "accept"
+            }
+            for swipe_action in swipe_actions
+        ]
+        return {"recorded": len(results), "results": results}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/deck", response_model=Deck)
+async def get_deck(
+    user_id: Optional[str] = None,
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    session: Optional[Session] = Depends(current_session),
+):
+    """Get the user's best-ranked jobs they have not swiped yet"""
+    user_id = acting_user_id(session, user_id)
+    try:
+        if ranker.ready:
+            jobs = await ranker.next_jobs(user_id, limit, category)
+        else:
+            # Unranked, newest first, until the ranking index has loaded
+            jobs = await deck_service.next_jobs(user_id, limit, category)
+        await employer_directory.attach(jobs)
+        return JobsResponse({"jobs": with_defaults(jobs, JOB_DEFAULTS)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/events")
+async def stream_events(
+    category: Optional[List[str]] = Query(None),
+    user_id: Optional[str] = None,
+    token: Optional[str] = None,
+    session: Optional[Session] = Depends(current_session),
+):
+    """Server-sent events for new and changed jobs, and the user's matches and payments"""
+    if token is not None and session is None:
+        # EventSource cannot send headers, so browsers pass the session token here
+        session = await current_session(f"Bearer {token}")
+    if user_id is not None or session is not None:
+        user_id = acting_user_id(session, user_id)
+    if event_broker.full:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many open event streams, retry shortly",
+            headers={"Retry-After": "5"}
+        )
+    return StreamingResponse(
+        event_broker.stream(category, user_id, EVENTS_HEARTBEAT),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/categories")
-async def get_categories():
+async def get_categories(request: Request):
     try:
-        categories = await jobs_collection.distinct("category")
-        return {"categories": categories}
+        jobs_version = await live_version()
+        headers = cache_headers(f'W/"{jobs_version}"', CATEGORIES_MAX_AGE)
+        response = not_modified(request, headers)
+        if response is not None:
+            return response
+        categories = await categories_cache.get_or_load(
+            ("categories", jobs_version), lambda: jobs_collection.distinct("category", live_query())
+        )
+        return JSONResponse({"categories": categories}, headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/stats")
+async def get_stats(
+    user_id: Optional[str] = None,
+    category: Optional[str] = None,
+    days: int = Query(30, ge=1, le=366),
+    until: Optional[date] = None,
+    session: Optional[Session] = Depends(current_session),
+):
+    """Daily completed payments, Pi volume and swipe acceptance for a user, a category or everyone"""
+    if user_id is not None and category is not None:
+        raise HTTPException(status_code=400, detail="Stats are per user or per category, not both")
+    if user_id is not None:
+        scope, key = USER, acting_user_id(session, user_id)
+    elif category:
+        scope, key = CATEGORY, category
+    else:
+        scope, key = ALL, ""
+    last = until or utcnow().date()
+    first = last - timedelta(days=days - 1)
+    try:
+        daily = await stats_rollups.daily(scope, key, first, last)
+        return {
+            "scope": scope,
+            "key": key or None,
+            "from": first.isoformat(),
+            "to": last.isoformat(),
+            "totals": summarize(daily),
+            "days": daily,
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/transactions")
-async def get_transactions(limit: int = 50):
-    """Get transaction history"""
+async def get_transactions(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    """Get a page of transaction history, newest first"""
     try:
-        transactions_cursor = transactions_collection.find().limit(limit).sort("created_at", -1)
-        transactions = []
-        async for tx in transactions_cursor:
+        query = {"status": status} if status else {}
+        transactions, next_cursor = await fetch_page(
+            transactions_collection, query, TRANSACTION_SORT, limit, cursor
+        )
+        for tx in transactions:
             tx["_id"] = str(tx["_id"])
-            transactions.append(tx)
         
-        return {"transactions": transactions}
+        return {"transactions": transactions, "next_cursor": next_cursor}
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/transactions/export")
+async def export_transactions(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    status: Optional[str] = None,
+):
+    """Stream the full transaction history as NDJSON or CSV"""
+    query = {"status": status} if status else {}
+    transactions_cursor = transactions_collection.find(query).sort(TRANSACTION_SORT).batch_size(1000)
+    
+    if format == "csv":
+        body = csv_stream(transactions_cursor, TRANSACTION_EXPORT_COLUMNS)
+        media_type = "text/csv"
+    else:
+        body = ndjson_stream(transactions_cursor)
+        media_type = "application/x-ndjson"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
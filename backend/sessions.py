@@ -0,0 +1,175 @@
+"""Signed session tokens.
+
+A Pi login is exchanged for a short-lived HS256 JWT naming the user
+(``sub``) and the session (``jti``). Requests present it as a bearer token
+and ``SessionManager.verify`` checks it with nothing but the signing key,
+so authenticating a request never touches MongoDB. Verified tokens are also
+remembered in a small LRU, as a client sends the same token with every
+request and checking its signature costs far more than a lookup.
+
+Logging out revokes the session. ``RevocationCache`` keeps revoked session
+IDs in memory until their tokens would have expired anyway, and follows the
+``revoked_sessions`` collection in the background so revocations made by
+other processes take effect within ``poll_interval`` seconds.
+"""
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+import jwt
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger("wolk.sessions")
+
+ALGORITHM = "HS256"
+ISSUER = "wolk"
+
+
+class InvalidSession(Exception):
+    """Raised for tokens that are malformed, expired, forged or revoked"""
+
+
+@dataclass(frozen=True)
+class Session:
+    user_id: str
+    username: str
+    session_id: str
+    expires_at: datetime
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class RevocationCache:
+    def __init__(self, collection, poll_interval: float = 5.0):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self._revoked: Dict[str, datetime] = {}
+        self._seen_until: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index("revoked_at")
+
+    def is_revoked(self, session_id: str) -> bool:
+        return session_id in self._revoked
+
+    async def revoke(self, session: Session):
+        now = utcnow()
+        self._revoked[session.session_id] = session.expires_at
+        try:
+            await self.collection.insert_one({
+                "_id": session.session_id,
+                "user_id": session.user_id,
+                "revoked_at": now,
+                # Removed once the token could no longer be used anyway
+                "expires_at": session.expires_at,
+            })
+        except DuplicateKeyError:
+            pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except PyMongoError as e:
+                logger.warning("Refreshing session revocations failed", extra={"error": str(e)})
+            await asyncio.sleep(self.poll_interval)
+
+    async def refresh(self):
+        """Load revocations made since the last refresh and forget expired ones"""
+        now = utcnow()
+        # Overlap the previous window a little so slow writes are not missed
+        query = {"expires_at": {"$gt": now}}
+        if self._seen_until is not None:
+            query["revoked_at"] = {"$gte": self._seen_until - timedelta(seconds=self.poll_interval)}
+        async for revocation in self.collection.find(query, {"expires_at": 1}):
+            expires_at = revocation["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._revoked[revocation["_id"]] = expires_at
+        self._seen_until = now
+        for session_id in [s for s, expires_at in self._revoked.items() if expires_at <= now]:
+            del self._revoked[session_id]
+
+
+class SessionManager:
+    def __init__(self, secret: str, ttl: float = 3600.0, revocations: Optional[RevocationCache] = None,
+                 leeway: float = 10.0, cache_size: int = 10000):
+        self.secret = secret
+        self.ttl = ttl
+        self.revocations = revocations
+        self.leeway = leeway
+        self.cache_size = cache_size
+        self._verified: "OrderedDict[str, Session]" = OrderedDict()
+
+    def issue(self, user_id: str, username: str) -> Tuple[str, Session]:
+        now = utcnow()
+        session = Session(user_id, username, uuid.uuid4().hex, now + timedelta(seconds=self.ttl))
+        claims = {
+            "iss": ISSUER,
+            "sub": user_id,
+            "name": username,
+            "jti": session.session_id,
+            "iat": now,
+            "exp": session.expires_at,
+        }
+        return jwt.encode(claims, self.secret, algorithm=ALGORITHM), session
+
+    def verify(self, token: str) -> Session:
+        session = self._verified.get(token)
+        if session is None:
+            session = self._decode(token)
+            if self.cache_size > 0:
+                self._verified[token] = session
+                if len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+        else:
+            self._verified.move_to_end(token)
+            if session.expires_at + timedelta(seconds=self.leeway) <= utcnow():
+                del self._verified[token]
+                raise InvalidSession("Session expired")
+        if self.revocations is not None and self.revocations.is_revoked(session.session_id):
+            raise InvalidSession("Session revoked")
+        return session
+
+    def _decode(self, token: str) -> Session:
+        try:
+            claims = jwt.decode(
+                token,
+                self.secret,
+                algorithms=[ALGORITHM],
+                issuer=ISSUER,
+                leeway=self.leeway,
+                options={"require": ["exp", "iat", "sub", "jti"]},
+            )
+        except jwt.ExpiredSignatureError:
+            raise InvalidSession("Session expired")
+        except jwt.InvalidTokenError:
+            raise InvalidSession("Invalid session token")
+        return Session(
+            claims["sub"], claims.get("name", ""), claims["jti"],
+            datetime.fromtimestamp(claims["exp"], timezone.utc),
+        )
@@ -0,0 +1,164 @@
+"""Write-behind buffer for swipe records.
+
+Swipes from every request are coalesced in memory and written to MongoDB
+with unordered ``insert_many`` calls, either once ``batch_size`` swipes are
+pending or every ``flush_interval`` seconds, whichever comes first. Write
+cost therefore scales with the number of batches, not the number of HTTP
+requests.
+
+The ``swipes`` collection has a unique ``(user_id, job_id)`` index, so
+inserts are idempotent: duplicate-key errors mean the swipe is already
+stored and are dropped, and any other failed write is simply retried.
+"""
+import asyncio
+import logging
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger("wolk.swipes")
+
+DUPLICATE_KEY_ERROR = 11000
+
+SwipeKey = Tuple[str, str]
+
+
+class SwipeBufferFull(Exception):
+    """Raised when the buffer stays full for longer than the put timeout"""
+
+
+class SwipeWriteBuffer:
+    """Coalesces swipes and flushes them to MongoDB in the background"""
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = 500,
+        flush_interval: float = 0.25,
+        max_pending: int = 10000,
+        put_timeout: float = 2.0,
+        retry_interval: float = 1.0,
+        on_written: Optional[Callable[[List[Dict[str, Any]]], Awaitable]] = None,
+    ):
+        self.collection = collection
+        # Called with each batch of newly stored swipes, e.g. to update rollups
+        self.on_written = on_written
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.retry_interval = retry_interval
+        # Latest swipe per (user_id, job_id) waiting to be written
+        self._pending: Dict[SwipeKey, Dict[str, Any]] = {}
+        # Swipes handed to insert_many but not yet acknowledged
+        self._inflight: Dict[SwipeKey, Dict[str, Any]] = {}
+        self._changed = asyncio.Condition()
+        self._task = None
+        self._closing = False
+        self.flushed = 0
+        self.batches = 0
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._inflight)
+
+    def pending_job_ids(self, user_id: str) -> List[str]:
+        """Job IDs the user has swiped that are not in MongoDB yet"""
+        return [
+            job_id
+            for store in (self._pending, self._inflight)
+            for (pending_user, job_id) in store
+            if pending_user == user_id
+        ]
+
+    async def add(self, records: Iterable[Dict[str, Any]]):
+        """Queue swipe records, waiting for room while the buffer is full"""
+        records = list(records)
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: len(self) + len(records) <= self.max_pending),
+                    self.put_timeout,
+                )
+            except asyncio.TimeoutError:
+                raise SwipeBufferFull(f"{len(self)} swipes waiting to be written")
+            for record in records:
+                self._pending[(record["user_id"], record["job_id"])] = record
+            if len(self._pending) >= self.batch_size:
+                self._changed.notify_all()
+
+    async def _run(self):
+        while not self._closing:
+            # Full batches go out immediately, partial ones once the timer fires
+            min_batch = self.batch_size
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(
+                            lambda: self._closing or len(self._pending) >= self.batch_size
+                        ),
+                        self.flush_interval,
+                    )
+                except asyncio.TimeoutError:
+                    min_batch = 1
+            if not await self.flush(min_batch):
+                await asyncio.sleep(self.retry_interval)
+
+    async def _write(self, batch: List[Tuple[SwipeKey, Dict[str, Any]]]) -> Tuple[List, List]:
+        """Insert a batch; returns the entries newly stored and those that must be retried"""
+        try:
+            await self.collection.insert_many([dict(record) for _, record in batch], ordered=False)
+        except BulkWriteError as e:
+            errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            stored = [entry for i, entry in enumerate(batch) if i not in errors]
+            return stored, [
+                batch[i] for i, error in errors.items() if error.get("code") != DUPLICATE_KEY_ERROR
+            ]
+        except Exception as e:
+            logger.error("Error writing swipes, will retry", extra={"swipes": len(batch), "error": str(e)})
+            return [], batch
+        return batch, []
+
+    async def flush(self, min_batch: int = 1) -> bool:
+        """Write pending swipes in batches while at least ``min_batch`` wait.
+
+        Returns False if some writes failed and were put back.
+        """
+        ok = True
+        while self._pending and len(self._pending) >= min_batch:
+            keys = list(islice(self._pending, self.batch_size))
+            batch = [(key, self._pending.pop(key)) for key in keys]
+            self._inflight.update(batch)
+
+            stored, failed = await self._write(batch)
+
+            for key, _ in batch:
+                self._inflight.pop(key, None)
+            for key, record in failed:
+                # A newer swipe for the same job may have arrived meanwhile
+                self._pending.setdefault(key, record)
+            self.flushed += len(batch) - len(failed)
+            self.batches += 1
+            async with self._changed:
+                self._changed.notify_all()
+            if stored and self.on_written is not None:
+                await self.on_written([record for _, record in stored])
+            if failed:
+                ok = False
+                break
+        return ok
+
+    async def close(self):
+        """Stop the background flusher and write out everything pending"""
+        self._closing = True
+        if self._task is not None:
+            async with self._changed:
+                self._changed.notify_all()
+            await self._task
+            self._task = None
+        await self.flush()
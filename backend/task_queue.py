@@ -0,0 +1,292 @@
+"""Durable MongoDB-backed task queue.
+
+Each task is a document in the ``tasks`` collection. A worker claims one
+with a single ``find_one_and_update`` that marks it ``running`` and pushes
+``visible_at`` one lease into the future; no other worker can claim it until
+that lease runs out. Workers renew the lease while a handler runs and mark
+the task ``done`` or ``failed`` when it returns.
+
+A worker that crashes never renews its lease, so the task becomes claimable
+again once the lease expires. Tasks are therefore delivered at least once,
+and handlers must be idempotent. Every claim bumps ``attempts``, and
+completions are fenced on it so a worker whose lease was taken over cannot
+overwrite the newer attempt's outcome.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from metrics import TASK_DURATION, TASKS_PROCESSED
+
+logger = logging.getLogger("wolk.tasks")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class TaskRejected(Exception):
+    """Raised by a handler to fail its task without retrying"""
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class TaskQueue:
+    """Enqueue, claim and settle tasks in one MongoDB collection"""
+
+    def __init__(
+        self,
+        collection,
+        lease: float = 30.0,
+        max_attempts: int = 5,
+        retention: float = 7 * 24 * 3600.0,
+    ):
+        self.collection = collection
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retention = retention
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", 1), ("visible_at", 1)])
+        await self.collection.create_index("dedupe_key", unique=True, sparse=True)
+        # Finished tasks are removed by MongoDB once expires_at passes
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> Dict[str, Any]:
+        """Add a task, or return the existing one with the same ``dedupe_key``.
+
+        A deduplicated task that already gave up is queued again.
+        """
+        now = utcnow()
+        task = {
+            "_id": str(uuid.uuid4()),
+            "kind": kind,
+            "payload": payload,
+            "status": QUEUED,
+            "attempts": 0,
+            "visible_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if dedupe_key:
+            task["dedupe_key"] = dedupe_key
+        try:
+            await self.collection.insert_one(task)
+            return task
+        except DuplicateKeyError:
+            retried = await self.collection.find_one_and_update(
+                {"dedupe_key": dedupe_key, "status": FAILED},
+                {
+                    "$set": {"status": QUEUED, "attempts": 0, "visible_at": now, "updated_at": now},
+                    "$unset": {"error": "", "expires_at": ""},
+                },
+                return_document=ReturnDocument.AFTER,
+            )
+            return retried or await self.collection.find_one({"dedupe_key": dedupe_key})
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return await self.collection.find_one({"_id": task_id})
+
+    async def claim(self, worker_id: str, kinds: Iterable[str]) -> Optional[Dict[str, Any]]:
+        """Lease the oldest visible task, including ones whose lease expired"""
+        now = utcnow()
+        return await self.collection.find_one_and_update(
+            {"status": {"$in": [QUEUED, RUNNING]}, "visible_at": {"$lte": now}, "kind": {"$in": list(kinds)}},
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "worker": worker_id,
+                    "visible_at": now + timedelta(seconds=self.lease),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("visible_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _owned(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        return {"_id": task["_id"], "status": RUNNING, "attempts": task["attempts"]}
+
+    async def renew(self, task: Dict[str, Any]) -> bool:
+        """Extend the lease; False if another worker has taken the task over"""
+        now = utcnow()
+        result = await self.collection.update_one(
+            self._owned(task),
+            {"$set": {"visible_at": now + timedelta(seconds=self.lease), "updated_at": now}},
+        )
+        return result.modified_count == 1
+
+    async def complete(self, task: Dict[str, Any], result: Optional[Dict[str, Any]] = None) -> bool:
+        return await self._finish(task, DONE, {"result": result, "error": None})
+
+    async def fail(self, task: Dict[str, Any], error: str) -> bool:
+        return await self._finish(task, FAILED, {"error": error})
+
+    async def retry(self, task: Dict[str, Any], error: str, delay: float) -> bool:
+        """Hide the task for ``delay`` seconds, or fail it after ``max_attempts``"""
+        if task["attempts"] >= self.max_attempts:
+            return await self.fail(task, error)
+        now = utcnow()
+        result = await self.collection.update_one(
+            self._owned(task),
+            {"$set": {
+                "status": QUEUED,
+                "error": error,
+                "visible_at": now + timedelta(seconds=delay),
+                "updated_at": now,
+            }},
+        )
+        return result.modified_count == 1
+
+    async def _finish(self, task: Dict[str, Any], status: str, fields: Dict[str, Any]) -> bool:
+        now = utcnow()
+        result = await self.collection.update_one(
+            self._owned(task),
+            {"$set": dict(
+                fields,
+                status=status,
+                finished_at=now,
+                updated_at=now,
+                expires_at=now + timedelta(seconds=self.retention),
+            )},
+        )
+        return result.modified_count == 1
+
+
+class TaskWorker:
+    """Runs ``concurrency`` consumer loops claiming tasks from a ``TaskQueue``.
+
+    ``handlers`` maps a task kind to ``async handler(payload) -> result``. A
+    handler raising ``TaskRejected`` fails its task for good; any other
+    exception retries it with exponential backoff. Consumers back off to
+    ``max_poll_interval`` while the queue is empty.
+    """
+
+    def __init__(
+        self,
+        queue: TaskQueue,
+        handlers: Dict[str, Handler],
+        concurrency: int = 10,
+        poll_interval: float = 0.1,
+        max_poll_interval: float = 2.0,
+        retry_base: float = 1.0,
+        retry_max: float = 60.0,
+        drain_timeout: float = 10.0,
+        worker_id: Optional[str] = None,
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.drain_timeout = drain_timeout
+        self._worker_id = worker_id
+        self._stopping = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def worker_id(self) -> str:
+        # Read at claim time so a worker forked after construction uses its own pid
+        return self._worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        if not self._tasks:
+            self._stopping.clear()
+            self._tasks = [asyncio.ensure_future(self._consume()) for _ in range(self.concurrency)]
+
+    async def close(self):
+        """Stop claiming, give in-flight tasks ``drain_timeout`` to finish"""
+        if not self._tasks:
+            return
+        self._stopping.set()
+        _, pending = await asyncio.wait(self._tasks, timeout=self.drain_timeout)
+        for task in pending:
+            # Their leases expire and another worker picks the tasks up
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _consume(self):
+        idle = self.poll_interval
+        while not self._stopping.is_set():
+            try:
+                task = await self.queue.claim(self.worker_id, self.handlers)
+            except PyMongoError as e:
+                logger.error("Task claim failed", extra={"error": str(e)})
+                task = None
+            if task is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), idle)
+                except asyncio.TimeoutError:
+                    pass
+                idle = min(self.max_poll_interval, idle * 2)
+                continue
+            idle = self.poll_interval
+            await self._process(task)
+
+    async def _heartbeat(self, task: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.queue.lease / 3)
+            try:
+                if not await self.queue.renew(task):
+                    logger.warning("Task lease lost", extra={"task_id": task["_id"], "kind": task["kind"]})
+                    return
+            except PyMongoError as e:
+                logger.error("Task lease renewal failed", extra={"task_id": task["_id"], "error": str(e)})
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _process(self, task: Dict[str, Any]):
+        kind = task["kind"]
+        if task["attempts"] > self.queue.max_attempts:
+            # Every earlier attempt lost its lease, e.g. the task keeps crashing workers
+            await self.queue.fail(task, "lease expired on every attempt")
+            TASKS_PROCESSED.inc(kind=kind, outcome="abandoned")
+            return
+        heartbeat = asyncio.ensure_future(self._heartbeat(task))
+        start = time.perf_counter()
+        try:
+            result = await self.handlers[kind](task.get("payload") or {})
+        except TaskRejected as e:
+            outcome = "rejected"
+            settle = self.queue.fail(task, str(e))
+        except Exception as e:
+            outcome = "retried"
+            logger.warning(
+                "Task attempt failed",
+                extra={"task_id": task["_id"], "kind": kind, "attempts": task["attempts"], "error": str(e)},
+            )
+            settle = self.queue.retry(task, str(e), self._backoff(task["attempts"]))
+        else:
+            outcome = "done"
+            settle = self.queue.complete(task, result)
+        finally:
+            heartbeat.cancel()
+            TASK_DURATION.observe(time.perf_counter() - start, kind=kind)
+
+        try:
+            await settle
+        except PyMongoError as e:
+            # The lease runs out and the task is retried
+            logger.error("Task settle failed", extra={"task_id": task["_id"], "kind": kind, "error": str(e)})
+            outcome = "unsettled"
+        TASKS_PROCESSED.inc(kind=kind, outcome=outcome)
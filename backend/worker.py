@@ -0,0 +1,71 @@
+"""Payment task worker.
+
+Claims approval and completion tasks queued by the API and runs them against
+the Pi API with ``--concurrency`` tasks in flight. Workers share nothing but
+the ``tasks`` collection, so throughput scales by starting more of them, on
+one machine or several:
+
+    python worker.py --concurrency 20
+
+SIGINT/SIGTERM stop claiming and let in-flight tasks finish. A worker that
+dies instead leaves its tasks leased; they are retried once the lease
+(``TASK_LEASE`` seconds) runs out.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from database import Mongo
+from logging_config import configure_logging, shutdown_logging
+from metrics import MongoCommandMetrics
+from payments import PaymentService, PaymentStore, payment_task_handlers
+from pi_client import PiClient
+from rollups import StatsRollups
+from task_queue import TaskQueue, TaskWorker
+
+logger = logging.getLogger("wolk.worker")
+
+
+async def main(args):
+    configure_logging()
+    mongo = Mongo(event_listeners=[MongoCommandMetrics()])
+    pi_client = PiClient(os.environ.get('PI_API_KEY'))
+    queue = TaskQueue(
+        mongo.collection("tasks"),
+        lease=float(os.environ.get('TASK_LEASE', '30')),
+        max_attempts=int(os.environ.get('TASK_MAX_ATTEMPTS', '8')),
+    )
+    rollups = StatsRollups(mongo.collection("stats_daily"), mongo.collection("jobs"), mongo.collection("jobs_archive"))
+    store = PaymentStore(mongo.collection("transactions"), on_completed=rollups.record_payment)
+    worker = TaskWorker(
+        queue,
+        payment_task_handlers(PaymentService(store, pi_client)),
+        concurrency=args.concurrency,
+        drain_timeout=args.drain_timeout,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await queue.ensure_indexes()
+    worker.start()
+    logger.info("Worker started", extra={"worker_id": worker.worker_id, "concurrency": args.concurrency})
+    try:
+        await stop.wait()
+    finally:
+        await worker.close()
+        await pi_client.aclose()
+        mongo.close()
+        logger.info("Worker stopped", extra={"worker_id": worker.worker_id})
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get('TASK_CONCURRENCY', '20')))
+    parser.add_argument("--drain-timeout", type=float, default=10.0, help="Seconds to let in-flight tasks finish on shutdown")
+    asyncio.run(main(parser.parse_args()))
@@ -75,14 +75,42 @@ class WolkAPITester:
             "api/jobs",
             200
         )
-        if success and isinstance(response, list):
-            self.job_ids = [job.get('id') for job in response if job.get('id')]
+        if success and isinstance(response, dict) and 'jobs' in response:
+            jobs = response['jobs']
+            self.job_ids = [job.get('id') for job in jobs if job.get('id')]
             print(f"   Found {len(self.job_ids)} jobs with IDs")
-            if len(response) > 0:
-                sample_job = response[0]
+            print(f"   Next cursor: {response.get('next_cursor') or 'none (last page)'}")
+            if len(jobs) > 0:
+                sample_job = jobs[0]
                 print(f"   Sample job: {sample_job.get('title', 'N/A')} - {sample_job.get('payment', 'N/A')} Pi Coin")
         return success
 
+    def test_get_jobs_next_page(self):
+        """Test following the job feed cursor"""
+        success, response = self.run_test(
+            "Get Jobs First Page",
+            "GET",
+            "api/jobs",
+            200,
+            params={"limit": 2}
+        )
+        if not success or not response.get('next_cursor'):
+            return success
+        
+        first_ids = {job.get('id') for job in response['jobs']}
+        success, response = self.run_test(
+            "Get Jobs Next Page",
+            "GET",
+            "api/jobs",
+            200,
+            params={"limit": 2, "cursor": response['next_cursor']}
+        )
+        if success and isinstance(response, dict):
+            overlap = first_ids & {job.get('id') for job in response['jobs']}
+            print(f"   Next page jobs: {len(response['jobs'])}, overlap with first page: {len(overlap)}")
+            return not overlap
+        return success
+
     def test_get_jobs_with_category(self):
         """Test getting jobs with category filter"""
         success, response = self.run_test(
@@ -92,8 +120,8 @@ class WolkAPITester:
             200,
             params={"category": "Technology"}
         )
-        if success and isinstance(response, list):
-            tech_jobs = [job for job in response if job.get('category') == 'Technology']
+        if success and isinstance(response, dict) and 'jobs' in response:
+            tech_jobs = [job for job in response['jobs'] if job.get('category') == 'Technology']
             print(f"   Found {len(tech_jobs)} Technology jobs")
         return success
 
@@ -153,11 +181,12 @@ class WolkAPITester:
             "action": "accept"
         }
         
+        # Swipes need a session from a verified Pi login, which test data can't get
         success, response = self.run_test(
-            "Swipe Accept",
+            "Swipe Accept Without Session",
             "POST",
             "api/swipe",
-            200,
+            401,
             data=swipe_data
         )
         if success and isinstance(response, dict):
@@ -180,10 +209,10 @@ class WolkAPITester:
         }
         
         success, response = self.run_test(
-            "Swipe Reject",
+            "Swipe Reject Without Session",
             "POST",
             "api/swipe",
-            200,
+            401,
             data=swipe_data
         )
         if success and isinstance(response, dict):
@@ -199,11 +228,12 @@ class WolkAPITester:
             "access_token": "test_access_token_123"
         }
         
+        # The access token is checked with the Pi API, which rejects test data
         success, response = self.run_test(
             "Pi User Authentication",
             "POST",
             "api/pi/auth",
-            200,
+            401,
             data=test_user
         )
         if success and isinstance(response, dict):
@@ -224,9 +254,11 @@ class WolkAPITester:
             "Payment Approval",
             "POST",
             "api/payments/approve",
-            400,  # Expecting 400 since it's test data
+            202,  # Queued; the worker's attempt fails since it's test data
             data=approval_data
         )
+        if success and isinstance(response, dict):
+            print(f"   Status URL: {response.get('status_url', 'N/A')}")
         print("   Note: Expected to fail with test data - testing endpoint accessibility")
         return True  # Consider this a pass since we're testing endpoint structure
 
@@ -243,9 +275,11 @@ class WolkAPITester:
             "Payment Completion",
             "POST",
             "api/payments/complete",
-            400,  # Expecting 400 since it's test data
+            202,  # Queued; the worker's attempt fails since it's test data
             data=completion_data
         )
+        if success and isinstance(response, dict):
+            print(f"   Status URL: {response.get('status_url', 'N/A')}")
         print("   Note: Expected to fail with test data - testing endpoint accessibility")
         return True  # Consider this a pass since we're testing endpoint structure
 
@@ -304,6 +338,7 @@ def main():
     print("\n📋 JOB MANAGEMENT TESTS")
     print("-" * 30)
     test_results.append(tester.test_get_jobs_with_category())
+    test_results.append(tester.test_get_jobs_next_page())
     test_results.append(tester.test_get_single_job())
     test_results.append(tester.test_get_nonexistent_job())
     
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from employers import EmployerDirectory
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_creates_of_a_new_name_share_one_employer(db):
+    # Separate processes: neither name cache knows the other's employers
+    first = EmployerDirectory(db.employers, db.employer_ratings)
+    second = EmployerDirectory(db.employers, db.employer_ratings)
+    await first.ensure_indexes()
+
+    a, b = await asyncio.gather(first.ids_for_names(["Acme", "Birch"]), second.ids_for_names(["Acme"]))
+
+    assert a["Acme"] == b["Acme"]
+    assert await db.employers.count_documents({"name": "Acme"}) == 1
+    employer = await db.employers.find_one({"name": "Birch"})
+    assert employer["id"] == a["Birch"]
+    assert employer["rating_count"] == 0
+
+
+async def test_existing_names_keep_their_employer(db):
+    directory = EmployerDirectory(db.employers, db.employer_ratings)
+    await directory.ensure_indexes()
+    employer = await directory.create("Acme", 4.0)
+
+    assert await directory.ids_for_names(["Acme"]) == {"Acme": employer["id"]}
+    assert await db.employers.count_documents({}) == 1
+
+
+async def test_non_unique_name_index_is_replaced(db):
+    await db.employers.create_index("name")
+    await EmployerDirectory(db.employers, db.employer_ratings).ensure_indexes()
+    assert (await db.employers.index_information())["name_1"].get("unique")
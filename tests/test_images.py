@@ -0,0 +1,129 @@
+import io
+import os
+import threading
+
+import httpx
+import pytest
+from PIL import Image
+
+import images
+from images import DiskCache, ImageError, ImagePipeline
+
+pytestmark = pytest.mark.anyio
+
+HOST = "images.example.test"
+URL = f"https://{HOST}/photo.jpg"
+
+
+@pytest.fixture
+def photo():
+    output = io.BytesIO()
+    Image.new("RGB", (320, 240), (200, 80, 40)).save(output, "JPEG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def fetched():
+    return []
+
+
+@pytest.fixture
+async def pipeline(tmp_path, photo, fetched):
+    def handler(request):
+        fetched.append(str(request.url))
+        if request.url.path != "/photo.jpg":
+            return httpx.Response(404)
+        return httpx.Response(200, content=photo, headers={"Content-Type": "image/jpeg"})
+
+    pipeline = ImagePipeline(
+        DiskCache(str(tmp_path), 1024 * 1024), allowed_hosts=[HOST], workers=1, transport=httpx.MockTransport(handler)
+    )
+    yield pipeline
+    await pipeline.close()
+
+
+async def test_first_request_renders_and_later_ones_hit_the_cache(pipeline, fetched):
+    assert await pipeline.cached_etag(URL, "thumb", "webp") is None
+
+    etag, body = await pipeline.get(URL, "thumb", "webp")
+    assert Image.open(io.BytesIO(body)).size == (150, 200)
+    assert await pipeline.cached_etag(URL, "thumb", "webp") == etag
+
+    assert await pipeline.get(URL, "thumb", "webp") == (etag, body)
+    # Another variant of the same source resizes the original already on disk
+    _, jpeg = await pipeline.get(URL, "thumb", "jpeg")
+    assert Image.open(io.BytesIO(jpeg)).format == "JPEG"
+    assert pipeline.renders == 2
+    assert fetched == [URL]
+
+
+async def test_cache_survives_a_restart(tmp_path, pipeline):
+    etag, body = await pipeline.get(URL, "thumb", "jpeg")
+
+    restarted = ImagePipeline(DiskCache(str(tmp_path), 1024 * 1024), allowed_hosts=[HOST])
+    restarted.start()
+    await restarted._loading
+    assert len(restarted.cache) == 3
+    assert await restarted.cached_etag(URL, "thumb", "jpeg") == etag
+    assert await restarted.get(URL, "thumb", "jpeg") == (etag, body)
+    assert restarted.renders == 0
+    await restarted.close()
+
+
+async def test_cache_file_io_runs_off_the_event_loop(pipeline, monkeypatch):
+    threads = []
+
+    def recorded(function):
+        def recording(*args):
+            threads.append(threading.current_thread())
+            return function(*args)
+        return recording
+
+    for name in ("_read_file", "_write_file", "_remove_files"):
+        monkeypatch.setattr(DiskCache, name, staticmethod(recorded(getattr(DiskCache, name))))
+    monkeypatch.setattr(images.os.path, "exists", recorded(os.path.exists))
+
+    await pipeline.get(URL, "thumb", "webp")
+    await pipeline.cached_etag(URL, "thumb", "webp")
+    assert threads
+    assert threading.main_thread() not in threads
+
+
+async def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=25)
+    await cache.write("aa1", b"a" * 10)
+    await cache.write("bb2", b"b" * 10)
+    assert await cache.read("aa1") == b"a" * 10
+
+    await cache.write("cc3", b"c" * 10)
+    assert await cache.read("bb2") is None
+    assert not os.path.exists(cache.path("bb2"))
+    assert await cache.read("aa1") == b"a" * 10
+    assert cache.size == 20
+
+
+async def test_urls_off_the_allowed_hosts_are_not_fetched(pipeline, fetched):
+    assert not pipeline.allowed(f"http://{HOST}/photo.jpg")
+    assert not pipeline.allowed("https://elsewhere.test/photo.jpg")
+    with pytest.raises(ImageError) as raised:
+        await pipeline.get("https://elsewhere.test/photo.jpg", "thumb", "webp")
+    assert raised.value.status_code == 404
+    assert fetched == []
+
+
+def test_card_view_keeps_image_urls_the_pipeline_cannot_fetch(monkeypatch):
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import server
+
+    monkeypatch.setattr(server.image_pipeline, "allowed_hosts", frozenset([HOST]))
+    jobs = [
+        {"id": "fetched", "image_url": URL},
+        {"id": "plain-http", "image_url": f"http://{HOST}/photo.jpg"},
+        {"id": "elsewhere", "image_url": "https://elsewhere.test/photo.jpg"},
+    ]
+    cards = server.shape_jobs(jobs, ["id", "image_url"], "card")
+    assert [card["image_url"] for card in cards] == [
+        "/api/images/fetched",
+        f"http://{HOST}/photo.jpg",
+        "https://elsewhere.test/photo.jpg",
+    ]
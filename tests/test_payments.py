@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from payments import APPROVED, COMPLETED, FAILED, PaymentRejected, PaymentService, PaymentStore
+from pi_client import PiAPIError
+
+pytestmark = pytest.mark.anyio
+
+
+class FakePiClient:
+    """Pi API stand-in answering with one payment's data"""
+
+    def __init__(self, payment_data):
+        self.payment_data = payment_data
+        self.approvals = 0
+        self.lookups = 0
+
+    async def approve_payment(self, payment_id):
+        self.approvals += 1
+        return {"identifier": payment_id}
+
+    async def get_payment(self, payment_id):
+        self.lookups += 1
+        # Lets concurrent completions interleave
+        await asyncio.sleep(0)
+        if self.payment_data is None:
+            raise PiAPIError("not found", status_code=404)
+        return self.payment_data
+
+
+def verified_payment(payment_id="pay-1"):
+    return {
+        "identifier": payment_id,
+        "amount": 3.5,
+        "user_uid": "user-1",
+        "metadata": {"jobId": "job-1"},
+        "status": {"developer_approved": True, "transaction_verified": True},
+        "transaction": {"txid": "tx-1"},
+    }
+
+
+@pytest.fixture
+def completed():
+    """Payment IDs passed to the store's on_completed hook"""
+    return []
+
+
+@pytest.fixture
+async def service(db, completed):
+    async def on_completed(payment):
+        completed.append(payment["payment_id"])
+
+    store = PaymentStore(db.transactions, on_completed=on_completed)
+    await store.ensure_indexes()
+    return PaymentService(store, FakePiClient(verified_payment()))
+
+
+async def test_approval_is_idempotent(service):
+    first = await service.approve("pay-1")
+    second = await service.approve("pay-1")
+    assert first == second == {"payment_id": "pay-1", "status": APPROVED}
+    assert service.pi_client.approvals == 1
+
+
+async def test_duplicate_completion_completes_once(service, completed):
+    await service.approve("pay-1")
+    first = await service.complete("pay-1", "tx-1")
+    second = await service.complete("pay-1", "tx-1")
+
+    assert first == second
+    assert first["status"] == COMPLETED
+    assert first["amount"] == 3.5
+    assert completed == ["pay-1"]
+    assert await service.store.collection.count_documents({"payment_id": "pay-1"}) == 1
+    stored = await service.store.get("pay-1")
+    assert stored["status"] == COMPLETED
+    assert stored["job_id"] == "job-1"
+
+
+async def test_concurrent_completions_complete_once(service, completed):
+    await service.approve("pay-1")
+    results = await asyncio.gather(*(service.complete("pay-1", "tx-1") for _ in range(5)))
+
+    assert all(result["status"] == COMPLETED for result in results)
+    assert completed == ["pay-1"]
+
+
+async def test_completion_unknown_to_pi_fails_and_stays_failed(service, completed):
+    service.pi_client.payment_data = None
+    await service.approve("pay-1")
+    with pytest.raises(PaymentRejected):
+        await service.complete("pay-1", "tx-1")
+    assert (await service.store.get("pay-1"))["status"] == FAILED
+
+    # A later retry must not move it back to completing
+    service.pi_client.payment_data = verified_payment()
+    with pytest.raises(PaymentRejected):
+        await service.complete("pay-1", "tx-1")
+    assert (await service.store.get("pay-1"))["status"] == FAILED
+    assert completed == []
+
+
+async def test_finish_only_moves_completing_payments(service):
+    await service.approve("pay-1")
+    assert await service.store.finish("pay-1", verified_payment()) is None
+    assert (await service.store.get("pay-1"))["status"] == APPROVED
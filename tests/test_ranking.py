@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ranking import RankingEngine
+
+pytestmark = pytest.mark.anyio
+
+FEED_SORT = [("created_at", -1), ("id", -1)]
+
+
+async def make_engine(db, count, version=None):
+    now = datetime.now(timezone.utc)
+    await db.jobs.insert_many([
+        {
+            "id": f"job-{i}", "category": "garden", "payment": 10 + i, "location": "Tallinn",
+            "employer": "Acme", "employer_rating": 4.5, "status": "open",
+            "created_at": now - timedelta(days=i), "deadline": now + timedelta(days=7),
+        }
+        for i in range(count)
+    ])
+    engine = RankingEngine(db.jobs, db.swipes, FEED_SORT, query={"status": "open"}, version=version)
+    engine.start()
+    while not engine.ready:
+        await asyncio.sleep(0.01)
+    return engine
+
+
+def ids(jobs):
+    return [job["id"] for job in jobs]
+
+
+async def test_unswiped_jobs_come_back_once_the_deck_runs_out(db):
+    engine = await make_engine(db, 5)
+
+    first = ids(await engine.next_jobs("user", 3))
+    assert first == ["job-0", "job-1", "job-2"]
+    # Two unserved jobs left, then the deck starts over with the best unswiped one
+    assert ids(await engine.next_jobs("user", 3)) == ["job-3", "job-4", "job-0"]
+
+    engine.record("user", first[0], "reject")
+    for _ in range(3):
+        served = ids(await engine.next_jobs("user", 10))
+        assert sorted(served) == sorted(f"job-{i}" for i in range(5) if f"job-{i}" != first[0])
+    await engine.close()
+
+
+async def test_swiped_jobs_are_never_served_again(db):
+    engine = await make_engine(db, 3)
+    for job_id in ids(await engine.next_jobs("user", 3)):
+        engine.record("user", job_id, "accept")
+    assert await engine.next_jobs("user", 3) == []
+    await engine.close()
+
+
+async def test_new_jobs_version_restarts_the_deck(db):
+    version = 1
+
+    async def current_version():
+        return version
+
+    engine = await make_engine(db, 4, current_version)
+    assert ids(await engine.next_jobs("user", 3)) == ["job-0", "job-1", "job-2"]
+    assert ids(await engine.next_jobs("user", 1)) == ["job-3"]
+    assert ids(await engine.next_jobs("user", 2)) == ["job-0", "job-1"]
+
+    # New jobs may outrank the ones served, so the deck starts over before running out
+    version = 2
+    assert ids(await engine.next_jobs("user", 1)) == ["job-0"]
+    await engine.close()
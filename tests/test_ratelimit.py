@@ -0,0 +1,134 @@
+import asyncio
+
+import httpx
+import pytest
+from pymongo.errors import PyMongoError
+
+from ratelimit import (
+    AdmissionControlMiddleware, BucketStore, MemoryBucketStore, MongoBucketStore, RateLimit, RateLimitMiddleware,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def client_for(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limit_parse():
+    assert RateLimit.parse("5/20") == RateLimit(5.0, 20)
+    assert RateLimit.parse("0.5") == RateLimit(0.5, 1)
+
+
+async def test_bucket_empties_after_burst_and_refills_over_time():
+    clock = FakeClock()
+    store = MemoryBucketStore(clock=clock)
+    limit = RateLimit(rate=2.0, burst=3)
+
+    assert [await store.take("client", limit) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert await store.take("client", limit) == pytest.approx(0.5)
+
+    # Half a second refills one token
+    clock.now += 0.5
+    assert await store.take("client", limit) == 0.0
+    assert await store.take("client", limit) > 0
+
+    # Refilling stops at the burst size
+    clock.now += 60
+    assert [await store.take("client", limit) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert await store.take("client", limit) > 0
+
+
+async def test_buckets_are_per_key():
+    store = MemoryBucketStore(clock=FakeClock())
+    limit = RateLimit(rate=1.0, burst=1)
+    assert await store.take("a", limit) == 0.0
+    assert await store.take("a", limit) > 0
+    assert await store.take("b", limit) == 0.0
+
+
+async def test_middleware_answers_429_with_retry_after():
+    clock = FakeClock()
+    limited = RateLimitMiddleware(
+        ok,
+        limits={("POST", "/api/swipe"): RateLimit(rate=0.5, burst=1)},
+        store=MemoryBucketStore(clock=clock),
+    )
+    async with client_for(limited) as client:
+        assert (await client.post("/api/swipe")).status_code == 200
+        rejected = await client.post("/api/swipe")
+        assert rejected.status_code == 429
+        assert rejected.headers["retry-after"] == "2"
+        # Other routes are not limited
+        assert (await client.get("/api/jobs")).status_code == 200
+        clock.now += 2
+        assert (await client.post("/api/swipe")).status_code == 200
+
+
+def test_incomplete_store_fails_when_created():
+    class NoTake(BucketStore):
+        pass
+
+    with pytest.raises(TypeError):
+        NoTake()
+
+
+async def test_mongo_store_shares_buckets_between_instances(db):
+    limit = RateLimit(rate=1.0, burst=2)
+    first, second = MongoBucketStore(db.buckets), MongoBucketStore(db.buckets)
+    assert await first.take("client", limit) == 0.0
+    assert await second.take("client", limit) == 0.0
+    assert await first.take("client", limit) > 0
+    assert await second.take("other", limit) == 0.0
+
+
+async def test_limits_can_be_disabled_and_a_broken_store_fails_open():
+    class BrokenStore(BucketStore):
+        async def take(self, key, limit):
+            raise PyMongoError("down")
+
+    limits = {("POST", "/api/swipe"): RateLimit(rate=0.1, burst=1)}
+    store = MemoryBucketStore(clock=FakeClock())
+    async with client_for(RateLimitMiddleware(ok, limits, store=store, enabled=False)) as client:
+        assert [(await client.post("/api/swipe")).status_code for _ in range(3)] == [200, 200, 200]
+    async with client_for(RateLimitMiddleware(ok, limits, store=BrokenStore())) as client:
+        assert [(await client.post("/api/swipe")).status_code for _ in range(3)] == [200, 200, 200]
+
+
+async def test_admission_control_queues_then_sheds_with_503():
+    release = asyncio.Event()
+
+    async def slow(scope, receive, send):
+        await release.wait()
+        await ok(scope, receive, send)
+
+    admission = AdmissionControlMiddleware(slow, max_concurrent=1, max_queue=1, queue_timeout=5, exempt={"/health"})
+    async with client_for(admission) as client:
+        running = asyncio.ensure_future(client.get("/api/jobs"))
+        queued = asyncio.ensure_future(client.get("/api/jobs"))
+        while admission.active < 1 or len(admission._waiters) < 1:
+            await asyncio.sleep(0.01)
+
+        shed = await client.get("/api/jobs")
+        assert shed.status_code == 503
+        assert shed.headers["retry-after"] == "1"
+
+        release.set()
+        assert (await running).status_code == 200
+        assert (await queued).status_code == 200
+        assert admission.active == 0
+        # Exempt paths are never counted nor shed
+        assert (await client.get("/health")).status_code == 200
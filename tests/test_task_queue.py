@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from task_queue import DONE, FAILED, QUEUED, RUNNING, TaskQueue
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_claimed_task_is_hidden_until_its_lease_expires(db):
+    queue = TaskQueue(db.tasks, lease=0.2)
+    task = await queue.enqueue("work", {"n": 1})
+
+    claimed = await queue.claim("worker-a", ["work"])
+    assert claimed["_id"] == task["_id"]
+    assert claimed["status"] == RUNNING
+    assert claimed["attempts"] == 1
+    assert await queue.claim("worker-b", ["work"]) is None
+
+    await asyncio.sleep(0.25)
+    reclaimed = await queue.claim("worker-b", ["work"])
+    assert reclaimed["_id"] == task["_id"]
+    assert reclaimed["worker"] == "worker-b"
+    assert reclaimed["attempts"] == 2
+
+
+async def test_worker_whose_lease_was_taken_over_cannot_settle(db):
+    queue = TaskQueue(db.tasks, lease=0.1)
+    await queue.enqueue("work", {})
+    stale = await queue.claim("worker-a", ["work"])
+    await asyncio.sleep(0.15)
+    current = await queue.claim("worker-b", ["work"])
+
+    assert not await queue.renew(stale)
+    assert not await queue.complete(stale, {"by": "a"})
+    assert await queue.complete(current, {"by": "b"})
+    stored = await queue.get(current["_id"])
+    assert stored["status"] == DONE
+    assert stored["result"] == {"by": "b"}
+
+
+async def test_retry_hides_task_then_fails_after_max_attempts(db):
+    queue = TaskQueue(db.tasks, lease=30, max_attempts=2)
+    await queue.enqueue("work", {})
+
+    first = await queue.claim("worker", ["work"])
+    assert await queue.retry(first, "boom", delay=0)
+    assert (await queue.get(first["_id"]))["status"] == QUEUED
+
+    second = await queue.claim("worker", ["work"])
+    assert second["attempts"] == 2
+    assert await queue.retry(second, "boom again", delay=0)
+    stored = await queue.get(second["_id"])
+    assert stored["status"] == FAILED
+    assert stored["error"] == "boom again"
+    assert await queue.claim("worker", ["work"]) is None
+
+
+async def test_enqueue_deduplicates_and_requeues_failed_tasks(db):
+    queue = TaskQueue(db.tasks, lease=30, max_attempts=1)
+    await queue.ensure_indexes()
+    first = await queue.enqueue("work", {}, dedupe_key="payment-1")
+    again = await queue.enqueue("work", {}, dedupe_key="payment-1")
+    assert again["_id"] == first["_id"]
+
+    claimed = await queue.claim("worker", ["work"])
+    await queue.fail(claimed, "gave up")
+    requeued = await queue.enqueue("work", {}, dedupe_key="payment-1")
+    assert requeued["_id"] == first["_id"]
+    assert requeued["status"] == QUEUED
+    assert requeued["attempts"] == 0